@@ -39,6 +39,9 @@ import requests
 # Add parent directory to path to import pipeline
 sys.path.insert(0, '/app')
 
+from parsers.dat_decoder import parse_time_bound
+from parsers.block_sinks import parse_targets
+
 # Configure logging with rotation (50MB max, 5 backups = ~300MB total)
 LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(50 * 1024 * 1024)))  # 50MB
 LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
@@ -579,15 +582,21 @@ def run_perfmonkey_parser_sync(job_id: str, archive_path: Path):
             logger.warning(f"Job {job_id}: Failed to cleanup {archive_path}: {e}")
 
 
-def run_pipeline_sync(job_id: str, archive_path: Path):
+def run_pipeline_sync(job_id: str, archive_path: Path, time_from: Optional[int] = None,
+                      time_to: Optional[int] = None, targets: tuple = ("grafana",)):
     """Run the Huawei processing pipeline synchronously.
     
     Поддерживает .zip и .7z архивы - streaming_pipeline.py умеет работать с обоими форматами.
+    time_from/time_to (epoch-секунды) - окно импорта, блоки вне окна не декодируются.
+    targets: выходы одного прохода декодирования - кроме 'grafana' (VictoriaMetrics)
+    'csv' и 'perfmonkey' пишут CSV в WORK_DIR/job_id (как отдельные CSV jobs).
     """
     import subprocess
     
     start_time = time.time()
     process = None
+    job_dir = WORK_DIR / job_id
+    file_targets = [t for t in targets if t != "grafana"]
     
     try:
         jobs[job_id]["status"] = "running"
@@ -605,6 +614,13 @@ def run_pipeline_sync(job_id: str, archive_path: Path):
             "--batch-size", "50000",
             "--all-metrics"
         ]
+        if file_targets:
+            job_dir.mkdir(parents=True, exist_ok=True)
+            cmd += ["--targets", ",".join(targets), "-o", str(job_dir)]
+        if time_from is not None:
+            cmd += ["--from", str(time_from)]
+        if time_to is not None:
+            cmd += ["--to", str(time_to)]
         
         logger.info(f"Job {job_id}: Running command: {' '.join(cmd)}")
         
@@ -646,11 +662,19 @@ def run_pipeline_sync(job_id: str, archive_path: Path):
         if return_code == 0:
             # НЕ устанавливаем status="done" сразу! Сначала получаем grafana_url,
             # потому что frontend прекращает polling когда видит status="done"
+            if file_targets:
+                jobs[job_id]["progress"] = 90
+                jobs[job_id]["message"] = "Compressing CSV files..."
+                jobs[job_id]["updated_at"] = datetime.now().isoformat()
+                
+                gzip_csv_files(job_dir)
+                jobs[job_id]["files"] = get_job_files(job_id)
+            
             jobs[job_id]["progress"] = 95
             jobs[job_id]["message"] = "Generating Grafana link..."
             
             sn_list = jobs[job_id]["serial_numbers"]
-            if sn_list:
+            if sn_list and "grafana" in targets:
                 # Формируем ссылку на Grafana с временным диапазоном данных
                 grafana_dashboard = f"{GRAFANA_URL}/d/huawei-oceanstor-real/huawei-oceanstor-real-data"
                 sn = sn_list[0]  # Берём первый SN
@@ -792,10 +816,11 @@ def run_pipeline_sync(job_id: str, archive_path: Path):
             pass
 
 
-async def run_pipeline_async(job_id: str, archive_path: Path):
+async def run_pipeline_async(job_id: str, archive_path: Path, time_from: Optional[int] = None,
+                             time_to: Optional[int] = None, targets: tuple = ("grafana",)):
     """Async wrapper to run pipeline in thread pool."""
     loop = asyncio.get_event_loop()
-    await loop.run_in_executor(executor, run_pipeline_sync, job_id, archive_path)
+    await loop.run_in_executor(executor, run_pipeline_sync, job_id, archive_path, time_from, time_to, targets)
 
 
 async def run_csv_parser_async(job_id: str, archive_path: Path):
@@ -831,18 +856,42 @@ async def health():
 async def upload_file(
     background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
-    target: str = Form("grafana")  # grafana | csv | perfmonkey
+    target: str = Form("grafana"),  # grafana | csv | perfmonkey | all | comma-separated list
+    time_from: Optional[str] = Form(None),
+    time_to: Optional[str] = Form(None)
 ):
     """Upload ZIP or 7Z archive with chunked progress tracking.
     
     Args:
         file: ZIP or 7Z archive with .tgz files
-        target: Processing target - 'grafana', 'csv' (wide format), or 'perfmonkey' (perfmonkey format)
+        target: Processing target - 'grafana', 'csv' (wide format), or 'perfmonkey' (perfmonkey format);
+                'all' or a comma-separated list (e.g. 'grafana,csv') runs one decoding pass
+                feeding every listed output
+        time_from: Start of import window (epoch seconds or ISO 8601, UTC if no TZ), grafana
+                   and combined targets only
+        time_to: End of import window (exclusive), grafana and combined targets only
     """
     
     # Validate target
-    if target not in ["grafana", "csv", "perfmonkey"]:
-        raise HTTPException(status_code=400, detail="Invalid target. Must be 'grafana', 'csv', or 'perfmonkey'")
+    try:
+        targets = parse_targets(target)
+    except ValueError:
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid target. Must be 'grafana', 'csv', 'perfmonkey', 'all' or a comma-separated list of them"
+        )
+    target = ",".join(targets)
+    
+    # Validate time window
+    try:
+        window_from = parse_time_bound(time_from) if time_from else None
+        window_to = parse_time_bound(time_to) if time_to else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid time_from/time_to. Use epoch seconds or ISO 8601")
+    if window_from is not None and window_to is not None and window_from >= window_to:
+        raise HTTPException(status_code=400, detail="time_from must be earlier than time_to")
+    if (window_from is not None or window_to is not None) and target in ["csv", "perfmonkey"]:
+        raise HTTPException(status_code=400, detail="time_from/time_to are supported only for target 'grafana' and combined targets")
     
     # Поддержка .zip и .7z архивов
     filename_lower = file.filename.lower()
@@ -916,12 +965,18 @@ async def upload_file(
             "error": None,
             "filename": file.filename,
             "target": target,
+            "time_from": window_from,
+            "time_to": window_to,
             "files": []
         }
         
         # Start appropriate background task based on target
-        if target == "grafana":
-            background_tasks.add_task(run_pipeline_async, job_id, upload_path)
+        if len(targets) > 1:
+            # Один проход декодирования на все выходы (streaming_pipeline --targets)
+            background_tasks.add_task(run_pipeline_async, job_id, upload_path, window_from, window_to, targets)
+            message_suffix = f"processing started (single pass: {' + '.join(targets)})"
+        elif target == "grafana":
+            background_tasks.add_task(run_pipeline_async, job_id, upload_path, window_from, window_to)
             message_suffix = "processing started (VictoriaMetrics)"
         elif target == "csv":
             background_tasks.add_task(run_csv_parser_async, job_id, upload_path)
@@ -1109,9 +1164,10 @@ async def list_csv_jobs():
     """Get list of all CSV processing jobs with their files."""
     csv_jobs = []
     
-    # Filter only CSV and perfmonkey jobs
+    # Filter only jobs with CSV outputs (csv, perfmonkey and combined targets)
     for job_id, job_data in jobs.items():
-        if job_data.get("target") in ["csv", "perfmonkey"]:
+        job_targets = job_data.get("target", "grafana").split(",")
+        if "csv" in job_targets or "perfmonkey" in job_targets:
             files = get_job_files(job_id)
             
             # Determine serial numbers from filenames if not in job_data
@@ -1126,7 +1182,11 @@ async def list_csv_jobs():
             csv_jobs.append({
                 "job_id": job_id,
                 "target": job_data.get("target"),
-                "target_label": "CSV Wide" if job_data.get("target") == "csv" else "CSV Perfmonkey",
+                "target_label": (
+                    "CSV Wide" if job_targets == ["csv"]
+                    else "CSV Perfmonkey" if job_targets == ["perfmonkey"]
+                    else "Combined (" + " + ".join(job_targets) + ")"
+                ),
                 "serial_numbers": serial_numbers,
                 "status": job_data.get("status"),
                 "created_at": job_data.get("created_at"),
@@ -4,5 +4,14 @@
 #   - streaming_pipeline: Streaming парсер → VictoriaMetrics
 #   - csv_wide_parser: CSV парсер (wide format)
 #   - perfmonkey_parser: Perfmonkey формат парсер
+#   - dat_decoder: Общий декодер бинарных .dat файлов (numpy)
+#   - dat_index: Индекс header-блоков .dat (sidecar .blockidx.json)
+#   - block_cache: Кэш декодированных блоков (.npz) для повторных выгрузок
+#   - import_ledger: Журнал импортированных .tgz (пропуск повторных загрузок)
+#   - block_sinks: Выходы CSV/PerfMonkey для режима одного прохода (--targets)
+#   - vm_sender: Отправка в VictoriaMetrics через пул keep-alive соединений
+#   - ingest_controller: AIMD-контроллер нагрузки на VictoriaMetrics (--adaptive)
+#   - block_dedup: Индекс импортированных блоков по SN (пропуск перекрывающихся архивов)
+#   - pipeline_metrics: Время стадий pipeline → huperf_pipeline_* в VictoriaMetrics
 #   - dictionaries: Словари метрик и ресурсов
 
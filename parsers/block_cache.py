@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""
+BLOCK CACHE: кэш декодированных блоков .dat (колоночный, .npz).
+
+Первый проход по источнику (.tgz, .dat или ZipMember) декодирует блоки как
+обычно и попутно пишет их в кэш; повторная выгрузка того же архива в другой
+target (Grafana, CSV, perfmonkey) читает готовые int32 массивы без gunzip и
+разбора карт - упирается в диск, а не в CPU.
+
+Раскладка:
+    <cache_dir>/<SN>/<file>.<digest>.blocks.npz
+
+Один .npz (zip без сжатия из .npy) на исходный файл: digest считается от
+имени и отпечатка источника (размер + mtime, для ZipMember - размер + CRC),
+изменённый файл получает новый кэш. Внутри:
+    manifest.npy  - JSON (uint8): версия, отпечаток, описание колонок
+                    (layouts: ObjectType, IDs, Names, DataTypes), заголовки,
+                    номера и смещения блоков в .dat
+    b<N>_g<M>.npy - сэмплы группы M (один ресурс) блока N: (rows × series группы)
+
+Ресурсы лежат отдельными массивами, поэтому выгрузка с выборкой ресурсов
+читает с диска только их; окно --from/--to отбирает блоки по заголовкам из
+manifest, не открывая остальные массивы.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import zipfile
+from pathlib import Path
+from typing import Callable, Collection, Generator, Optional, Tuple, Union
+
+import numpy as np
+
+try:
+    from .dat_decoder import (
+        SAMPLE_DTYPE, DataBlock, DatSource, ZipMember, block_overlaps_window, block_part,
+        dat_source_size, iter_dat_blocks, open_dat_source, restore_block_layout,
+    )
+    from .dat_index import (
+        BLOCK_INDEX_DIR, block_index_entry, block_index_path, iter_indexed_blocks,
+        load_block_index, save_block_index, select_indexed_blocks, source_fingerprint,
+    )
+    from .pipeline_metrics import stage
+except ImportError:
+    from dat_decoder import (
+        SAMPLE_DTYPE, DataBlock, DatSource, ZipMember, block_overlaps_window, block_part,
+        dat_source_size, iter_dat_blocks, open_dat_source, restore_block_layout,
+    )
+    from dat_index import (
+        BLOCK_INDEX_DIR, block_index_entry, block_index_path, iter_indexed_blocks,
+        load_block_index, save_block_index, select_indexed_blocks, source_fingerprint,
+    )
+    from pipeline_metrics import stage
+
+logger = logging.getLogger(__name__)
+
+BLOCK_CACHE_VERSION = 2
+BLOCK_CACHE_SUFFIX = '.blocks.npz'
+MANIFEST_KEY = 'manifest'
+
+# Каталог кэша декодированных блоков; пусто - кэш выключен
+BLOCK_CACHE_DIR = os.getenv("BLOCK_CACHE_DIR", "")
+
+
+def _array_sn(source: DatSource) -> str:
+    """Серийный номер массива из имени файла (каталог кэша)."""
+    match = re.search(r"_SN_([0-9A-Z]+)_SP\d+", source.name)
+    return match.group(1) if match else "UNKNOWN_SN"
+
+
+def block_cache_path(source: DatSource, fingerprint: dict, cache_dir: Union[str, Path]) -> Path:
+    """Путь к .npz кэшу источника: <cache_dir>/<SN>/<file>.<digest>.blocks.npz"""
+    source_key = json.dumps([source.name, fingerprint], sort_keys=True)
+    digest = hashlib.blake2b(source_key.encode('utf-8'), digest_size=8).hexdigest()
+    return Path(cache_dir) / _array_sn(source) / f"{source.name}.{digest}{BLOCK_CACHE_SUFFIX}"
+
+
+def _write_array(zip_file: zipfile.ZipFile, key: str, array: np.ndarray):
+    with zip_file.open(key + '.npy', 'w', force_zip64=True) as f:
+        np.lib.format.write_array(f, np.ascontiguousarray(array), allow_pickle=False)
+
+
+class BlockCacheWriter:
+    """
+    Потоковая запись блоков в .npz: массивы пишутся по мере декодирования,
+    manifest - в commit(). Файл появляется атомарно (tmp + rename), поэтому
+    параллельные workers и прерванный проход не оставляют битый кэш.
+    """
+
+    def __init__(self, cache_path: Path, fingerprint: dict):
+        self.cache_path = cache_path
+        self.tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+        self.manifest = {
+            'version': BLOCK_CACHE_VERSION,
+            'source': fingerprint,
+            'layouts': {},
+            'blocks': [],
+        }
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        self.zip_file = zipfile.ZipFile(self.tmp_path, 'w', compression=zipfile.ZIP_STORED)
+
+    def add(self, block: DataBlock):
+        layout = block.layout
+        if layout.layout_hash not in self.manifest['layouts']:
+            self.manifest['layouts'][layout.layout_hash] = [
+                [group.object_type, group.ids, group.names, group.data_types]
+                for group in layout.groups
+            ]
+
+        block_number = len(self.manifest['blocks'])
+        for group_number, group in enumerate(layout.groups):
+            _write_array(self.zip_file, f"b{block_number}_g{group_number}",
+                         block.values[:, group.offset:group.offset + group.series_count])
+        self.manifest['blocks'].append({
+            'header': block.header,
+            'layout': layout.layout_hash,
+            'rows': block.rows,
+            'number': block.number,
+            'offset': block.offset,
+        })
+
+    def commit(self):
+        manifest = json.dumps(self.manifest, separators=(',', ':')).encode('utf-8')
+        _write_array(self.zip_file, MANIFEST_KEY, np.frombuffer(manifest, dtype=np.uint8))
+        self.zip_file.close()
+        os.replace(self.tmp_path, self.cache_path)
+
+    def discard(self):
+        self.zip_file.close()
+        if self.tmp_path.exists():
+            self.tmp_path.unlink()
+
+
+def load_block_cache(cache_path: Path, fingerprint: dict) -> Optional[Tuple[np.lib.npyio.NpzFile, dict]]:
+    """Открыть .npz кэш -> (npz, manifest); None - если его нет, он устарел или повреждён."""
+    try:
+        npz = np.load(cache_path, allow_pickle=False)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, zipfile.BadZipFile) as e:
+        logger.warning(f"Ignoring broken block cache {cache_path}: {e}")
+        return None
+
+    try:
+        manifest = json.loads(npz[MANIFEST_KEY].tobytes())
+        if manifest.get('version') == BLOCK_CACHE_VERSION and manifest.get('source') == fingerprint:
+            return npz, manifest
+    except (KeyError, ValueError, zipfile.BadZipFile) as e:
+        logger.warning(f"Ignoring broken block cache {cache_path}: {e}")
+    npz.close()
+    return None
+
+
+def iter_cached_blocks(npz: np.lib.npyio.NpzFile, manifest: dict,
+                       resources: Optional[Collection[str]] = None,
+                       time_from: Optional[int] = None, time_to: Optional[int] = None,
+                       part: int = 0, parts: int = 1, start_block: int = 0,
+                       skip_block: Optional[Callable[[dict, str], bool]] = None,
+                       dat_size: Optional[int] = None) -> Generator[DataBlock, None, None]:
+    """
+    Блоки из .npz кэша - с теми же окном, частями, start_block и skip_block, что iter_dat_blocks.
+
+    Args:
+        npz, manifest: Кэш, открытый load_block_cache
+        resources: ID ресурсов (ObjectType), которые нужно прочитать с диска;
+                   колонки остальных ресурсов в values заполнены нулями.
+                   None - читать все
+        dat_size: Размер .dat потока источника - нужен при parts > 1
+    """
+    if parts > 1 and dat_size is None:
+        raise ValueError("dat_size is required to split a .dat file into parts")
+    layouts = {}
+
+    for block_number, entry in enumerate(manifest['blocks']):
+        data_header = entry['header']
+        # Номер блока в .dat (пустые блоки в кэш не попадают)
+        number = entry['number']
+        if ((parts > 1 and block_part(entry['offset'], dat_size, parts) != part) or number < start_block
+                or not block_overlaps_window(data_header, time_from, time_to)
+                or (skip_block is not None and skip_block(data_header, entry['layout']))):
+            continue
+
+        layout = layouts.get(entry['layout'])
+        if layout is None:
+            layout = restore_block_layout(entry['layout'], manifest['layouts'][entry['layout']])
+            layouts[entry['layout']] = layout
+
+        loaded = [
+            (group_number, group) for group_number, group in enumerate(layout.groups)
+            if resources is None or group.object_type in resources
+        ]
+        allocate = np.empty if len(loaded) == len(layout.groups) else np.zeros
+        values = allocate((entry['rows'], layout.series_count), dtype=SAMPLE_DTYPE)
+        # Чтение и распаковка массивов .npz - то же, что чтение .dat (pipeline_metrics)
+        with stage('extract'):
+            for group_number, group in loaded:
+                values[:, group.offset:group.offset + group.series_count] = \
+                    npz[f"b{block_number}_g{group_number}"]
+
+        block = DataBlock(header=dict(data_header), layout=layout, values=values,
+                          number=number, offset=entry['offset'])
+        if time_from is not None or time_to is not None:
+            block = block.window(time_from, time_to)
+        if block.rows:
+            yield block
+
+
+def _iter_dat_source(source: DatSource, time_from: Optional[int] = None,
+                     time_to: Optional[int] = None, part: int = 0, parts: int = 1,
+                     start_block: int = 0, skip_block: Optional[Callable[[dict, str], bool]] = None,
+                     dat_size: Optional[int] = None,
+                     index_dir: Optional[Union[str, Path]] = None) -> Generator[DataBlock, None, None]:
+    """
+    Блоки источника без .npz кэша.
+
+    Частичный проход (окно, часть файла, start_block, skip_block) при
+    актуальном индексе блоков (dat_index) читает только отобранные по нему
+    блоки и заканчивает чтение на последнем из них. Полный проход попутно
+    записывает индекс, если его ещё нет, - только в каталог индексов
+    (index_dir или BLOCK_INDEX_DIR): рядом с исходными файлами ничего не
+    создаётся.
+    """
+    index_dir = index_dir or BLOCK_INDEX_DIR
+    index_path = block_index_path(source, index_dir)
+    fingerprint = source_fingerprint(source)
+    entries = load_block_index(index_path, fingerprint)
+
+    if (time_from is not None or time_to is not None or parts > 1 or start_block > 0
+            or skip_block is not None):
+        with open_dat_source(source) as fin:
+            if entries is None:
+                yield from iter_dat_blocks(fin, time_from=time_from, time_to=time_to,
+                                           part=part, parts=parts, start_block=start_block,
+                                           skip_block=skip_block, dat_size=dat_size)
+                return
+
+            selected = select_indexed_blocks(entries, time_from, time_to, part, parts,
+                                             start_block, skip_block, dat_size)
+            for block in iter_indexed_blocks(fin, selected):
+                if time_from is not None or time_to is not None:
+                    block = block.window(time_from, time_to)
+                if block.rows:
+                    yield block
+        return
+
+    build_index = entries is None and bool(index_dir)
+    new_entries = []
+    with open_dat_source(source) as fin:
+        for block in iter_dat_blocks(fin):
+            if build_index:
+                new_entries.append(block_index_entry(block))
+            yield block
+
+    if build_index and save_block_index(index_path, fingerprint, new_entries):
+        logger.debug(f"Indexed {len(new_entries)} blocks of {source.name} -> {index_path}")
+
+
+def iter_source_blocks(source: DatSource, cache_dir: Optional[Union[str, Path]] = None,
+                       resources: Optional[Collection[str]] = None,
+                       time_from: Optional[int] = None, time_to: Optional[int] = None,
+                       part: int = 0, parts: int = 1, start_block: int = 0,
+                       skip_block: Optional[Callable[[dict, str], bool]] = None,
+                       index_dir: Optional[Union[str, Path]] = None) -> Generator[DataBlock, None, None]:
+    """
+    Блоки источника через кэш декодированных блоков.
+
+    Без кэша (cache_dir и BLOCK_CACHE_DIR пусты) - то же, что
+    open_dat_source + iter_dat_blocks; частичный проход идёт по индексу
+    блоков (dat_index), если полный проход уже записал его в index_dir
+    (или BLOCK_INDEX_DIR). Есть актуальный кэш - блоки читаются из него.
+    Нет кэша - файл декодируется и кэш пишется
+    попутно; только при полном проходе (без окна, без деления на части, с
+    первого блока и без skip_block), чтобы кэш не оказался неполным.
+    """
+    cache_dir = cache_dir or BLOCK_CACHE_DIR
+    if not isinstance(source, ZipMember):
+        source = Path(source)
+    # Границы частей - по размеру .dat, одинаково для файла и кэша
+    dat_size = dat_source_size(source) if parts > 1 else None
+    if not cache_dir:
+        yield from _iter_dat_source(source, time_from, time_to, part, parts, start_block,
+                                    skip_block, dat_size, index_dir)
+        return
+
+    fingerprint = source_fingerprint(source)
+    cache_path = block_cache_path(source, fingerprint, cache_dir)
+
+    cached = load_block_cache(cache_path, fingerprint)
+    if cached is not None:
+        npz, manifest = cached
+        with npz:
+            yield from iter_cached_blocks(npz, manifest, resources, time_from, time_to, part, parts,
+                                          start_block, skip_block, dat_size)
+        return
+
+    if (time_from is not None or time_to is not None or parts > 1 or start_block > 0
+            or skip_block is not None):
+        yield from _iter_dat_source(source, time_from, time_to, part, parts, start_block,
+                                    skip_block, dat_size, index_dir)
+        return
+
+    try:
+        writer = BlockCacheWriter(cache_path, fingerprint)
+    except OSError as e:
+        logger.warning(f"Could not create block cache {cache_path}: {e}")
+        writer = None
+
+    try:
+        for block in _iter_dat_source(source):
+            if writer is not None:
+                try:
+                    writer.add(block)
+                except OSError as e:
+                    logger.warning(f"Could not write block cache {cache_path}: {e}")
+                    writer.discard()
+                    writer = None
+            yield block
+
+        if writer is not None:
+            try:
+                writer.commit()
+                logger.info(f"Cached decoded blocks of {source.name} -> {cache_path}")
+            except OSError as e:
+                logger.warning(f"Could not write block cache {cache_path}: {e}")
+                writer.discard()
+            writer = None
+    finally:
+        # Прерванный проход (ошибка, закрытый генератор) не оставляет кэш
+        if writer is not None:
+            writer.discard()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+BLOCK DEDUP: индекс уже импортированных header-блоков по SN массива.
+
+Заказчики присылают перекрывающиеся архивы (каждый день - последние 7 дней):
+в новом Perf_*.zip другие .tgz (журнал импортов их не узнаёт), но большая
+часть блоков в них та же. Индекс хранит ключи блоков, которые уже приняты VM:
+    (CtrlID, StartTime, Archive, layout_hash)
+и stream_prometheus_metrics пропускает такие блоки по заголовку, без
+декодирования - повторная выгрузка стоит только новых блоков. Archive в
+ключе: архивы 60s и 300s одного контроллера могут начинаться одновременно.
+
+В индекс попадают только блоки, отданные целиком: обрезанный последний блок
+(дамп снят посреди интервала) и блоки, срезанные окном --from/--to, при
+следующей выгрузке импортируются снова.
+
+Раскладка - JSON Lines на SN, только дописывание (одна строка на
+импортированный файл или часть, одной записью write - workers пишут
+одновременно):
+    <index_dir>/<SN>.jsonl
+    {"target": "http://vm:8428/api/v1/import/prometheus",
+     "blocks": [["1129", 1664312040, 60, "9f2c…"], ...], "imported_at": "..."}
+"""
+
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Set, Tuple, Union
+
+try:
+    from .dat_decoder import DataBlock, block_times_collect
+except ImportError:
+    from dat_decoder import DataBlock, block_times_collect
+
+logger = logging.getLogger(__name__)
+
+# Каталог индекса импортированных блоков; пусто - дедупликация выключена
+IMPORTED_BLOCKS_DIR = os.getenv("IMPORTED_BLOCKS_DIR", "")
+
+BlockKey = Tuple[str, int, int, str]
+
+
+def block_key(data_header: dict, layout_hash: str) -> BlockKey:
+    """Ключ блока: (CtrlID, StartTime, Archive, layout_hash)."""
+    return (str(data_header['CtrlID']), int(data_header['StartTime']),
+            int(data_header['Archive']), layout_hash)
+
+
+class ImportedBlockIndex:
+    """
+    Индекс импортированных блоков в каталоге index_dir (файл на SN).
+
+    Файл SN читается при первом обращении и дочитывается, если вырос
+    (другой worker дописал блоки) - как ImportLedger.
+    """
+
+    def __init__(self, index_dir: Union[str, Path]):
+        self.index_dir = Path(index_dir)
+        # {SN: (offset, {target: set ключей})}
+        self._loaded: Dict[str, Tuple[int, Dict[str, Set[BlockKey]]]] = {}
+
+    def path(self, array_sn: str) -> Path:
+        return self.index_dir / f"{array_sn}.jsonl"
+
+    def imported(self, array_sn: str, target: str) -> Set[BlockKey]:
+        """Ключи блоков SN, уже импортированных в target."""
+        offset, targets = self._loaded.get(array_sn, (0, {}))
+        path = self.path(array_sn)
+        try:
+            if path.stat().st_size > offset:
+                with open(path, 'rb') as f:
+                    f.seek(offset)
+                    data = f.read()
+                # Недописанная последняя строка дочитается в следующий раз
+                complete = data.rfind(b'\n') + 1
+                offset += complete
+                for line in data[:complete].splitlines():
+                    try:
+                        entry = json.loads(line)
+                        targets.setdefault(entry['target'], set()).update(
+                            (str(ctrl_id), int(start), int(archive), str(layout_hash))
+                            for ctrl_id, start, archive, layout_hash in entry['blocks']
+                        )
+                    except (ValueError, KeyError, TypeError):
+                        logger.warning(f"Skipping broken block index line in {path}: {line[:200]!r}")
+        except FileNotFoundError:
+            pass
+        self._loaded[array_sn] = (offset, targets)
+        return targets.get(target, set())
+
+    def record(self, array_sn: str, target: str, keys: List[BlockKey]) -> bool:
+        """Дописать ключи блоков, принятых target (одна строка)."""
+        if not keys:
+            return True
+        entry = {
+            'target': target,
+            'blocks': [list(key) for key in keys],
+            'imported_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        }
+        line = (json.dumps(entry, separators=(',', ':')) + '\n').encode('utf-8')
+        path = self.path(array_sn)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # O_APPEND + один write: строки параллельных workers не перемешиваются
+            fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+        except OSError as e:
+            logger.warning(f"Could not write block index {path}: {e}")
+            return False
+        return True
+
+    def session(self, array_sn: str, target: str, skip_known: bool = True) -> 'ImportedBlocks':
+        """Фильтр блоков для одного импорта SN в target; skip_known=False (--force) - только записать."""
+        return ImportedBlocks(self, array_sn, target, skip_known)
+
+
+class ImportedBlocks:
+    """
+    Дедупликация блоков одного импорта (файла или части) SN в target.
+
+    Вызов (data_header, layout_hash) -> True - блок уже импортирован,
+    пропустить (skip_block для iter_source_blocks). add(block) копит ключи
+    отданных целиком блоков, commit() пишет их в индекс - после того, как
+    VM принял все батчи.
+    """
+
+    def __init__(self, index: ImportedBlockIndex, array_sn: str, target: str, skip_known: bool = True):
+        self.index = index
+        self.array_sn = array_sn
+        self.target = target
+        self.known = index.imported(array_sn, target) if skip_known else set()
+        self.skipped = 0
+        self.pending: List[BlockKey] = []
+
+    def __call__(self, data_header: dict, layout_hash: str) -> bool:
+        if block_key(data_header, layout_hash) in self.known:
+            self.skipped += 1
+            return True
+        return False
+
+    def add(self, block: DataBlock):
+        # Обрезанный или срезанный окном блок импортирован не весь (у среза
+        # окном заголовок сдвинут на оставленные строки - ключ был бы чужой)
+        if not block.windowed and block.rows == block_times_collect(block.header):
+            self.pending.append(block_key(block.header, block.layout.layout_hash))
+
+    def commit(self) -> bool:
+        keys, self.pending = self.pending, []
+        return self.index.record(self.array_sn, self.target, keys)
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+BLOCK SINKS: файловые выходы комбинированного режима streaming_pipeline.
+
+С --targets grafana,csv,perfmonkey (или all) worker декодирует блоки .dat
+один раз и раздаёт каждый блок всем выходам сразу: VictoriaMetrics (батчи
+Prometheus строк), long CSV (формат csv_wide_parser, <SN>.csv) и wide CSV
+PerfMonkey (формат perfmonkey_parser). Вместо трёх проходов по архиву -
+один, и декодирование не повторяется для каждого target.
+
+Форматирование блока в long CSV живёт здесь и используется csv_wide_parser,
+поэтому вывод обоих путей совпадает. Модуль без побочных эффектов при импорте
+(csv_wide_parser перенастраивает logging), perfmonkey_parser импортируется
+лениво - только если выход PerfMonkey включён.
+"""
+
+import logging
+from pathlib import Path
+from typing import Collection, List, Optional, Tuple, Union
+
+try:
+    from .dictionaries import METRIC_NAME_DICT, RESOURCE_NAME_DICT, METRIC_CONVERSION
+    from .dat_decoder import DataBlock, format_timestamps, get_column_index
+except ImportError:
+    from dictionaries import METRIC_NAME_DICT, RESOURCE_NAME_DICT, METRIC_CONVERSION
+    from dat_decoder import DataBlock, format_timestamps, get_column_index
+
+logger = logging.getLogger(__name__)
+
+# Выходы комбинированного режима (grafana - импорт в VictoriaMetrics)
+SINK_TARGETS = ('grafana', 'csv', 'perfmonkey')
+
+CSV_TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"  # UTC
+
+
+def parse_targets(value: str) -> Tuple[str, ...]:
+    """'all' или список через запятую ('grafana,csv') -> кортеж выходов в порядке SINK_TARGETS."""
+    names = {name.strip().lower() for name in value.split(',') if name.strip()}
+    if 'all' in names:
+        return SINK_TARGETS
+    unknown = names - set(SINK_TARGETS)
+    if unknown or not names:
+        raise ValueError(
+            f"Unknown targets: {', '.join(sorted(unknown)) or repr(value)} "
+            f"(expected: all or a comma-separated list of {', '.join(SINK_TARGETS)})"
+        )
+    return tuple(target for target in SINK_TARGETS if target in names)
+
+
+def _perfmonkey_parser():
+    """perfmonkey_parser импортируется только когда выход PerfMonkey включён."""
+    try:
+        from . import perfmonkey_parser
+    except ImportError:
+        from parsers import perfmonkey_parser
+    return perfmonkey_parser
+
+
+def create_perfmonkey_output(output_dir: Union[str, Path], manager) -> dict:
+    """Заголовки CSV PerfMonkey и locks на файл ресурса (до запуска workers); -> file_locks."""
+    perfmonkey = _perfmonkey_parser()
+    perfmonkey.create_csv_headers(Path(output_dir))
+    return {resource_id: manager.Lock() for resource_id in perfmonkey.RESOURCE_CONFIG}
+
+
+def finish_perfmonkey_output(output_dir: Union[str, Path]):
+    """Сортировка и перенумерация строк CSV PerfMonkey (после всех workers)."""
+    _perfmonkey_parser().sort_and_renumber_csv_files(Path(output_dir))
+
+
+def csv_block_lines(block: DataBlock, columns, unknown_resources: set = None,
+                    unknown_metrics: set = None) -> List[str]:
+    """
+    Строки long CSV для выбранных колонок блока:
+        resource;metric;element;value;time (UTC);epoch
+
+    unknown_resources / unknown_metrics: если переданы, в них собираются ID,
+    которых нет в словарях (для логирования)
+    """
+    csv_lines = []
+
+    # Время строк (UTC) рендерим один раз на блок, а не на каждую серию
+    timestamps_ms = block.timestamps_ms
+    time_strings = format_timestamps(timestamps_ms, CSV_TIME_FORMAT)
+    time_epochs = [str(ts / 1000) for ts in timestamps_ms.tolist()]
+
+    for column, series_values in zip(columns.tolist(), block.select(columns)):
+        resource_id, metric_id, element = block.list_data_type[column]
+
+        # Проверяем, известны ли ID
+        resource_name = RESOURCE_NAME_DICT.get(resource_id, f"UNKNOWN_RESOURCE_{resource_id}")
+        metric_name = METRIC_NAME_DICT.get(metric_id, f"UNKNOWN_METRIC_{metric_id}")
+
+        # Собираем ТОЛЬКО те ID, которых НЕТ в словарях (для логирования)
+        if unknown_resources is not None and resource_id not in RESOURCE_NAME_DICT:
+            unknown_resources.add(resource_id)
+        if unknown_metrics is not None and metric_id not in METRIC_NAME_DICT:
+            unknown_metrics.add(metric_id)
+
+        str_to_csv = resource_name + ';' + metric_name + ';' + element + ';'
+        # Конверсия единиц измерения (KB/s→MB/s, us→ms) для метрик, где сырые данные в других единицах
+        factor = METRIC_CONVERSION.get(metric_id)
+        for point_value, time_string, time_qqq in zip(
+            series_values.tolist(), time_strings, time_epochs
+        ):
+            value = float(point_value)
+            if factor is not None:
+                value = value / factor
+
+            csv_lines.append(f'{str_to_csv}{value};{time_string};{time_qqq}\n')
+
+    return csv_lines
+
+
+class CsvSink:
+    """
+    Long CSV одного .tgz (или его части): строки копятся в памяти и в close()
+    дописываются в <output_dir>/<SN>.csv - как process_single_tgz_file в
+    csv_wide_parser.
+
+    error: выставляется, если проход по блокам прервался ошибкой - тогда
+    close() ничего не пишет (неполный файл хуже отсутствующего).
+    """
+
+    target = 'csv'
+
+    def __init__(self, output_dir: Union[str, Path], serial_number: str,
+                 resources: Collection[str], metrics: Collection[str]):
+        self.output_file = Path(output_dir) / f'{serial_number}.csv'
+        self.resources = frozenset(resources)
+        self.metrics = frozenset(metrics)
+        self.lines = []
+        self.unknown_resources = set()
+        self.unknown_metrics = set()
+        self.error = None
+
+    def add_block(self, block: DataBlock):
+        # Та же выборка и тот же ключ индекса колонок, что у VictoriaMetrics выхода
+        resources, metrics = self.resources, self.metrics
+        columns = get_column_index(
+            block.layout, (resources, metrics),
+            lambda resource_id, metric_id: resource_id in resources and metric_id in metrics
+        )
+        self.lines.extend(csv_block_lines(block, columns, self.unknown_resources, self.unknown_metrics))
+
+    def close(self, source_name: str = '') -> Optional[int]:
+        """Дописать строки в CSV; число строк или None, если проход был с ошибкой."""
+        if self.error is not None:
+            self.lines = []
+            return None
+
+        if self.unknown_resources:
+            logger.warning(f"Found {len(self.unknown_resources)} unknown resource IDs in {source_name}: {sorted(self.unknown_resources)}")
+        if self.unknown_metrics:
+            logger.warning(f"Found {len(self.unknown_metrics)} unknown metric IDs in {source_name}: {sorted(self.unknown_metrics)}")
+
+        lines_count = len(self.lines)
+        with open(self.output_file, 'a', encoding='utf-8') as fout:
+            fout.writelines(self.lines)
+        self.lines = []
+        return lines_count
+
+
+class PerfmonkeySink:
+    """
+    Wide CSV PerfMonkey одного .tgz: блоки собираются в wide-структуру
+    perfmonkey_parser, в close() строки дописываются в CSV ресурсов под
+    file_locks (Manager locks от вызывающего процесса).
+
+    Заголовки (create_csv_headers) и финальную перенумерацию
+    (sort_and_renumber_csv_files) делает вызывающий процесс.
+    """
+
+    target = 'perfmonkey'
+
+    def __init__(self, output_dir: Union[str, Path], serial_number: str, file_locks: dict):
+        perfmonkey_parser = _perfmonkey_parser()
+        self._perfmonkey = perfmonkey_parser
+        self.output_dir = Path(output_dir)
+        self.serial_number = serial_number
+        self.file_locks = file_locks
+        self.resources = frozenset(perfmonkey_parser.PERFMONKEY_SELECTION)
+        self.wide_data = perfmonkey_parser.new_wide_format()
+        self.error = None
+
+    def add_block(self, block: DataBlock):
+        self._perfmonkey.add_block_to_wide_format(block, self.wide_data)
+
+    def close(self, source_name: str = '') -> Optional[int]:
+        """Дописать строки в CSV ресурсов; число строк или None, если проход был с ошибкой."""
+        wide_data, self.wide_data = self.wide_data, None
+        if self.error is not None:
+            return None
+        stats = self._perfmonkey.write_wide_format_csv(
+            wide_data, self.serial_number, self.output_dir, self.file_locks
+        )
+        return sum(stats.values())
@@ -11,23 +11,26 @@ from pathlib import Path
 # Импорт словарей из parsers/dictionaries/
 # Поддержка запуска как модуля и напрямую
 try:
-    from parsers.dictionaries import METRIC_NAME_DICT, RESOURCE_NAME_DICT, METRIC_CONVERSION
+    from parsers.dictionaries import METRIC_NAME_DICT, RESOURCE_NAME_DICT
+    from parsers.dat_decoder import (
+        list_zip_tgz_members, get_column_index, source_size, split_parts,
+    )
+    from parsers.block_cache import iter_source_blocks, BLOCK_CACHE_DIR
+    from parsers.block_sinks import csv_block_lines
 except ImportError:
     # Запуск напрямую из директории parsers
     sys.path.insert(0, str(Path(__file__).parent))
     sys.path.insert(0, str(Path(__file__).parent.parent))
-    from dictionaries import METRIC_NAME_DICT, RESOURCE_NAME_DICT, METRIC_CONVERSION
+    from dictionaries import METRIC_NAME_DICT, RESOURCE_NAME_DICT
+    from dat_decoder import (
+        list_zip_tgz_members, get_column_index, source_size, split_parts,
+    )
+    from block_cache import iter_source_blocks, BLOCK_CACHE_DIR
+    from block_sinks import csv_block_lines
 
 
 import re
 import os
-import struct
-from datetime import datetime
-from datetime import timedelta
-import tarfile
-import time
-import zipfile
-import shutil
 from multiprocessing import Pool, cpu_count, Manager
 from functools import partial
 import io
@@ -168,190 +171,39 @@ DEFAULT_METRICS = [
 
 
 # -----------------------------------------------------------------------------
-def construct_data_header(result):
-    """ construct data header
-        {
-            'EndTime': '1664312940', 'StartTime': '1664312040', 'Archive': '60',
-            'CtrlID': '1129',
-            'Map': [{
-                'ObjectTypes': '10',
-                'IDs': ['134234114', '134234112', ...],
-                'Names': ['DAE010.2', 'DAE010.0', ...],
-                'DataTypes': ['5', '18', ...]
-            }]
-        }
-    """
-    data_header = {}
-    if result:
-        result = result.groups()
-        map_header = result[0]
-        map_content = result[1]
-
-        list_map_header = map_header.split(",")
-        for each_key in list_map_header:
-            list_key_value = each_key.split(":")
-            map_key = list_key_value[0].replace('"', '')
-            map_value = list_key_value[1].replace('"', '')
-            data_header[map_key] = map_value.strip()
-
-        data_header['Map'] = []
-        result = re.findall(
-            '"([0-9]+)":{"IDs":\\[(("[0-9a-zA-Z]+",?)+)\\],'
-            '"Names":\\[(("[.0-9A-Za-z$ \\[\\]\\(\\):_-]*",?)+)\\],'
-            '"DataTypes":\\[(([0-9]+,?)+)\\]}',
-            map_content
-        )
-        if result:
-            for each_result in result:
-                object_type = {}
-                object_type['ObjectTypes'] = each_result[0]
-                object_type['IDs'] = each_result[1].replace('"', '').split(',')
-                object_type['Names'] = each_result[3].replace('"', '').split(',')
-                object_type['DataTypes'] = each_result[5].replace('"', '').split(',')
-                data_header['Map'].append(object_type)
-    return data_header
-
-
-# -----------------------------------------------------------------------------
-def construct_data_type(data_header):
-    """ construct data type
-        ['10', '5', 'DAE010.2', []]
-    """
-    list_data_type = []
-    size_collect_once = 0
-    if 'Map' in data_header:
-        for resource_type in data_header['Map']:
-            size_collect_once += (
-                len(resource_type['IDs']) *
-                len(resource_type['DataTypes']) * 4
-            )
-            for index_ids, _ in enumerate(resource_type['IDs']):
-                for index_data_type in resource_type['DataTypes']:
-                    list_index = [
-                        resource_type['ObjectTypes'],
-                        index_data_type,
-                        resource_type['Names'][index_ids], []
-                    ]
-                    list_data_type.append(list_index)
-
-    return list_data_type, size_collect_once
-
-
-# -----------------------------------------------------------------------------
-def process_perf_file_to_memory(file_path, resources, metrics, to_db=False):
-    """ read binary perf file and return CSV lines as a list
+def process_perf_file_to_memory(file_path, resources, metrics, to_db=False, part=0, parts=1, cache_dir=None):
+    """ read binary perf file (.dat or .tgz streamed without extraction)
+        and return CSV lines as a list
+        part/parts: decode only the part-th contiguous block range of the file (large file split)
+        cache_dir: decoded block cache (.npz), None - BLOCK_CACHE_DIR
     """
     csv_lines = []
+    resources = frozenset(resources)
+    metrics = frozenset(metrics)
+    
+    def is_needed(resource_id, metric_id):
+        return is_resource_and_datatype_needed(
+            resource_id=resource_id, metric_id=metric_id,
+            resources=resources, metrics=metrics, allow_unknown=True
+        )
     
     try:
-        with open(file_path, "rb") as fin:
-            bit_correct = fin.read(32)
-            bit_msg_version = fin.read(4)
-            bit_equip_sn = fin.read(256).decode('utf-8')
-            bit_equip_name = fin.read(41).decode('utf-8')
-            bit_equip_data_length = fin.read(4)
-
-            process_finish_flag = False
-
-            bit_map_type = fin.read(4)
-            bit_map_length, = struct.unpack("<l", fin.read(4))
-            bit_map_value = fin.read(bit_map_length - 8)
-            if len(bit_map_value) < bit_map_length - 8:
-                logger.error("Read Data Header Failed for %s", file_path)
-                return None
-
-            while not process_finish_flag:
-                result = re.match(
-                    '{(.*),"Map":{(.*)}}', bit_map_value.decode('utf-8')
-                )
-                data_header = construct_data_header(result)
-                list_data_type, size_collect_once = construct_data_type(data_header)
-
-                times_collcet = int(
-                    (int(data_header['EndTime'])-int(data_header['StartTime']))/
-                    int(data_header['Archive'])
-                )
-
-                for i in range(times_collcet):
-                    buffer_read = fin.read(size_collect_once)
-                    if len(buffer_read) < size_collect_once:
-                        process_finish_flag = True
-                        break
-                    for index_in_buffer in range(0, size_collect_once, 4):
-                        bytes_read_4 = buffer_read[index_in_buffer: index_in_buffer + 4]
-                        bytes_read_int, = struct.unpack("<l", bytes_read_4)
-                        list_data_type[int(index_in_buffer / 4)][3].append(str(bytes_read_int))
-
-                start_time = datetime.fromtimestamp(int(data_header['StartTime']))
-                next_time = start_time
-                time_list = []
-                for i, _ in enumerate(list_data_type[0][3]):
-                    time_list.append(next_time)
-                    next_time += timedelta(seconds=int(data_header['Archive']))
-
-                # Собираем статистику по неизвестным ID (для логирования)
-                unknown_resources = set()
-                unknown_metrics = set()
-                
-                for i, data_type in enumerate(list_data_type):
-                    resource_id = str(data_type[0])
-                    metric_id = str(data_type[1])
-                    
-                    if not is_resource_and_datatype_needed(
-                        resource_id=data_type[0], metric_id=data_type[1],
-                        resources=resources, metrics=metrics, allow_unknown=True
-                    ):
-                        continue
-
-                    # Проверяем, известны ли ID
-                    resource_name = RESOURCE_NAME_DICT.get(resource_id, f"UNKNOWN_RESOURCE_{resource_id}")
-                    metric_name = METRIC_NAME_DICT.get(metric_id, f"UNKNOWN_METRIC_{metric_id}")
-                    
-                    # Собираем ТОЛЬКО те ID, которых НЕТ в словарях (для логирования)
-                    # Если ID уже добавлен в словарь (даже с именем UNKNOWN_XXX), warning не нужен
-                    if resource_id not in RESOURCE_NAME_DICT:
-                        unknown_resources.add(resource_id)
-                    if metric_id not in METRIC_NAME_DICT:
-                        unknown_metrics.add(metric_id)
-                    
-                    str_to_csv = ""
-                    str_to_csv += resource_name + ';'
-                    str_to_csv += metric_name + ';'
-                    str_to_csv += data_type[2] + ';'
-                    for index, point_value in enumerate(data_type[3]):
-                        time_string = time_list[index].strftime("%Y-%m-%dT%H:%M:%SZ")
-                        time_qqq = time.mktime(time_list[index].timetuple())
-                        
-                        # Применяем конверсию единиц измерения если нужно
-                        # Для метрик, где сырые данные в других единицах (KB/s→MB/s, us→ms)
-                        value = float(point_value)
-                        if metric_id in METRIC_CONVERSION:
-                            value = value / METRIC_CONVERSION[metric_id]
-                        
-                        csv_lines.append(
-                            f'{str_to_csv}{value};{time_string};{time_qqq}\n'
-                        )
+        for block in iter_source_blocks(file_path, cache_dir=cache_dir, resources=resources,
+                                        part=part, parts=parts):
+            # Собираем статистику по неизвестным ID (для логирования)
+            unknown_resources = set()
+            unknown_metrics = set()
+            
+            # Забираем из блока только нужные колонки (индекс кэшируется на layout)
+            columns = get_column_index(block.layout, (resources, metrics), is_needed)
+            csv_lines.extend(csv_block_lines(block, columns, unknown_resources, unknown_metrics))
+            
+            # Логируем неизвестные ID если они есть
+            if unknown_resources:
+                logger.warning(f"Found {len(unknown_resources)} unknown resource IDs in {file_path}: {sorted(unknown_resources)}")
+            if unknown_metrics:
+                logger.warning(f"Found {len(unknown_metrics)} unknown metric IDs in {file_path}: {sorted(unknown_metrics)}")
                 
-                # Логируем неизвестные ID если они есть
-                if unknown_resources:
-                    logger.warning(f"Found {len(unknown_resources)} unknown resource IDs in {file_path}: {sorted(unknown_resources)}")
-                if unknown_metrics:
-                    logger.warning(f"Found {len(unknown_metrics)} unknown metric IDs in {file_path}: {sorted(unknown_metrics)}")
-
-                bit_map_type = fin.read(4)
-                if bit_map_type == '':
-                    process_finish_flag = True
-                elif bit_map_type == '\x00\x00\x00\x00':
-                    bit_map_length, = struct.unpack("<l", fin.read(4))
-                    if bit_map_length < 8:
-                        process_finish_flag = True
-                    else:
-                        bit_map_value = fin.read(bit_map_length - 8)
-                        if len(bit_map_value) < bit_map_length - 8:
-                            return None
-                else:
-                    process_finish_flag = True
-                    
     except Exception as exc_info:
         logger.error(f"Error processing {file_path}: {exc_info}")
         return None
@@ -365,30 +217,20 @@ def process_single_tgz_file(args):
     Process a single .tgz file and write directly to CSV file.
     Memory optimized - streams data to disk instead of accumulating in memory.
     """
-    file_path, resources, metrics, to_db, output_file = args
+    file_path, resources, metrics, to_db, output_file, part, parts, cache_dir = args
     
     try:
-        # Decompress
-        decompressed_file_path = decompress_tgz(file_path)
-        if not decompressed_file_path:
-            return {
-                'file': file_path,
-                'lines_count': 0,
-                'success': False
-            }
-            
-        # Process to memory
+        # Process to memory (.tgz is streamed, nothing is extracted to disk)
         csv_lines = process_perf_file_to_memory(
-            file_path=decompressed_file_path,
+            file_path=file_path,
             resources=resources,
             metrics=metrics,
             to_db=to_db,
+            part=part,
+            parts=parts,
+            cache_dir=cache_dir,
         )
         
-        # Cleanup decompressed file
-        if decompressed_file_path.exists():
-            decompressed_file_path.unlink()
-        
         if csv_lines is None:
             return {
                 'file': file_path,
@@ -445,43 +287,6 @@ def is_resource_and_datatype_needed(resource_id, metric_id, resources, metrics,
     
     return resource_requested and metric_requested and resource_known and metric_known
 
-# -----------------------------------------------------------------------------
-#decompress zip archive
-def decompress_zip(zip_path, extract_to=None):
-    """
-    Извлекает zip архив во временную директорию
-    Возвращает путь к директории с извлеченными файлами
-    """
-    if extract_to is None:
-        extract_to = Path("temp_zip_extract")
-    else:
-        extract_to = Path(extract_to)
-    
-    if extract_to.exists():
-        shutil.rmtree(extract_to)
-    extract_to.mkdir(parents=True)
-    
-    logger.info(f"Extracting zip archive {zip_path} to {extract_to}")
-    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-        zip_ref.extractall(extract_to)
-    
-    logger.info(f"Successfully extracted zip archive to {extract_to}")
-    return extract_to
-
-# -----------------------------------------------------------------------------
-#decompress file
-def decompress_tgz(file_tgz):
-    tar = tarfile.open(file_tgz)
-    names = tar.getnames()
-    temp_file_path = Path("temp") / f"temp_{os.getpid()}_{time.time()}"
-    if not temp_file_path.is_dir():
-        temp_file_path.mkdir(parents=True)
-    if len(names) == 1:
-        tar.extract(names[0], temp_file_path)
-        return temp_file_path / names[0]
-    logger.error("perf file content error, perf file: %s", file_tgz)
-    return ""
-
 # -----------------------------------------------------------------------------
 def split_files_by_sn(files, prefix=None):
     """
@@ -610,7 +415,7 @@ def determine_optimal_workers_for_parsing(num_workers=None):
     return max(1, final_workers)
 
 # -----------------------------------------------------------------------------
-def process_perf_file_tgz_dir(input_path, output_path, is_delete_after_parse, resources, metrics, to_db=False, prefix=None, num_workers=None):
+def process_perf_file_tgz_dir(input_path, output_path, is_delete_after_parse, resources, metrics, to_db=False, prefix=None, num_workers=None, cache_dir=None):
     logger.info("%s: start processing  %s", inspect.stack()[0][3], input_path)
     input_path = Path(input_path)
     output_path = Path(output_path)
@@ -634,25 +439,21 @@ def process_perf_file_tgz_dir(input_path, output_path, is_delete_after_parse, re
     num_workers = optimal_workers
     
     # Проверяем, является ли входной путь zip файлом
-    temp_extract_dir = None
-    original_input_path = input_path
+    is_zip_input = input_path.is_file() and input_path.suffix.lower() == '.zip'
     
-    if input_path.is_file() and input_path.suffix.lower() == '.zip':
-        logger.info("Input is a zip archive, extracting...")
-        temp_extract_dir = decompress_zip(input_path)
-        input_path = temp_extract_dir
-        logger.info(f"Working with extracted directory: {input_path}")
-    elif not input_path.is_dir():
+    if is_zip_input:
+        # Без extractall: workers распаковывают .tgz прямо из ZIP, каждый своим ZipFile
+        logger.info("Input is a zip archive, reading .tgz members without extraction")
+        files = list_zip_tgz_members(input_path)
+    elif input_path.is_dir():
+        # Рекурсивный поиск всех .tgz файлов
+        files = list(input_path.rglob("*.tgz"))
+    else:
         logger.error("%s is not a valid path or zip file!", input_path)
         return
 
-    # Рекурсивный поиск всех .tgz файлов
-    files = list(input_path.rglob("*.tgz"))
     if len(files) == 0:
         logger.warning("There are no perf files yet in %s", input_path)
-        if temp_extract_dir and temp_extract_dir.exists():
-            logger.info(f"Cleaning up temporary directory {temp_extract_dir}")
-            shutil.rmtree(temp_extract_dir)
         return
 
     logger.info(f"Found {len(files)} .tgz files")
@@ -669,16 +470,28 @@ def process_perf_file_tgz_dir(input_path, output_path, is_delete_after_parse, re
         logger.info(f"Writing to CSV: {output_csv_file_path}")
         
         try:
+            # Large files are split into block parts so they don't leave a single-core tail
+            file_sizes = [source_size(f) for f in sn_files]
+            total_bytes = sum(file_sizes)
+            
             # Prepare arguments for parallel processing
             # Each worker writes directly to the output file
-            process_args = [(f, resources, metrics, to_db, output_csv_file_path) for f in sn_files]
+            process_args = []
+            for f, size in zip(sn_files, file_sizes):
+                parts = split_parts(size, total_bytes, num_workers)
+                process_args.extend(
+                    (f, resources, metrics, to_db, output_csv_file_path, part, parts, cache_dir)
+                    for part in range(parts)
+                )
+            if len(process_args) > len(sn_files):
+                logger.info(f"Split large files: {len(sn_files)} files -> {len(process_args)} tasks")
             
             # Process files in parallel
             with Pool(processes=num_workers) as pool:
                 # Use imap_unordered for better performance and progress tracking
                 results = list(tqdm.tqdm(
                     pool.imap_unordered(process_single_tgz_file, process_args),
-                    total=len(sn_files),
+                    total=len(process_args),
                     desc=f"Processing {serial}"
                 ))
             
@@ -692,14 +505,13 @@ def process_perf_file_tgz_dir(input_path, output_path, is_delete_after_parse, re
                     logger.error(f"Failed to process {result['file'].name}")
             
             # Cleanup source files if needed
-            if not temp_extract_dir:
-                for file_info in results:
-                    file = file_info['file']
+            if not is_zip_input:
+                for file in dict.fromkeys(file_info['file'] for file_info in results):
                     if is_delete_after_parse:
                         if file.exists():
                             file.unlink()
                     else:
-                        parsed_files_path = original_input_path / "parsed_files"
+                        parsed_files_path = input_path / "parsed_files"
                         if not parsed_files_path.is_dir():
                             parsed_files_path.mkdir()
                         if file.exists():
@@ -708,21 +520,6 @@ def process_perf_file_tgz_dir(input_path, output_path, is_delete_after_parse, re
             logger.info(f"Finished writing to {output_csv_file_path}")
         except Exception as e:
             logger.error(f"Error writing to {output_csv_file_path}: {str(e)}")
-    
-    # Очистка временной директории после обработки zip архива
-    if temp_extract_dir and temp_extract_dir.exists():
-        logger.info(f"Cleaning up temporary directory {temp_extract_dir}")
-        shutil.rmtree(temp_extract_dir)
-        
-    # Cleanup temp directories
-    temp_path = Path("temp")
-    if temp_path.exists():
-        for item in temp_path.iterdir():
-            if item.is_dir() and item.name.startswith("temp_"):
-                try:
-                    shutil.rmtree(item)
-                except:
-                    pass
 
 # -----------------------------------------------------------------------------
 def check_resource_existance(resources):
@@ -767,9 +564,10 @@ def make_dirs(log_path, output_path):
 @click.option("--to_db", is_flag=True, show_default=True, required=False, default=False, help='Send data to InfluxDB')
 @click.option("-w", "--num_workers", type=int, default=None, help='Number of parallel workers (default: CPU count - 1)')
 @click.option("--all-metrics", is_flag=True, default=False, help='Parse ALL metrics and resources from METRIC_DICT and RESOURCE_DICT (instead of DEFAULT lists)')
+@click.option("--cache-dir", type=click.Path(), default=BLOCK_CACHE_DIR or None, help='Decoded block cache directory (.npz): the first run fills it, re-exports read it without decompression (default: $BLOCK_CACHE_DIR)')
 def huawei_collect(
     input_path, output_path, log_path, is_delete_after_parse, resources,
-    metrics, prefix, ext, to_db, num_workers, all_metrics
+    metrics, prefix, ext, to_db, num_workers, all_metrics, cache_dir
 ):
     """ process collected data - PARALLEL VERSION
     """
@@ -794,6 +592,7 @@ def huawei_collect(
         prefix=prefix,
         to_db=to_db,
         num_workers=num_workers,
+        cache_dir=cache_dir,
     )
     logger.info("%s: done", inspect.stack()[0][3])
 
@@ -0,0 +1,761 @@
+#!/usr/bin/env python3
+"""
+DAT DECODER: общий декодер бинарных .dat файлов Huawei Performance.
+
+Используется всеми парсерами (streaming_pipeline, csv_wide_parser, perfmonkey_parser).
+
+Формат .dat файла:
+- Заголовок файла (337 байт): correct(32) + version(4) + SN(256) + name(41) + data_length(4)
+- Цепочка header-блоков: type(4) + length(4) + JSON-подобная карта
+  {"EndTime":..,"StartTime":..,"Archive":..,"CtrlID":..,"Map":{...}}
+- После каждой карты: times_collect строк по size_collect_once байт (int32 little-endian)
+
+Блок сэмплов читается целиком и декодируется одним numpy.frombuffer(dtype='<i4')
+в 2-D массив (times_collect × series) вместо struct.unpack на каждые 4 байта.
+
+Время строк блока - один int64 вектор epoch-миллисекунд (UTC, без зависимости
+от локальной TZ контейнера), текстовые форматы рендерятся один раз на блок.
+
+Карта блока ("Map") разбирается json-парсером в неизменяемый BlockLayout и
+кэшируется по хэшу байт карты: соседние блоки и SP-файлы одного массива
+несут одну и ту же карту, повторный блок стоит одного поиска в словаре.
+
+Выборка (resource, metric) компилируется в индекс колонок на layout
+(get_column_index): из блока забираются только нужные серии (DataBlock.select).
+
+.dat внутри .tgz читается потоково (tarfile stream mode), без распаковки на диск.
+.tgz внутри ZIP открывается прямо из архива (ZipMember) - без extractall().
+"""
+
+import hashlib
+import io
+import json
+import math
+import os
+import re
+import struct
+import tarfile
+import time
+import zipfile
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path, PurePosixPath
+from typing import BinaryIO, Callable, Dict, Generator, Hashable, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
+
+try:
+    from .pipeline_metrics import stage
+except ImportError:
+    from pipeline_metrics import stage
+
+# Размер заголовка .dat файла: correct(32) + version(4) + SN(256) + name(41) + data_length(4)
+DAT_FILE_HEADER_SIZE = 32 + 4 + 256 + 41 + 4
+
+# Тип одного сэмпла: int32 little-endian (как struct "<l")
+SAMPLE_DTYPE = np.dtype('<i4')
+SAMPLE_SIZE = SAMPLE_DTYPE.itemsize
+
+# Маркер header-блока с картой данных
+MAP_BLOCK_TYPE = b'\x00\x00\x00\x00'
+
+# Разделитель заголовка блока и карты данных
+MAP_KEY_MARKER = b',"Map":'
+
+# Максимум закэшированных BlockLayout (разных карт) на процесс
+LAYOUT_CACHE_SIZE = int(os.getenv("LAYOUT_CACHE_SIZE", "256"))
+
+# Максимум закэшированных индексов колонок (layout × выборка) на процесс
+COLUMN_INDEX_CACHE_SIZE = int(os.getenv("COLUMN_INDEX_CACHE_SIZE", "1024"))
+
+# Файлы меньше этого размера не делятся между workers (split_parts)
+SPLIT_MIN_BYTES = int(os.getenv("SPLIT_MIN_BYTES", str(64 * 1024 * 1024)))  # 64MB
+
+# Размер куска при пропуске данных в потоке .tgz (без seek)
+SKIP_CHUNK_BYTES = 1024 * 1024
+
+# Размер буфера упреждающего чтения gzip-потока .tgz (ограничивает память на worker)
+TGZ_READ_AHEAD_BYTES = int(os.getenv("TGZ_READ_AHEAD_BYTES", str(1024 * 1024)))  # 1MB
+
+
+class DatFormatError(Exception):
+    """Повреждённый или обрезанный заголовок блока .dat файла."""
+
+
+def construct_data_header(result):
+    """ construct data header
+        {
+            'EndTime': '1664312940', 'StartTime': '1664312040', 'Archive': '60',
+            'CtrlID': '1129',
+            'Map': [{
+                'ObjectTypes': '10',
+                'IDs': ['134234114', '134234112', ...],
+                'Names': ['DAE010.2', 'DAE010.0', ...],
+                'DataTypes': ['5', '18', ...]
+            }]
+        }
+    """
+    data_header = {}
+    if result:
+        result = result.groups()
+        map_header = result[0]
+        map_content = result[1]
+
+        list_map_header = map_header.split(",")
+        for each_key in list_map_header:
+            list_key_value = each_key.split(":")
+            map_key = list_key_value[0].replace('"', '')
+            map_value = list_key_value[1].replace('"', '')
+            data_header[map_key] = map_value.strip()
+
+        data_header['Map'] = []
+        result = re.findall(
+            '"([0-9]+)":{"IDs":\\[(("[0-9a-zA-Z]+",?)+)\\],'
+            '"Names":\\[(("[.0-9A-Za-z$ \\[\\]\\(\\):_-]*",?)+)\\],'
+            '"DataTypes":\\[(([0-9]+,?)+)\\]}',
+            map_content
+        )
+        if result:
+            for each_result in result:
+                object_type = {}
+                object_type['ObjectTypes'] = each_result[0]
+                object_type['IDs'] = each_result[1].replace('"', '').split(',')
+                object_type['Names'] = each_result[3].replace('"', '').split(',')
+                object_type['DataTypes'] = each_result[5].replace('"', '').split(',')
+                data_header['Map'].append(object_type)
+    return data_header
+
+
+def construct_data_type(data_header):
+    """ construct data type
+        ['10', '5', 'DAE010.2', []]
+    """
+    list_data_type = []
+    size_collect_once = 0
+    if 'Map' in data_header:
+        for resource_type in data_header['Map']:
+            size_collect_once += (
+                len(resource_type['IDs']) *
+                len(resource_type['DataTypes']) * SAMPLE_SIZE
+            )
+            for index_ids, _ in enumerate(resource_type['IDs']):
+                for index_data_type in resource_type['DataTypes']:
+                    list_index = [
+                        resource_type['ObjectTypes'],
+                        index_data_type,
+                        resource_type['Names'][index_ids], []
+                    ]
+                    list_data_type.append(list_index)
+
+    return list_data_type, size_collect_once
+
+
+class ZipMember(NamedTuple):
+    """
+    .tgz файл внутри ZIP архива.
+
+    Передаётся в worker вместо пути к распакованному файлу: каждый worker
+    открывает ZIP своим ZipFile и распаковывает member на лету.
+    """
+    archive: Path
+    member: str
+    size: int = 0  # размер .tgz внутри архива (для планирования частей)
+
+    @property
+    def name(self) -> str:
+        """Имя файла без пути внутри архива (как Path.name)."""
+        return PurePosixPath(self.member).name
+
+    @property
+    def suffix(self) -> str:
+        return PurePosixPath(self.member).suffix
+
+    def __str__(self) -> str:
+        return f"{self.archive}:{self.member}"
+
+
+DatSource = Union[str, Path, ZipMember]
+
+
+class ObjectGroup(NamedTuple):
+    """Группа объектов одного ObjectType в карте блока."""
+    object_type: str
+    ids: Tuple[str, ...]
+    names: Tuple[str, ...]
+    data_types: Tuple[str, ...]
+    offset: int  # индекс первой колонки группы в строке сэмплов
+
+    @property
+    def series_count(self) -> int:
+        return len(self.ids) * len(self.data_types)
+
+
+@dataclass(frozen=True)
+class BlockLayout:
+    """
+    Неизменяемое описание колонок блока, общее для всех блоков с одной картой.
+
+    Attributes:
+        layout_hash: blake2b (hex) от байт карты "Map"
+        groups: Группы объектов в порядке карты, с offset первой колонки
+        columns: (ObjectType, DataType, Name) - по одной на серию, в порядке сэмплов
+    """
+    layout_hash: str
+    groups: Tuple[ObjectGroup, ...]
+    columns: Tuple[Tuple[str, str, str], ...]
+
+    @property
+    def series_count(self) -> int:
+        return len(self.columns)
+
+    @property
+    def size_collect_once(self) -> int:
+        return self.series_count * SAMPLE_SIZE
+
+
+@dataclass
+class DataBlock:
+    """
+    Один header-блок .dat файла.
+
+    Attributes:
+        header: Заголовок блока (StartTime, EndTime, Archive, CtrlID) - строки
+        layout: Описание колонок (общий закэшированный BlockLayout)
+        values: Сэмплы int32, shape (rows, layout.series_count)
+        number: Порядковый номер блока в .dat (с 0) - позиция для checkpoints
+        offset: Смещение начала блока (карты) в .dat потоке - по нему блок относится к части файла
+        windowed: Строки срезаны окном (window) - заголовок описывает только оставленные строки
+    """
+    header: dict
+    layout: BlockLayout
+    values: np.ndarray
+    number: int = 0
+    offset: int = 0
+    windowed: bool = False
+
+    @property
+    def rows(self) -> int:
+        return self.values.shape[0]
+
+    @property
+    def list_data_type(self) -> Tuple[Tuple[str, str, str], ...]:
+        """Колонки (ObjectType, DataType, Name) - одна на серию."""
+        return self.layout.columns
+
+    def select(self, column_index: np.ndarray) -> np.ndarray:
+        """Сэмплы только выбранных колонок, по серии на строку: shape (len(column_index), rows)."""
+        return self.values[:, column_index].T
+
+    @property
+    def truncated(self) -> bool:
+        """Блок обрезан концом файла (прочитано меньше строк, чем в заголовке)."""
+        return self.layout.size_collect_once > 0 and self.rows < block_times_collect(self.header)
+
+    def window(self, time_from: Optional[int], time_to: Optional[int]) -> 'DataBlock':
+        """
+        Строки блока внутри окна [time_from, time_to) (epoch-секунды) - срез без копии.
+        StartTime/EndTime заголовка сдвигаются на оставленные строки, блок
+        помечается windowed.
+        """
+        start_time = int(self.header['StartTime'])
+        archive_interval = int(self.header['Archive'])
+        first, last = 0, self.rows
+        if time_from is not None:
+            first = min(max(-(-(time_from - start_time) // archive_interval), 0), self.rows)
+        if time_to is not None:
+            last = min(max(-(-(time_to - start_time) // archive_interval), first), self.rows)
+        if (first, last) == (0, self.rows):
+            return self
+
+        header = dict(self.header)
+        header['StartTime'] = str(start_time + first * archive_interval)
+        header['EndTime'] = str(start_time + last * archive_interval)
+        return DataBlock(header=header, layout=self.layout, values=self.values[first:last],
+                         number=self.number, offset=self.offset, windowed=True)
+
+    @property
+    def timestamps_ms(self) -> np.ndarray:
+        """Время строк блока в epoch-миллисекундах: StartTime + arange(rows) * Archive."""
+        start_time = int(self.header['StartTime'])
+        archive_interval = int(self.header['Archive'])
+        return (start_time + np.arange(self.rows, dtype=np.int64) * archive_interval) * 1000
+
+
+def format_timestamps(timestamps_ms: np.ndarray, time_format: str) -> List[str]:
+    """Отрендерить время строк блока (UTC) в строки формата strftime."""
+    return [time.strftime(time_format, time.gmtime(ts)) for ts in (timestamps_ms // 1000).tolist()]
+
+
+_layout_cache: Dict[bytes, BlockLayout] = {}
+
+
+def _build_layout(layout_hash: str, groups: Iterable[Tuple[str, list, list, list]]) -> BlockLayout:
+    """Собрать BlockLayout из групп (ObjectType, IDs, Names, DataTypes)."""
+    object_groups = []
+    columns = []
+    for object_type, ids, names, data_types in groups:
+        group = ObjectGroup(
+            object_type=str(object_type),
+            ids=tuple(str(each_id) for each_id in ids),
+            names=tuple(str(name) for name in names),
+            data_types=tuple(str(data_type) for data_type in data_types),
+            offset=len(columns),
+        )
+        object_groups.append(group)
+        for index_ids in range(len(group.ids)):
+            for data_type in group.data_types:
+                columns.append((group.object_type, data_type, group.names[index_ids]))
+    return BlockLayout(layout_hash=layout_hash, groups=tuple(object_groups), columns=tuple(columns))
+
+
+def get_block_layout(map_bytes: bytes) -> BlockLayout:
+    """
+    BlockLayout для байт карты "Map" (JSON-объект {ObjectType: {IDs, Names, DataTypes}}).
+
+    Результат мемоизируется по blake2b от байт карты.
+    """
+    digest = hashlib.blake2b(map_bytes, digest_size=16).digest()
+    layout = _layout_cache.get(digest)
+    if layout is not None:
+        return layout
+
+    data_map = json.loads(map_bytes)
+    layout = _build_layout(digest.hex(), (
+        (object_type, group['IDs'], group['Names'], group['DataTypes'])
+        for object_type, group in data_map.items()
+    ))
+
+    if len(_layout_cache) >= LAYOUT_CACHE_SIZE:
+        _layout_cache.pop(next(iter(_layout_cache)))
+    _layout_cache[digest] = layout
+    return layout
+
+
+def restore_block_layout(layout_hash: str, groups: Iterable[Tuple[str, list, list, list]]) -> BlockLayout:
+    """
+    BlockLayout по сохранённому хэшу и группам (ObjectType, IDs, Names, DataTypes),
+    например из кэша декодированных блоков. Общий кэш с get_block_layout.
+    """
+    digest = bytes.fromhex(layout_hash)
+    layout = _layout_cache.get(digest)
+    if layout is not None:
+        return layout
+
+    layout = _build_layout(layout_hash, groups)
+    if len(_layout_cache) >= LAYOUT_CACHE_SIZE:
+        _layout_cache.pop(next(iter(_layout_cache)))
+    _layout_cache[digest] = layout
+    return layout
+
+
+_column_index_cache: Dict[tuple, np.ndarray] = {}
+
+
+def get_column_index(layout: BlockLayout, selection_key: Hashable,
+                     is_selected: Callable[[str, str], bool]) -> np.ndarray:
+    """
+    Скомпилировать выборку серий в индекс колонок layout.
+
+    Args:
+        layout: BlockLayout блока
+        selection_key: Hashable описание выборки - ключ кэша вместе с layout_hash
+        is_selected: Предикат (resource_id, metric_id) -> bool, вызывается
+                     один раз на колонку при первой встрече layout
+
+    Returns:
+        np.ndarray[intp] (read-only) с номерами выбранных колонок по порядку
+    """
+    key = (layout.layout_hash, selection_key)
+    column_index = _column_index_cache.get(key)
+    if column_index is not None:
+        return column_index
+
+    column_index = np.fromiter(
+        (column for column, (resource_id, metric_id, _) in enumerate(layout.columns)
+         if is_selected(resource_id, metric_id)),
+        dtype=np.intp,
+    )
+    column_index.setflags(write=False)
+
+    if len(_column_index_cache) >= COLUMN_INDEX_CACHE_SIZE:
+        _column_index_cache.pop(next(iter(_column_index_cache)))
+    _column_index_cache[key] = column_index
+    return column_index
+
+
+def _parse_block_map_legacy(bit_map_value: bytes) -> Tuple[dict, BlockLayout]:
+    """Разбор карты регулярными выражениями (если карта - не валидный JSON)."""
+    result = re.match('{(.*),"Map":{(.*)}}', bit_map_value.decode('utf-8'))
+    data_header = construct_data_header(result)
+    if 'Map' not in data_header:
+        raise DatFormatError("Block map has no \"Map\" section")
+    layout = _build_layout(
+        hashlib.blake2b(bit_map_value, digest_size=16).hexdigest(),
+        ((group['ObjectTypes'], group['IDs'], group['Names'], group['DataTypes'])
+         for group in data_header.pop('Map')),
+    )
+    return data_header, layout
+
+
+def parse_block_map(bit_map_value: bytes) -> Tuple[dict, BlockLayout]:
+    """
+    Разобрать карту header-блока.
+
+    Returns:
+        (header, layout): header - {'EndTime', 'StartTime', 'Archive', 'CtrlID'}
+        строками, layout - закэшированный BlockLayout
+    """
+    bit_map_value = bit_map_value.rstrip(b'\x00 \t\r\n')
+    marker = bit_map_value.find(MAP_KEY_MARKER)
+    if marker < 0 or not bit_map_value.endswith(b'}'):
+        return _parse_block_map_legacy(bit_map_value)
+    try:
+        header = {
+            key: str(value)
+            for key, value in json.loads(bit_map_value[:marker] + b'}').items()
+        }
+        layout = get_block_layout(bit_map_value[marker + len(MAP_KEY_MARKER):-1])
+    except (ValueError, AttributeError, KeyError, TypeError):
+        return _parse_block_map_legacy(bit_map_value)
+    return header, layout
+
+
+def _read_int32(fin: BinaryIO) -> int:
+    """Прочитать int32 little-endian (длина карты)."""
+    raw = fin.read(4)
+    if len(raw) < 4:
+        raise DatFormatError("Unexpected end of file while reading block length")
+    value, = struct.unpack("<l", raw)
+    return value
+
+
+def _read_map_value(fin: BinaryIO, bit_map_length: int) -> bytes:
+    """Прочитать тело карты header-блока."""
+    bit_map_value = fin.read(bit_map_length - 8)
+    if len(bit_map_value) < bit_map_length - 8:
+        raise DatFormatError("Read Data Header Failed")
+    return bit_map_value
+
+
+def block_times_collect(data_header: dict) -> int:
+    """Число строк сэмплов в блоке: (EndTime - StartTime) / Archive."""
+    return int(
+        (int(data_header['EndTime']) - int(data_header['StartTime'])) /
+        int(data_header['Archive'])
+    )
+
+
+def read_block_map(fin: BinaryIO, check_type: bool = True) -> Optional[bytes]:
+    """
+    Прочитать type + length + карту следующего header-блока.
+
+    Returns:
+        Байты карты или None, если header-блоков больше нет
+    """
+    with stage('extract'):
+        bit_map_type = fin.read(4)
+        if check_type and bit_map_type != MAP_BLOCK_TYPE:
+            return None
+
+        bit_map_length = _read_int32(fin)
+        if bit_map_length < 8:
+            return None
+        return _read_map_value(fin, bit_map_length)
+
+
+def decode_block(fin: BinaryIO, data_header: dict, layout: BlockLayout, number: int = 0,
+                 offset: int = 0) -> DataBlock:
+    """Прочитать блок сэмплов, следующий за картой, одним fin.read()."""
+    size_collect_once = layout.size_collect_once
+    times_collect = block_times_collect(data_header)
+
+    series_count = layout.series_count
+    if size_collect_once > 0 and times_collect > 0:
+        with stage('extract'):
+            buffer_read = fin.read(times_collect * size_collect_once)
+        rows = len(buffer_read) // size_collect_once
+    else:
+        buffer_read = b''
+        rows = 0
+
+    values = np.frombuffer(
+        buffer_read, dtype=SAMPLE_DTYPE, count=rows * series_count
+    ).reshape(rows, series_count)
+
+    return DataBlock(header=data_header, layout=layout, values=values, number=number, offset=offset)
+
+
+def skip_bytes(fin: BinaryIO, count: int) -> int:
+    """
+    Пропустить count байт потока без декодирования.
+
+    Обычный файл - seek; поток .tgz (tarfile stream mode не умеет seek) -
+    чтение кусками SKIP_CHUNK_BYTES.
+
+    Returns:
+        Сколько байт реально пропущено (меньше count у конца файла)
+    """
+    if count <= 0:
+        return 0
+    try:
+        file_size = os.fstat(fin.fileno()).st_size
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        skipped = 0
+        with stage('extract'):
+            while skipped < count:
+                chunk = fin.read(min(SKIP_CHUNK_BYTES, count - skipped))
+                if not chunk:
+                    break
+                skipped += len(chunk)
+        return skipped
+
+    position = fin.tell()
+    target = min(position + count, max(file_size, position))
+    fin.seek(target)
+    return target - position
+
+
+def parse_time_bound(value: Union[str, int]) -> int:
+    """
+    Граница временного окна в epoch-секундах.
+
+    Принимает epoch-секунды или ISO 8601 ('2024-05-01', '2024-05-01T12:00:00',
+    '2024-05-01T12:00:00+03:00'); время без TZ считается UTC.
+
+    Raises:
+        ValueError: если строку не удалось разобрать
+    """
+    if isinstance(value, int):
+        return value
+    value = value.strip()
+    if value.lstrip('-').isdigit():
+        return int(value)
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp())
+
+
+def block_overlaps_window(data_header: dict, time_from: Optional[int], time_to: Optional[int]) -> bool:
+    """Пересекается ли блок [StartTime, EndTime) с окном [time_from, time_to)."""
+    if time_from is not None and int(data_header['EndTime']) <= time_from:
+        return False
+    if time_to is not None and int(data_header['StartTime']) >= time_to:
+        return False
+    return True
+
+
+def source_size(source: DatSource) -> int:
+    """Размер источника в байтах (.tgz/.dat на диске или .tgz внутри ZIP)."""
+    if isinstance(source, ZipMember):
+        return source.size
+    return Path(source).stat().st_size
+
+
+def _tgz_dat_size(file_tgz: Union[str, Path], fileobj: Optional[BinaryIO] = None) -> int:
+    """Размер .dat внутри .tgz из заголовка tar (распаковывается только начало потока)."""
+    if fileobj is not None:
+        tar = tarfile.open(fileobj=fileobj, mode='r|gz')
+    else:
+        tar = tarfile.open(file_tgz, mode='r|gz')
+    with tar:
+        for member in tar:
+            if member.isfile():
+                return member.size
+    raise DatFormatError(f"perf file content error: {file_tgz}")
+
+
+def dat_source_size(source: DatSource) -> int:
+    """Размер .dat потока источника в байтах - граница частей файла (block_part)."""
+    if isinstance(source, ZipMember):
+        with zipfile.ZipFile(source.archive, 'r') as zip_ref:
+            with zip_ref.open(source.member) as member_file:
+                return _tgz_dat_size(source, fileobj=member_file)
+
+    file_path = Path(source)
+    if file_path.suffix.lower() in ('.tgz', '.gz'):
+        return _tgz_dat_size(file_path)
+    return file_path.stat().st_size
+
+
+def split_parts(size: int, total_size: int, workers: int,
+                split_min_bytes: int = SPLIT_MIN_BYTES) -> int:
+    """
+    На сколько частей делить файл между workers.
+
+    Файл крупнее средней доли на worker (total_size / workers, но не меньше
+    split_min_bytes) делится на ceil(size / доля) частей, не больше workers -
+    общее время стремится к total_size / cores, а не к самому большому файлу.
+    """
+    if workers <= 1 or split_min_bytes <= 0 or size < split_min_bytes:
+        return 1
+    share = max(total_size / workers, split_min_bytes)
+    return max(1, min(workers, math.ceil(size / share)))
+
+
+def block_part(offset: int, dat_size: int, parts: int) -> int:
+    """
+    Часть файла, к которой относится блок: .dat поток делится на parts
+    непрерывных диапазонов байт, блок принадлежит диапазону своего начала.
+    """
+    if parts <= 1 or dat_size <= 0:
+        return 0
+    return min(offset * parts // dat_size, parts - 1)
+
+
+def iter_dat_blocks(fin: BinaryIO, time_from: Optional[int] = None,
+                    time_to: Optional[int] = None, part: int = 0,
+                    parts: int = 1, start_block: int = 0,
+                    skip_block: Optional[Callable[[dict, str], bool]] = None,
+                    dat_size: Optional[int] = None) -> Generator[DataBlock, None, None]:
+    """
+    Генератор header-блоков .dat файла.
+
+    Каждый блок сэмплов читается одним fin.read() и декодируется через
+    numpy.frombuffer в массив (times_collect × series). Обрезанный последний
+    блок отдаётся только с полностью прочитанными строками.
+
+    С окном [time_from, time_to) блоки вне окна пропускаются без декодирования
+    (skip_bytes: seek в .dat, чтение без разбора в .tgz), блоки на границе
+    обрезаются по строкам.
+
+    part/parts делят один файл между несколькими workers на непрерывные
+    диапазоны блоков: .dat поток (dat_size байт) режется на parts равных
+    диапазонов, блок относится к диапазону своего начала (block_part).
+    Часть пропускает блоки до своего диапазона без декодирования и
+    заканчивает чтение после него. gzip-поток нельзя начать с середины,
+    поэтому часть part распаковывает заново только префикс перед своим
+    диапазоном: k частей .tgz стоят (k + 1) / 2 полных распаковок, а не k.
+
+    start_block: блоки с меньшим номером тоже пропускаются без декодирования -
+    продолжение прерванного импорта с checkpoint.
+
+    skip_block(header, layout_hash) -> True: блок пропускается без
+    декодирования (блоки, уже импортированные из другого архива - block_dedup).
+
+    Время чтения потока (extract) и разбора карт (header) учитывается в
+    pipeline_metrics.
+
+    Args:
+        fin: Бинарный файловый объект, позиционированный на начало .dat
+        time_from: Начало окна, epoch-секунды (включительно); None - без ограничения
+        time_to: Конец окна, epoch-секунды (не включительно); None - без ограничения
+        part: Номер части файла (0..parts-1)
+        parts: На сколько частей делится файл
+        start_block: Номер первого отдаваемого блока
+        skip_block: Фильтр блоков по заголовку и layout_hash; None - без фильтра
+        dat_size: Размер .dat потока (dat_source_size) - нужен при parts > 1
+
+    Yields:
+        DataBlock: заголовок, описание колонок и 2-D массив сэмплов
+
+    Raises:
+        DatFormatError: если заголовок блока обрезан
+        ValueError: parts > 1 без dat_size
+    """
+    if parts > 1 and dat_size is None:
+        raise ValueError("dat_size is required to split a .dat file into parts")
+
+    fin.read(DAT_FILE_HEADER_SIZE)
+    position = DAT_FILE_HEADER_SIZE
+
+    # Тип первого блока не проверяется
+    bit_map_value = read_block_map(fin, check_type=False)
+
+    block_number = 0
+    while bit_map_value is not None:
+        offset = position
+        own_part = block_part(offset, dat_size, parts) if parts > 1 else part
+        # Диапазон части кончился - следующие блоки принадлежат другим частям
+        if own_part > part:
+            return
+
+        with stage('header'):
+            data_header, layout = parse_block_map(bit_map_value)
+        number = block_number
+        block_number += 1
+        data_length = max(block_times_collect(data_header), 0) * layout.size_collect_once
+        position += 8 + len(bit_map_value) + data_length
+
+        if (own_part != part or number < start_block
+                or not block_overlaps_window(data_header, time_from, time_to)
+                or (skip_block is not None and skip_block(data_header, layout.layout_hash))):
+            if skip_bytes(fin, data_length) < data_length:
+                return
+            bit_map_value = read_block_map(fin)
+            continue
+
+        block = decode_block(fin, data_header, layout, number, offset)
+        truncated = block.truncated
+        if time_from is not None or time_to is not None:
+            block = block.window(time_from, time_to)
+        if block.rows:
+            yield block
+
+        # Обрезанный блок - дальше данных нет
+        if truncated:
+            return
+
+        bit_map_value = read_block_map(fin)
+
+
+def list_zip_tgz_members(zip_path: Union[str, Path]) -> List[ZipMember]:
+    """Найти все .tgz файлы внутри ZIP архива (рекурсивно по путям)."""
+    zip_path = Path(zip_path)
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        return [
+            ZipMember(zip_path, info.filename, info.file_size)
+            for info in zip_ref.infolist()
+            if not info.is_dir() and info.filename.lower().endswith('.tgz')
+        ]
+
+
+@contextmanager
+def open_tgz_dat(file_tgz: Union[str, Path], fileobj: Optional[BinaryIO] = None) -> Iterator[BinaryIO]:
+    """
+    Открыть .dat файл внутри .tgz как поток - без распаковки во временную директорию.
+
+    gzip-поток читается через tarfile stream mode ('r|gz') с буфером
+    TGZ_READ_AHEAD_BYTES, поэтому между .tgz и декодером ничего не пишется на диск.
+
+    Args:
+        file_tgz: Путь к .tgz (или имя для сообщений, если передан fileobj)
+        fileobj: Уже открытый поток .tgz (например, member ZIP архива)
+
+    Raises:
+        DatFormatError: если в архиве нет ни одного файла
+    """
+    if fileobj is not None:
+        tar = tarfile.open(fileobj=fileobj, mode='r|gz', bufsize=TGZ_READ_AHEAD_BYTES)
+    else:
+        tar = tarfile.open(file_tgz, mode='r|gz', bufsize=TGZ_READ_AHEAD_BYTES)
+    with tar:
+        for member in tar:
+            if member.isfile():
+                yield tar.extractfile(member)
+                return
+    raise DatFormatError(f"perf file content error: {file_tgz}")
+
+
+@contextmanager
+def open_dat_source(source: DatSource) -> Iterator[BinaryIO]:
+    """
+    Открыть источник данных как бинарный поток .dat.
+
+    Поддерживает: .dat файл, .tgz с .dat внутри, ZipMember (.tgz внутри ZIP).
+    """
+    if isinstance(source, ZipMember):
+        with zipfile.ZipFile(source.archive, 'r') as zip_ref:
+            with zip_ref.open(source.member) as member_file:
+                with open_tgz_dat(source, fileobj=member_file) as fin:
+                    yield fin
+        return
+
+    file_path = Path(source)
+    if file_path.suffix.lower() in ('.tgz', '.gz'):
+        with open_tgz_dat(file_path) as fin:
+            yield fin
+    else:
+        with open(file_path, "rb") as fin:
+            yield fin
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+DAT INDEX: индекс header-блоков .dat файла (sidecar JSON).
+
+Для каждого header-блока сохраняется смещение в .dat потоке, интервал
+StartTime..EndTime, Archive, CtrlID, layout_hash, число строк и номер блока.
+Индекс пишется попутно полным проходом декодирования (block_cache.iter_source_blocks,
+только если задан каталог индексов - index_dir или BLOCK_INDEX_DIR) или строится отдельным проходом только по картам блоков (get_block_index,
+данные пропускаются без декодирования) и кэшируется рядом с .tgz или в
+BLOCK_INDEX_DIR.
+
+Частичные проходы - окно --from/--to, часть файла, продолжение с checkpoint,
+пропуск импортированных блоков - отбирают блоки по индексу
+(select_indexed_blocks) и читают только их (iter_indexed_blocks): в обычном
+.dat - через seek, в потоке .tgz - пропуском байт без разбора карт; чтение
+заканчивается на последнем нужном блоке.
+
+Формат sidecar (<file>.blockidx.json):
+    {"version": 2, "source": {"size": .., "mtime_ns": ..}, "blocks": [
+        {"offset": 337, "start_time": 1664312040, "end_time": 1664312940,
+         "archive": 60, "ctrl_id": "1129", "layout_hash": "…", "rows": 15,
+         "series_count": 12, "number": 0}, ...]}
+"""
+
+import hashlib
+import json
+import logging
+import os
+import zipfile
+from pathlib import Path
+from typing import BinaryIO, Callable, Generator, Iterable, List, NamedTuple, Optional, Union
+
+try:
+    from .dat_decoder import (
+        DAT_FILE_HEADER_SIZE, DataBlock, DatSource, ZipMember, block_overlaps_window,
+        block_part, block_times_collect, decode_block, open_dat_source, parse_block_map,
+        read_block_map, skip_bytes,
+    )
+    from .pipeline_metrics import stage
+except ImportError:
+    from dat_decoder import (
+        DAT_FILE_HEADER_SIZE, DataBlock, DatSource, ZipMember, block_overlaps_window,
+        block_part, block_times_collect, decode_block, open_dat_source, parse_block_map,
+        read_block_map, skip_bytes,
+    )
+    from pipeline_metrics import stage
+
+logger = logging.getLogger(__name__)
+
+BLOCK_INDEX_VERSION = 2
+BLOCK_INDEX_SUFFIX = '.blockidx.json'
+
+# Каталог для индексов; пусто - полный проход iter_source_blocks индекс не пишет,
+# а get_block_index кладёт его рядом с .tgz (или рядом с ZIP)
+BLOCK_INDEX_DIR = os.getenv("BLOCK_INDEX_DIR", "")
+
+
+class BlockIndexEntry(NamedTuple):
+    """Один header-блок .dat файла."""
+    offset: int          # смещение начала блока (type) в .dat потоке
+    start_time: int
+    end_time: int
+    archive: int
+    ctrl_id: str
+    layout_hash: str
+    rows: int            # фактически записанные строки (у обрезанного блока меньше)
+    series_count: int
+    number: int          # порядковый номер блока в .dat (DataBlock.number)
+
+    @property
+    def data_end_time(self) -> int:
+        """Время за последней записанной строкой (для обрезанного блока < end_time)."""
+        return self.start_time + self.rows * self.archive
+
+    @property
+    def header(self) -> dict:
+        """Заголовок блока в виде карты .dat (строки) - для окна и skip_block."""
+        return {'EndTime': str(self.end_time), 'StartTime': str(self.start_time),
+                'Archive': str(self.archive), 'CtrlID': self.ctrl_id}
+
+
+def block_index_entry(block: DataBlock) -> BlockIndexEntry:
+    """Запись индекса для блока полного прохода (без окна)."""
+    return BlockIndexEntry(
+        offset=block.offset,
+        start_time=int(block.header['StartTime']),
+        end_time=int(block.header['EndTime']),
+        archive=int(block.header['Archive']),
+        ctrl_id=block.header.get('CtrlID', ''),
+        layout_hash=block.layout.layout_hash,
+        rows=block.rows,
+        series_count=block.layout.series_count,
+        number=block.number,
+    )
+
+
+def scan_block_index(fin: BinaryIO) -> List[BlockIndexEntry]:
+    """
+    Построить индекс блоков, читая только карты: данные блоков пропускаются.
+
+    Args:
+        fin: Бинарный поток, позиционированный на начало .dat
+    """
+    entries = []
+    fin.read(DAT_FILE_HEADER_SIZE)
+    position = DAT_FILE_HEADER_SIZE
+
+    # Тип первого блока не проверяется (как в iter_dat_blocks)
+    bit_map_value = read_block_map(fin, check_type=False)
+    while bit_map_value is not None:
+        data_header, layout = parse_block_map(bit_map_value)
+        times_collect = block_times_collect(data_header)
+        data_length = max(times_collect, 0) * layout.size_collect_once
+        skipped = skip_bytes(fin, data_length)
+        rows = skipped // layout.size_collect_once if layout.size_collect_once else 0
+
+        entries.append(BlockIndexEntry(
+            offset=position,
+            start_time=int(data_header['StartTime']),
+            end_time=int(data_header['EndTime']),
+            archive=int(data_header['Archive']),
+            ctrl_id=data_header.get('CtrlID', ''),
+            layout_hash=layout.layout_hash,
+            rows=rows,
+            series_count=layout.series_count,
+            number=len(entries),
+        ))
+        position += 8 + len(bit_map_value) + skipped
+
+        # Обрезанный блок - дальше данных нет
+        if skipped < data_length:
+            break
+        bit_map_value = read_block_map(fin)
+
+    return entries
+
+
+def select_indexed_blocks(entries: Iterable[BlockIndexEntry], time_from: Optional[int] = None,
+                          time_to: Optional[int] = None, part: int = 0, parts: int = 1,
+                          start_block: int = 0,
+                          skip_block: Optional[Callable[[dict, str], bool]] = None,
+                          dat_size: Optional[int] = None) -> List[BlockIndexEntry]:
+    """
+    Записи индекса, которые отдал бы iter_dat_blocks с теми же окном,
+    частью, start_block и skip_block (пустые блоки не отбираются).
+    """
+    if parts > 1 and dat_size is None:
+        raise ValueError("dat_size is required to split a .dat file into parts")
+
+    selected = []
+    for entry in entries:
+        if not entry.rows or entry.number < start_block:
+            continue
+        if parts > 1 and block_part(entry.offset, dat_size, parts) != part:
+            continue
+        header = entry.header
+        if not block_overlaps_window(header, time_from, time_to):
+            continue
+        if skip_block is not None and skip_block(header, entry.layout_hash):
+            continue
+        selected.append(entry)
+    return selected
+
+
+def iter_indexed_blocks(fin: BinaryIO, entries: Iterable[BlockIndexEntry]) -> Generator[DataBlock, None, None]:
+    """
+    Прочитать только перечисленные блоки, пропуская остальные без декодирования.
+
+    Args:
+        fin: Бинарный поток, позиционированный на начало .dat
+        entries: Записи индекса этого файла, по возрастанию offset
+    """
+    position = 0
+    for entry in entries:
+        if entry.offset < position:
+            raise ValueError("Block index entries must be sorted by offset")
+        position += skip_bytes(fin, entry.offset - position)
+
+        bit_map_value = read_block_map(fin, check_type=False)
+        if bit_map_value is None:
+            return
+        with stage('header'):
+            data_header, layout = parse_block_map(bit_map_value)
+        block = decode_block(fin, data_header, layout, entry.number, entry.offset)
+        position = entry.offset + 8 + len(bit_map_value) + block.rows * block.layout.size_collect_once
+        yield block
+
+        if block.truncated:
+            return
+
+
+def _short_digest(text: str) -> str:
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=6).hexdigest()
+
+
+def block_index_path(source: DatSource, cache_dir: Optional[Union[str, Path]] = None) -> Path:
+    """
+    Путь к sidecar индексу источника.
+
+    С cache_dir (или BLOCK_INDEX_DIR) - <cache_dir>/<name>.<digest>.blockidx.json,
+    иначе рядом с файлом: <file>.blockidx.json; для .tgz внутри ZIP - рядом с ZIP.
+    """
+    cache_dir = cache_dir or BLOCK_INDEX_DIR
+    if cache_dir:
+        source_key = str(Path(source.archive).resolve()) + ':' + source.member \
+            if isinstance(source, ZipMember) else str(Path(source).resolve())
+        return Path(cache_dir) / f"{source.name}.{_short_digest(source_key)}{BLOCK_INDEX_SUFFIX}"
+
+    if isinstance(source, ZipMember):
+        archive = Path(source.archive)
+        return archive.with_name(f"{archive.name}.{_short_digest(source.member)}.{source.name}{BLOCK_INDEX_SUFFIX}")
+
+    source = Path(source)
+    return source.with_name(source.name + BLOCK_INDEX_SUFFIX)
+
+
+def source_fingerprint(source: DatSource) -> dict:
+    """Отпечаток источника: индекс перестраивается, если файл изменился."""
+    if isinstance(source, ZipMember):
+        with zipfile.ZipFile(source.archive, 'r') as zip_ref:
+            info = zip_ref.getinfo(source.member)
+        return {'size': info.file_size, 'crc': info.CRC}
+    stat = Path(source).stat()
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def load_block_index(index_path: Path, fingerprint: dict) -> Optional[List[BlockIndexEntry]]:
+    """Прочитать sidecar; None - если его нет, он устарел или повреждён."""
+    try:
+        with open(index_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('version') != BLOCK_INDEX_VERSION or data.get('source') != fingerprint:
+            return None
+        return [BlockIndexEntry(**block) for block in data['blocks']]
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, TypeError, KeyError) as e:
+        logger.warning(f"Ignoring broken block index {index_path}: {e}")
+        return None
+
+
+def save_block_index(index_path: Path, fingerprint: dict, entries: List[BlockIndexEntry]) -> bool:
+    """Атомарно записать sidecar (tmp + rename - безопасно для параллельных workers)."""
+    data = {
+        'version': BLOCK_INDEX_VERSION,
+        'source': fingerprint,
+        'blocks': [entry._asdict() for entry in entries],
+    }
+    tmp_path = index_path.with_name(f"{index_path.name}.{os.getpid()}.tmp")
+    try:
+        index_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.replace(tmp_path, index_path)
+        return True
+    except OSError as e:
+        logger.warning(f"Could not write block index {index_path}: {e}")
+        if tmp_path.exists():
+            tmp_path.unlink()
+        return False
+
+
+def get_block_index(source: DatSource, cache_dir: Optional[Union[str, Path]] = None) -> List[BlockIndexEntry]:
+    """
+    Индекс блоков источника (.dat, .tgz или ZipMember): из sidecar, если он
+    актуален, иначе построить одним проходом по картам и сохранить.
+    """
+    index_path = block_index_path(source, cache_dir)
+    fingerprint = source_fingerprint(source)
+
+    entries = load_block_index(index_path, fingerprint)
+    if entries is not None:
+        return entries
+
+    with open_dat_source(source) as fin:
+        entries = scan_block_index(fin)
+    save_block_index(index_path, fingerprint, entries)
+    logger.info(f"Built block index for {source.name}: {len(entries)} blocks -> {index_path}")
+    return entries
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+IMPORT LEDGER: локальный журнал уже импортированных .tgz файлов.
+
+Ключ записи - содержимое файла: <имя>:<размер>:<crc32>. Для .tgz внутри
+ZIP и 7z размер и CRC32 берутся из каталога архива (без чтения данных),
+для файла на диске CRC32 считается одним проходом по сжатому .tgz. Поэтому
+тот же .tgz, загруженный повторно (в другом архиве, под другим путём или
+после удаления watcher'ом), узнаётся за миллисекунды.
+
+Запись хранит target (URL импорта), число отправленных метрик, интервал
+данных и окно --from/--to, с которым шёл импорт. Файл пропускается, если для
+того же target есть запись, окно которой покрывает запрошенное; --force
+импортирует заново.
+
+Формат - JSON Lines, только дописывание (одна строка на импорт, последняя
+запись по ключу и target побеждает):
+    {"key": "PerfData_..._SP0_0_20220927.tgz:2807:500f9b07", "target": "http://vm:8428/api/v1/import/prometheus",
+     "metrics": 740, "data_from": 1664312040, "data_to": 1664313780,
+     "window": [null, null], "imported_at": "2026-10-17T00:30:00+00:00"}
+
+Пока файл импортируется, в тот же журнал пишутся checkpoints - позиция,
+до которой VM подтвердил приём: part/parts (деление файла между workers),
+номер блока .dat и число уже отправленных серий этого блока. Повторный
+запуск с тем же окном продолжает с этой позиции, не декодируя файл заново:
+    {"key": "...", "target": "...", "metrics": 300000, "window": [null, null],
+     "checkpoint": {"part": 0, "parts": 2, "block": 14, "series": 1200, "done": false},
+     "imported_at": "..."}
+"""
+
+import json
+import logging
+import os
+import time
+import zipfile
+import zlib
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# Журнал импортов (JSON Lines); пусто - журнал выключен
+IMPORT_LEDGER = os.getenv("IMPORT_LEDGER", "")
+# Checkpoint подтверждённой позиции пишется не чаще, чем раз в столько секунд
+IMPORT_CHECKPOINT_SECONDS = float(os.getenv("IMPORT_CHECKPOINT_SECONDS", "10"))
+
+CRC_CHUNK_BYTES = 1024 * 1024
+
+
+def ledger_key(name: str, size: int, crc32: int) -> str:
+    """Ключ .tgz по содержимому: имя (в нём SN) + размер + CRC32."""
+    return f"{name}:{size}:{crc32 & 0xFFFFFFFF:08x}"
+
+
+def file_ledger_key(file_path: Union[str, Path]) -> str:
+    """Ключ .tgz на диске: CRC32 считается потоково, без распаковки."""
+    file_path = Path(file_path)
+    crc32 = 0
+    size = 0
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CRC_CHUNK_BYTES), b''):
+            crc32 = zlib.crc32(chunk, crc32)
+            size += len(chunk)
+    return ledger_key(file_path.name, size, crc32)
+
+
+def zip_member_ledger_keys(zip_path: Union[str, Path]) -> Dict[str, str]:
+    """Ключи всех .tgz внутри ZIP по каталогу архива: {member: key}."""
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        return {
+            info.filename: ledger_key(Path(info.filename).name, info.file_size, info.CRC)
+            for info in zip_ref.infolist()
+            if info.filename.lower().endswith('.tgz')
+        }
+
+
+def _window_covers(window: list, time_from: Optional[int], time_to: Optional[int]) -> bool:
+    """Покрывает ли окно прошлого импорта [from, to) запрошенное (None - без границы)."""
+    done_from, done_to = window
+    if done_from is not None and (time_from is None or time_from < done_from):
+        return False
+    if done_to is not None and (time_to is None or time_to > done_to):
+        return False
+    return True
+
+
+class ImportLedger:
+    """
+    Журнал импортов поверх JSON Lines файла.
+
+    Читается один раз и дочитывается, если файл вырос (другой процесс
+    дописал записи); запись - одна строка в режиме append.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self._entries: Dict[Tuple[str, str], dict] = {}
+        self._checkpoints: Dict[Tuple[str, str], List[dict]] = {}
+        self._offset = 0
+
+    def _refresh(self):
+        try:
+            if self.path.stat().st_size <= self._offset:
+                return
+            with open(self.path, 'rb') as f:
+                f.seek(self._offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+
+        # Недописанная последняя строка дочитается в следующий раз
+        complete = data.rfind(b'\n') + 1
+        self._offset += complete
+        for line in data[:complete].splitlines():
+            try:
+                entry = json.loads(line)
+                entry_key = (entry['key'], entry['target'])
+                if 'checkpoint' in entry:
+                    self._checkpoints.setdefault(entry_key, []).append(entry)
+                else:
+                    self._entries[entry_key] = entry
+                    # Импорт с этим окном завершён - его checkpoints больше не нужны
+                    if entry_key in self._checkpoints:
+                        self._checkpoints[entry_key] = [
+                            checkpoint for checkpoint in self._checkpoints[entry_key]
+                            if checkpoint.get('window') != entry.get('window')
+                        ]
+            except (ValueError, KeyError, TypeError):
+                logger.warning(f"Skipping broken ledger line in {self.path}: {line[:200]!r}")
+
+    def lookup(self, key: str, target: str, time_from: Optional[int] = None,
+               time_to: Optional[int] = None) -> Optional[dict]:
+        """Запись об импорте key в target, покрывающем окно [time_from, time_to); иначе None."""
+        self._refresh()
+        entry = self._entries.get((key, target))
+        if entry is None or not _window_covers(entry.get('window', [None, None]), time_from, time_to):
+            return None
+        return entry
+
+    def checkpoints(self, key: str, target: str, time_from: Optional[int] = None,
+                    time_to: Optional[int] = None) -> Optional[Tuple[int, Dict[int, dict]]]:
+        """
+        Последние checkpoints прерванного импорта key в target с тем же окном.
+
+        Returns:
+            (parts, {part: checkpoint entry}) - деление файла последнего запуска и
+            позиции его частей; None - checkpoints нет (или файл уже импортирован)
+        """
+        self._refresh()
+        window = [time_from, time_to]
+        entries = [
+            entry for entry in self._checkpoints.get((key, target), [])
+            if entry.get('window') == window
+        ]
+        if not entries:
+            return None
+
+        parts = entries[-1]['checkpoint']['parts']
+        positions = {}
+        for entry in entries:
+            if entry['checkpoint']['parts'] == parts:
+                positions[entry['checkpoint']['part']] = entry
+        return parts, positions
+
+    def record_checkpoint(self, key: str, target: str, part: int, parts: int,
+                          block: int, series: int, metrics: int, done: bool = False,
+                          time_from: Optional[int] = None, time_to: Optional[int] = None) -> dict:
+        """Дописать checkpoint: часть part/parts подтверждена VM до (block, series); done - часть целиком."""
+        entry = {
+            'key': key,
+            'target': target,
+            'metrics': metrics,
+            'window': [time_from, time_to],
+            'checkpoint': {'part': part, 'parts': parts, 'block': block, 'series': series, 'done': done},
+            'imported_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        }
+        self._append(entry)
+        return entry
+
+    def _append(self, entry: dict) -> bool:
+        line = json.dumps(entry, separators=(',', ':')) + '\n'
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+        except OSError as e:
+            logger.warning(f"Could not write import ledger {self.path}: {e}")
+            return False
+        return True
+
+    def record(self, key: str, target: str, metrics: int,
+               data_from: Optional[int] = None, data_to: Optional[int] = None,
+               time_from: Optional[int] = None, time_to: Optional[int] = None) -> dict:
+        """Дописать запись об успешном импорте key в target."""
+        entry = {
+            'key': key,
+            'target': target,
+            'metrics': metrics,
+            'data_from': data_from,
+            'data_to': data_to,
+            'window': [time_from, time_to],
+            'imported_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        }
+        if not self._append(entry):
+            return entry
+
+        self._refresh()
+        self._entries[(key, target)] = entry
+        return entry
+
+
+class ImportCheckpoint:
+    """
+    Checkpoints импорта одной части файла.
+
+    on_sent(position, metrics) - callback BatchUploader: позиция (block, series),
+    подтверждённая VM, пишется в журнал не чаще interval секунд. finish()
+    записывает итог: часть отправлена целиком или последняя подтверждённая
+    позиция (после ошибки отправки).
+
+    metrics - метрик этой части, отправленных прошлыми запусками (с checkpoint).
+    """
+
+    def __init__(self, ledger: ImportLedger, key: str, target: str, part: int = 0, parts: int = 1,
+                 metrics: int = 0, time_from: Optional[int] = None, time_to: Optional[int] = None,
+                 interval: float = IMPORT_CHECKPOINT_SECONDS):
+        self.ledger = ledger
+        self.key = key
+        self.target = target
+        self.part = part
+        self.parts = parts
+        self.base_metrics = metrics
+        self.time_from = time_from
+        self.time_to = time_to
+        self.interval = interval
+        self._confirmed = None
+        self._written = None
+        self._written_at = time.monotonic()
+
+    def _write(self, position, metrics: int, done: bool = False):
+        self.ledger.record_checkpoint(
+            self.key, self.target, self.part, self.parts, position[0], position[1],
+            self.base_metrics + metrics, done=done, time_from=self.time_from, time_to=self.time_to,
+        )
+        self._written = (tuple(position), metrics)
+        self._written_at = time.monotonic()
+
+    def on_sent(self, position, metrics: int):
+        self._confirmed = (tuple(position), metrics)
+        if time.monotonic() - self._written_at >= self.interval:
+            self._write(position, metrics)
+
+    def finish(self, done: bool, metrics: int = 0):
+        """done - часть отправлена целиком (metrics - всего за запуск); иначе сохранить подтверждённую позицию."""
+        if done:
+            self._write((0, 0), metrics, done=True)
+        elif self._confirmed is not None and self._confirmed != self._written:
+            self._write(*self._confirmed)
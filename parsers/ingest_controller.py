@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+INGEST CONTROLLER: адаптивная нагрузка на VictoriaMetrics (AIMD).
+
+Число workers фиксировано, и без обратной связи каждый отправляет так быстро,
+как может: маленький VM захлёбывается (503, таймауты -insert.maxQueueDuration,
+медленная Grafana), а большой недогружен. Контроллер общий для всего
+pipeline (состояние в shared memory multiprocessing, один на главный процесс
+и workers) и по ответам VM держит задержку import запроса около цели:
+
+- каждый запрос к VM занимает слот (acquire/release в vm_sender._post):
+  запросов в пути не больше limit на все процессы, остальные ждут;
+- ошибка VM (429, 5xx, сетевая ошибка, таймаут) - limit и размер батча
+  делятся на 1/INGEST_DECREASE (multiplicative decrease);
+- задержка выше цели - уменьшается limit, а на минимуме - размер батча;
+- задержка ниже цели и все слоты заняты - limit +1, при задержке меньше
+  половины цели батч растёт на min_batch_bytes (additive increase).
+
+Решения принимаются не чаще раза в INGEST_ADJUST_SECONDS (ошибка - сразу,
+если limit не снижался последний интервал) и пишутся в лог.
+
+Настройки (env):
+    INGEST_TARGET_LATENCY    - целевая задержка import запроса, секунды (default: 2)
+    INGEST_ADJUST_SECONDS    - интервал решений, секунды (default: 2)
+    INGEST_DECREASE          - множитель limit / батча при перегрузке (default: 0.5)
+    INGEST_MIN_BATCH_BYTES   - минимальный батч и шаг его роста, байт (default: 1MB)
+"""
+
+import logging
+import multiprocessing
+import os
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+INGEST_TARGET_LATENCY = float(os.getenv("INGEST_TARGET_LATENCY", "2"))
+INGEST_ADJUST_SECONDS = float(os.getenv("INGEST_ADJUST_SECONDS", "2"))
+INGEST_DECREASE = float(os.getenv("INGEST_DECREASE", "0.5"))
+INGEST_MIN_BATCH_BYTES = int(os.getenv("INGEST_MIN_BATCH_BYTES", str(1024 * 1024)))
+
+# Сглаживание задержки (EWMA): вес нового ответа
+LATENCY_ALPHA = 0.3
+
+# Поля состояния в shared memory
+(_LIMIT, _IN_FLIGHT, _IN_FLIGHT_BYTES, _PEAK_IN_FLIGHT_BYTES, _BATCH_BYTES, _LATENCY,
+ _WINDOW_START, _WINDOW_OK, _WINDOW_ERRORS, _SATURATED, _LAST_DECREASE,
+ _REQUESTS, _ERRORS, _INCREASES, _DECREASES) = range(15)
+_FIELDS = 15
+
+OK, ERROR, REJECTED = 'ok', 'error', 'rejected'
+
+
+def _mb(value: float) -> str:
+    return f"{value / (1024 * 1024):.1f}MB"
+
+
+class IngestController:
+    """
+    AIMD контроллер числа одновременных import запросов и размера батча.
+
+    Создаётся в главном процессе и передаётся workers через initializer
+    multiprocessing.Pool (vm_sender.set_ingest_controller) - лимит общий
+    на все процессы и потоки отправки.
+
+    max_uploads: потолок одновременных запросов (workers x потоков отправки);
+    batch_bytes: потолок размера батча (--batch-mb).
+    """
+
+    def __init__(self, max_uploads: int, batch_bytes: int, min_uploads: int = 1,
+                 initial_uploads: Optional[int] = None,
+                 target_latency: float = INGEST_TARGET_LATENCY,
+                 interval: float = INGEST_ADJUST_SECONDS,
+                 decrease: float = INGEST_DECREASE,
+                 min_batch_bytes: int = INGEST_MIN_BATCH_BYTES):
+        self.max_uploads = max(1, max_uploads)
+        self.min_uploads = max(1, min(min_uploads, self.max_uploads))
+        self.max_batch_bytes = batch_bytes
+        self.min_batch_bytes = min(min_batch_bytes, batch_bytes)
+        self.target_latency = target_latency
+        self.interval = interval
+        self.decrease = decrease
+
+        if initial_uploads is None:
+            # Старт с половины потолка: есть куда расти и не бьём сразу всем пулом
+            initial_uploads = max(self.min_uploads, self.max_uploads // 2)
+        self._cond = multiprocessing.Condition()
+        self._state = multiprocessing.RawArray('d', _FIELDS)
+        self._state[_LIMIT] = min(max(initial_uploads, self.min_uploads), self.max_uploads)
+        self._state[_BATCH_BYTES] = batch_bytes
+        self._state[_WINDOW_START] = time.monotonic()
+        self._state[_LAST_DECREASE] = -interval
+
+    def acquire(self, nbytes: int = 0) -> float:
+        """Занять слот запроса (ждёт, пока запросов в пути не меньше limit); -> время начала."""
+        state = self._state
+        with self._cond:
+            while state[_IN_FLIGHT] >= int(state[_LIMIT]):
+                state[_SATURATED] = 1
+                self._cond.wait()
+            state[_IN_FLIGHT] += 1
+            state[_IN_FLIGHT_BYTES] += nbytes
+            state[_PEAK_IN_FLIGHT_BYTES] = max(state[_PEAK_IN_FLIGHT_BYTES], state[_IN_FLIGHT_BYTES])
+            if state[_IN_FLIGHT] >= int(state[_LIMIT]):
+                state[_SATURATED] = 1
+        return time.monotonic()
+
+    def release(self, nbytes: int, started: float, outcome: str, timed: bool = True):
+        """
+        Освободить слот и учесть ответ VM.
+
+        started: время из acquire(); outcome: OK, ERROR (перегрузка: 429, 5xx,
+        сеть) или REJECTED (4xx - ошибка в данных, на нагрузку не влияет);
+        timed=False - задержку не учитывать (chunked поток на целый файл)
+        """
+        state = self._state
+        now = time.monotonic()
+        with self._cond:
+            state[_IN_FLIGHT] -= 1
+            state[_IN_FLIGHT_BYTES] -= nbytes
+            state[_REQUESTS] += 1
+            if outcome == OK:
+                state[_WINDOW_OK] += 1
+                if timed:
+                    latency = now - started
+                    previous = state[_LATENCY]
+                    state[_LATENCY] = latency if not previous else \
+                        previous + LATENCY_ALPHA * (latency - previous)
+            elif outcome == ERROR:
+                state[_ERRORS] += 1
+                # Запрос ушёл до последнего снижения - на ошибку уже отреагировали
+                if started >= state[_LAST_DECREASE]:
+                    state[_WINDOW_ERRORS] += 1
+            self._adjust(now)
+            self._cond.notify_all()
+
+    def _adjust(self, now: float):
+        state = self._state
+        window_elapsed = now - state[_WINDOW_START] >= self.interval
+        # Ошибка - реагируем сразу, но не чаще одного снижения за интервал
+        urgent = state[_WINDOW_ERRORS] and now - state[_LAST_DECREASE] >= self.interval
+        if not (window_elapsed or urgent):
+            return
+
+        limit, batch_bytes, latency = state[_LIMIT], state[_BATCH_BYTES], state[_LATENCY]
+        new_limit, new_batch_bytes, reason = limit, batch_bytes, None
+        # Окно сбрасывается при каждом решении: снижения не чаще раза в интервал
+        if state[_WINDOW_ERRORS]:
+            new_limit = max(self.min_uploads, int(limit * self.decrease))
+            new_batch_bytes = max(self.min_batch_bytes, batch_bytes * self.decrease)
+            reason = f"{int(state[_WINDOW_ERRORS])} VM errors"
+        elif state[_WINDOW_OK] and latency > self.target_latency:
+            if int(limit) > self.min_uploads:
+                new_limit = max(self.min_uploads, int(limit * self.decrease))
+            else:
+                new_batch_bytes = max(self.min_batch_bytes, batch_bytes * self.decrease)
+            reason = f"latency {latency:.2f}s > target {self.target_latency:.2f}s"
+        elif state[_WINDOW_OK] and state[_SATURATED]:
+            # Растём, только если лимит действительно упирался
+            new_limit = min(self.max_uploads, limit + 1)
+            if latency < self.target_latency / 2:
+                new_batch_bytes = min(self.max_batch_bytes, batch_bytes + self.min_batch_bytes)
+            reason = f"latency {latency:.2f}s < target {self.target_latency:.2f}s"
+
+        if int(new_limit) != int(limit) or int(new_batch_bytes) != int(batch_bytes):
+            if new_limit < limit or new_batch_bytes < batch_bytes:
+                state[_DECREASES] += 1
+                state[_LAST_DECREASE] = now
+                log = logger.warning
+            else:
+                state[_INCREASES] += 1
+                log = logger.info
+            changes = []
+            if int(new_limit) != int(limit):
+                changes.append(f"uploads {int(limit)} -> {int(new_limit)}")
+            if int(new_batch_bytes) != int(batch_bytes):
+                changes.append(f"batch {_mb(batch_bytes)} -> {_mb(new_batch_bytes)}")
+            log(f"Ingest control: {reason} -> {', '.join(changes)} "
+                f"(in flight {int(state[_IN_FLIGHT])} requests, {_mb(state[_IN_FLIGHT_BYTES])})")
+            state[_LIMIT] = new_limit
+            state[_BATCH_BYTES] = new_batch_bytes
+
+        state[_WINDOW_START] = now
+        state[_WINDOW_OK] = 0
+        state[_WINDOW_ERRORS] = 0
+        state[_SATURATED] = 0
+
+    def batch_bytes(self) -> int:
+        """Текущий размер батча, байт."""
+        with self._cond:
+            return int(self._state[_BATCH_BYTES])
+
+    def snapshot(self) -> dict:
+        """Состояние для отчёта: limit, batch_bytes, latency, requests, errors, increases, decreases, ..."""
+        state = self._state
+        with self._cond:
+            return {
+                'limit': int(state[_LIMIT]),
+                'max_uploads': self.max_uploads,
+                'batch_bytes': int(state[_BATCH_BYTES]),
+                'latency': state[_LATENCY],
+                'in_flight': int(state[_IN_FLIGHT]),
+                'peak_in_flight_bytes': int(state[_PEAK_IN_FLIGHT_BYTES]),
+                'requests': int(state[_REQUESTS]),
+                'errors': int(state[_ERRORS]),
+                'increases': int(state[_INCREASES]),
+                'decreases': int(state[_DECREASES]),
+            }
@@ -18,6 +18,9 @@ PERF WATCHER: Автоматический мониторинг и парсин
     
 Или с параметрами:
     python -m parsers.perf_watcher --watch-dir /data/perf-dumps/dumps --vm-url http://localhost:8428
+
+Несколько VM / vminsert - список через запятую в --vm-url (VM_IMPORT_URL);
+--sharding sn отправляет файлы массива на один shard.
 """
 
 import sys
@@ -28,15 +31,12 @@ import signal
 import logging
 from logging.handlers import RotatingFileHandler
 import threading
-import tarfile
-import shutil
 from pathlib import Path
 from queue import Queue, Empty
 from datetime import datetime
 from typing import Optional, Set
 from dataclasses import dataclass, field
 
-import requests
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler, FileCreatedEvent
 
@@ -44,21 +44,33 @@ from watchdog.events import FileSystemEventHandler, FileCreatedEvent
 try:
     from parsers.streaming_pipeline import (
         stream_prometheus_metrics,
-        send_batch_to_vm,
         extract_serial_from_filename,
         BATCH_SIZE as DEFAULT_BATCH_SIZE,
     )
     from parsers.dictionaries import METRIC_NAME_DICT, RESOURCE_NAME_DICT
+    from parsers.dat_decoder import open_tgz_dat, DAT_FILE_HEADER_SIZE
+    from parsers.import_ledger import ImportCheckpoint, ImportLedger, file_ledger_key
+    from parsers.block_dedup import ImportedBlockIndex
+    from parsers.vm_sender import (
+        IMPORT_FORMATS, SHARDING_MODES, VM_IMPORT_FORMAT, VM_SHARDING, BatchUploader, get_session,
+        import_url, parse_endpoints, shard_key_for, vm_timeout,
+    )
 except ImportError:
     # Запуск напрямую
     sys.path.insert(0, str(Path(__file__).parent.parent))
     from parsers.streaming_pipeline import (
         stream_prometheus_metrics,
-        send_batch_to_vm,
         extract_serial_from_filename,
         BATCH_SIZE as DEFAULT_BATCH_SIZE,
     )
     from parsers.dictionaries import METRIC_NAME_DICT, RESOURCE_NAME_DICT
+    from parsers.dat_decoder import open_tgz_dat, DAT_FILE_HEADER_SIZE
+    from parsers.import_ledger import ImportCheckpoint, ImportLedger, file_ledger_key
+    from parsers.block_dedup import ImportedBlockIndex
+    from parsers.vm_sender import (
+        IMPORT_FORMATS, SHARDING_MODES, VM_IMPORT_FORMAT, VM_SHARDING, BatchUploader, get_session,
+        import_url, parse_endpoints, shard_key_for, vm_timeout,
+    )
 
 # Конфигурация из переменных окружения
 VM_URL = os.getenv("VM_URL", "http://victoriametrics:8428")
@@ -76,6 +88,11 @@ FILE_STABILITY_CHECK_SECONDS = int(os.getenv("FILE_STABILITY_CHECK_SECONDS", "5"
 LOG_DIR = Path("/app/logs") if Path("/app").exists() else Path("logs")
 LOG_DIR.mkdir(parents=True, exist_ok=True)
 
+# Журнал импортов: повторно подброшенные .tgz узнаются по содержимому и не импортируются
+IMPORT_LEDGER = os.getenv("IMPORT_LEDGER", str(LOG_DIR / "import_ledger.jsonl"))
+# Индекс импортированных блоков: из ежедневных перекрывающихся архивов импортируются только новые блоки
+IMPORTED_BLOCKS_DIR = os.getenv("IMPORTED_BLOCKS_DIR", str(LOG_DIR / "imported_blocks"))
+
 LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(50 * 1024 * 1024)))  # 50MB default
 LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))  # 5 backup files
 
@@ -159,13 +176,30 @@ class PerfWatcher:
         batch_size: int = BATCH_SIZE,
         delete_after_process: bool = DELETE_AFTER_PROCESS,
         max_retries: int = MAX_RETRIES,
+        ledger_path: str = IMPORT_LEDGER,
+        force: bool = False,
+        dedup_dir: str = IMPORTED_BLOCKS_DIR,
+        import_format: str = VM_IMPORT_FORMAT,
+        sharding: str = VM_SHARDING,
     ):
         self.watch_dir = Path(watch_dir)
         self.vm_import_url = vm_import_url
+        # Формат импорта: jsonl отправляется в /api/v1/import того же VM;
+        # журнал импортов ведётся по vm_import_url
+        self.import_format = import_format
+        self.send_url = import_url(vm_import_url, import_format)
+        # Список endpoints: round-robin или файлы массива на один shard (sn)
+        self.sharding = sharding
         self.batch_size = batch_size
         self.delete_after_process = delete_after_process
         self.max_retries = max_retries
         
+        # Журнал импортов (None - выключен), force - импортировать заново
+        self.ledger = ImportLedger(ledger_path) if ledger_path else None
+        self.force = force
+        # Индекс импортированных блоков по SN (None - выключен)
+        self.imported_blocks = ImportedBlockIndex(dedup_dir) if dedup_dir else None
+        
         # Очередь задач на обработку
         self.task_queue: Queue[FileTask] = Queue()
         
@@ -178,6 +212,7 @@ class PerfWatcher:
         # Обработанные файлы в текущей сессии (для статистики)
         self.processed_count = 0
         self.failed_count = 0
+        self.skipped_count = 0
         self.total_metrics_sent = 0
         
         # Флаг для graceful shutdown
@@ -198,11 +233,15 @@ class PerfWatcher:
         logger.info("🚀 PERF WATCHER STARTED")
         logger.info("=" * 80)
         logger.info(f"Watch directory:  {self.watch_dir}")
-        logger.info(f"VM Import URL:    {self.vm_import_url}")
+        logger.info(f"VM Import URL:    {', '.join(parse_endpoints(self.send_url))} ({self.import_format})")
+        if len(parse_endpoints(self.send_url)) > 1:
+            logger.info(f"Sharding:         {self.sharding}")
         logger.info(f"File wait time:   {FILE_WAIT_SECONDS}s")
         logger.info(f"Delete after:     {self.delete_after_process}")
         logger.info(f"Batch size:       {self.batch_size:,}")
         logger.info(f"Max retries:      {self.max_retries}")
+        logger.info(f"Import ledger:    {self.ledger.path if self.ledger else 'disabled'}{' (force)' if self.force else ''}")
+        logger.info(f"Block dedup:      {self.imported_blocks.index_dir if self.imported_blocks else 'disabled'}")
         logger.info("=" * 80)
         
         # Проверяем доступность VictoriaMetrics
@@ -250,13 +289,18 @@ class PerfWatcher:
         self.shutdown_event.set()
     
     def _check_vm_health(self) -> bool:
-        """Проверка доступности VictoriaMetrics."""
+        """Проверка доступности VictoriaMetrics (из нескольких endpoints достаточно одного)."""
+        endpoints = parse_endpoints(self.vm_import_url)
+        return any([self._check_endpoint_health(endpoint) for endpoint in endpoints])
+    
+    def _check_endpoint_health(self, vm_import_url: str) -> bool:
+        """Проверка доступности одного endpoint VictoriaMetrics."""
         try:
             # Извлекаем base URL из import URL
-            base_url = self.vm_import_url.rsplit('/api/', 1)[0]
-            response = requests.get(f"{base_url}/-/healthy", timeout=5)
+            base_url = vm_import_url.rsplit('/api/', 1)[0]
+            response = get_session().get(f"{base_url}/-/healthy", timeout=vm_timeout(5))
             if response.status_code == 200:
-                logger.info("✅ VictoriaMetrics доступен")
+                logger.info(f"✅ VictoriaMetrics доступен: {base_url}")
                 return True
         except Exception as e:
             logger.warning(f"⚠️  Не удалось проверить VM health: {e}")
@@ -264,9 +308,9 @@ class PerfWatcher:
         # Пробуем отправить тестовую метрику
         try:
             test_metric = 'perf_watcher_health{status="ok"} 1\n'
-            response = requests.post(self.vm_import_url, data=test_metric.encode(), timeout=5)
+            response = get_session().post(vm_import_url, data=test_metric.encode(), timeout=vm_timeout(5))
             if response.status_code in (200, 204):
-                logger.info("✅ VictoriaMetrics доступен (проверка через import)")
+                logger.info(f"✅ VictoriaMetrics доступен (проверка через import): {vm_import_url}")
                 return True
         except Exception as e:
             logger.error(f"❌ VictoriaMetrics недоступен: {e}")
@@ -431,55 +475,106 @@ class PerfWatcher:
         logger.info(f"⚙️  Обработка: {tgz_path.name}")
         start_time = time.time()
         
-        # Создаём временную директорию для распаковки
-        temp_dir = Path(f"/tmp/perf_watcher_{os.getpid()}_{time.time()}")
-        temp_dir.mkdir(parents=True, exist_ok=True)
-        
         try:
             # Извлекаем серийный номер из имени файла
             array_sn = extract_serial_from_filename(tgz_path.name)
             
-            # Распаковываем .tgz
-            dat_file = self._extract_tgz(tgz_path, temp_dir)
-            if not dat_file:
+            # Файл с тем же содержимым уже импортирован в этот VM - пропускаем
+            ledger_key = file_ledger_key(tgz_path) if self.ledger else None
+            if ledger_key and not self.force:
+                entry = self.ledger.lookup(ledger_key, self.vm_import_url)
+                if entry:
+                    self.skipped_count += 1
+                    logger.info(
+                        f"⏭️  {tgz_path.name}: уже импортирован {entry['imported_at']} "
+                        f"({entry['metrics']:,} метрик), пропуск"
+                    )
+                    return True
+            
+            # Проверяем что .tgz читается (.dat стримится без распаковки на диск)
+            if not self._check_tgz(tgz_path):
                 logger.error(f"❌ Не удалось распаковать {tgz_path.name}")
                 return False
             
-            # Парсим и отправляем метрики
-            metrics_sent = 0
-            batches_sent = 0
-            batch = []
+            # Повтор после сбоя отправки продолжает с позиции, подтверждённой VM (checkpoint)
+            position = None
+            checkpoint = None
+            resume = None
+            resumed_metrics = 0
+            if ledger_key:
+                found = None if self.force else self.ledger.checkpoints(ledger_key, self.vm_import_url)
+                # Checkpoints файла, поделённого на части streaming_pipeline, здесь не продолжить
+                resume = found[1].get(0) if found and found[0] == 1 else None
+                position = [0, 0]
+                if resume:
+                    position = [resume['checkpoint']['block'], resume['checkpoint']['series']]
+                    resumed_metrics = resume['metrics']
+                    logger.info(
+                        f"↩️  {tgz_path.name}: продолжение с блока {position[0]}, серии {position[1]} "
+                        f"({resumed_metrics:,} метрик уже отправлено)"
+                    )
+                checkpoint = ImportCheckpoint(self.ledger, ledger_key, self.vm_import_url, metrics=resumed_metrics)
             
-            for metric_line in stream_prometheus_metrics(
-                dat_file, array_sn, self.resources, self.metrics
-            ):
-                batch.append(metric_line)
-                
-                if len(batch) >= self.batch_size:
-                    if send_batch_to_vm(batch, self.vm_import_url):
-                        metrics_sent += len(batch)
-                        batches_sent += 1
-                        batch = []
-                    else:
-                        logger.error(f"❌ Ошибка отправки batch в VM")
-                        return False
+            # Блоки, уже импортированные из предыдущих архивов этого массива, не декодируются
+            imported_blocks = None
+            if self.imported_blocks:
+                imported_blocks = self.imported_blocks.session(array_sn, self.vm_import_url,
+                                                               skip_known=not self.force)
             
-            # Отправляем остаток
-            if batch:
-                if send_batch_to_vm(batch, self.vm_import_url):
-                    metrics_sent += len(batch)
-                    batches_sent += 1
-                else:
-                    logger.error(f"❌ Ошибка отправки последнего batch в VM")
-                    return False
+            # Парсим и отправляем метрики батчами по batch_size метрик или VM_BATCH_BYTES байт
+            # (отправка в потоке uploader'а, пока парсится следующий batch)
+            data_span = [None, None]
+            # Ошибка чтения .tgz обрывает генератор - файл отправлен не целиком
+            read_errors = []
+            uploader = BatchUploader(self.send_url, on_sent=checkpoint.on_sent if checkpoint else None,
+                                     shard_key=shard_key_for(self.sharding, array_sn))
+            
+            try:
+                # Отправлен целиком, но итог не записан - только записать
+                if not (resume and resume['checkpoint']['done']):
+                    uploader.upload(
+                        stream_prometheus_metrics(
+                            tgz_path, array_sn, self.resources, self.metrics, data_span=data_span,
+                            import_format=self.import_format, position=position,
+                            imported_blocks=imported_blocks, errors=read_errors
+                        ),
+                        self.batch_size,
+                        position=(lambda: tuple(position)) if position is not None else None,
+                    )
+            finally:
+                uploaded = uploader.close()
+                if checkpoint:
+                    # После ошибки чтения - только последняя подтверждённая позиция
+                    checkpoint.finish(uploaded and not read_errors, uploader.metrics_sent)
+            metrics_sent = uploader.metrics_sent
+            
+            if not uploaded:
+                logger.error(f"❌ Ошибка отправки batch в VM")
+                return False
+            if read_errors:
+                logger.error(f"❌ {tgz_path.name} прочитан не целиком: {read_errors[0]}")
+                return False
             
             elapsed = time.time() - start_time
             rate = metrics_sent / elapsed if elapsed > 0 else 0
             
             self.total_metrics_sent += metrics_sent
             
+            skipped_info = ''
+            if imported_blocks is not None:
+                imported_blocks.commit()
+                if imported_blocks.skipped:
+                    skipped_info = f", {imported_blocks.skipped:,} блоков уже импортировано"
+            
+            if ledger_key:
+                self.ledger.record(
+                    ledger_key, self.vm_import_url, resumed_metrics + metrics_sent,
+                    data_from=data_span[0] // 1000 if data_span[0] is not None else None,
+                    data_to=data_span[1] // 1000 if data_span[1] is not None else None,
+                )
+            
             logger.info(
-                f"✅ {tgz_path.name}: {metrics_sent:,} метрик за {elapsed:.1f}s "
+                f"✅ {tgz_path.name}: {metrics_sent:,} метрик{skipped_info} за {elapsed:.1f}s "
                 f"({rate:,.0f} m/s) | SN: {array_sn}"
             )
             
@@ -488,46 +583,20 @@ class PerfWatcher:
         except Exception as e:
             logger.error(f"❌ Ошибка обработки {tgz_path.name}: {e}", exc_info=True)
             return False
-            
-        finally:
-            # Cleanup временной директории
-            if temp_dir.exists():
-                try:
-                    shutil.rmtree(temp_dir)
-                except Exception as e:
-                    logger.warning(f"⚠️  Не удалось удалить temp dir: {e}")
     
-    def _extract_tgz(self, tgz_path: Path, temp_dir: Path) -> Optional[Path]:
+    def _check_tgz(self, tgz_path: Path) -> bool:
         """
-        Распаковка .tgz файла.
+        Проверка что .tgz открывается и содержит .dat с полным заголовком.
         
-        Returns:
-            Path к .dat файлу или None при ошибке
+        Читается только начало gzip-потока, на диск ничего не распаковывается.
         """
         try:
-            with tarfile.open(tgz_path, 'r:gz') as tar:
-                names = tar.getnames()
-                
-                if len(names) != 1:
-                    logger.warning(f"⚠️  Неожиданное количество файлов в архиве: {len(names)}")
-                
-                # Извлекаем первый файл (обычно .dat)
-                tar.extractall(temp_dir)
-                
-                # Находим .dat файл
-                dat_files = list(temp_dir.glob("*.dat"))
-                if dat_files:
-                    return dat_files[0]
-                
-                # Если нет .dat, возвращаем первый извлечённый файл
-                extracted = temp_dir / names[0]
-                if extracted.exists():
-                    return extracted
-                    
+            with open_tgz_dat(tgz_path) as fin:
+                return len(fin.read(DAT_FILE_HEADER_SIZE)) == DAT_FILE_HEADER_SIZE
         except Exception as e:
             logger.error(f"❌ Ошибка распаковки {tgz_path}: {e}")
         
-        return None
+        return False
     
     def _shutdown(self):
         """Graceful shutdown."""
@@ -544,6 +613,7 @@ class PerfWatcher:
         logger.info("=" * 80)
         logger.info(f"Обработано файлов:  {self.processed_count}")
         logger.info(f"Ошибок:             {self.failed_count}")
+        logger.info(f"Пропущено (журнал): {self.skipped_count}")
         logger.info(f"Метрик отправлено:  {self.total_metrics_sent:,}")
         logger.info(f"В очереди:          {self.task_queue.qsize()}")
         logger.info("=" * 80)
@@ -560,11 +630,19 @@ def main():
         epilog="""
 Переменные окружения:
   VM_URL                    VictoriaMetrics URL (default: http://victoriametrics:8428)
+  VM_IMPORT_URL             Import URL или несколько через запятую - default --vm-url
+                            (default: $VM_URL/api/v1/import/prometheus)
   WATCH_DIR                 Директория для мониторинга (default: /data/perf-dumps/dumps)
   FILE_WAIT_SECONDS         Задержка перед обработкой (default: 30)
   DELETE_AFTER_PROCESS      Удалять файлы после обработки (default: true)
   BATCH_SIZE                Размер батча метрик (default: 100000)
   MAX_RETRIES               Количество попыток при ошибке (default: 3)
+  IMPORT_LEDGER             Журнал импортов (default: <logs>/import_ledger.jsonl, пусто - выключен)
+  IMPORTED_BLOCKS_DIR       Индекс импортированных блоков (default: <logs>/imported_blocks, пусто - выключен)
+  VM_IMPORT_FORMAT          Формат импорта: prometheus, jsonl (default: prometheus)
+  VM_UPLOAD_THREADS         Потоков отправки batch, 0 - синхронно (default: 1)
+  VM_UPLOAD_QUEUE           Batch в очереди отправки до паузы парсинга (default: 2)
+  VM_BATCH_BYTES            Байт в batch, отправка по этому порогу или BATCH_SIZE (default: 16MB)
 
 Примеры:
   # Запуск с настройками по умолчанию
@@ -575,6 +653,9 @@ def main():
   
   # Запуск без удаления файлов
   python -m parsers.perf_watcher --no-delete
+  
+  # Импортировать заново файлы, уже записанные в журнале импортов
+  python -m parsers.perf_watcher --force
         """
     )
     
@@ -587,8 +668,15 @@ def main():
     parser.add_argument(
         '--vm-url',
         type=str,
-        default=VM_URL,
-        help=f'VictoriaMetrics URL (default: {VM_URL})'
+        default=VM_IMPORT_URL,
+        help=f'VictoriaMetrics URL (базовый или import) или несколько через запятую '
+             f'(default: env VM_IMPORT_URL или {VM_IMPORT_URL})'
+    )
+    parser.add_argument(
+        '--sharding',
+        choices=SHARDING_MODES,
+        default=VM_SHARDING,
+        help=f'Выбор endpoint из списка --vm-url: round-robin или sn - файлы массива на один shard (default: {VM_SHARDING})'
     )
     parser.add_argument(
         '--no-delete',
@@ -602,10 +690,36 @@ def main():
         help=f'Размер батча метрик (default: {BATCH_SIZE})'
     )
     
+    parser.add_argument(
+        '--format',
+        dest='import_format',
+        choices=IMPORT_FORMATS,
+        default=VM_IMPORT_FORMAT,
+        help=f'Формат импорта: prometheus или jsonl - строка на серию, /api/v1/import (default: {VM_IMPORT_FORMAT})'
+    )
+    
+    parser.add_argument(
+        '--ledger',
+        type=str,
+        default=IMPORT_LEDGER,
+        help=f'Журнал импортов, пусто - выключен (default: {IMPORT_LEDGER})'
+    )
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='Импортировать заново файлы, уже записанные в журнале импортов, и уже импортированные блоки'
+    )
+    parser.add_argument(
+        '--dedup-dir',
+        type=str,
+        default=IMPORTED_BLOCKS_DIR,
+        help=f'Индекс импортированных блоков по SN, пусто - выключен (default: {IMPORTED_BLOCKS_DIR})'
+    )
+    
     args = parser.parse_args()
     
-    # Формируем VM import URL
-    vm_import_url = f"{args.vm_url}/api/v1/import/prometheus"
+    # Формируем VM import URL (для каждого endpoint списка)
+    vm_import_url = import_url(args.vm_url, 'prometheus')
     
     # Создаём и запускаем watcher
     watcher = PerfWatcher(
@@ -613,6 +727,11 @@ def main():
         vm_import_url=vm_import_url,
         batch_size=args.batch_size,
         delete_after_process=not args.no_delete,
+        ledger_path=args.ledger,
+        force=args.force,
+        dedup_dir=args.dedup_dir,
+        import_format=args.import_format,
+        sharding=args.sharding,
     )
     
     success = watcher.start()
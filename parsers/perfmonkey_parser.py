@@ -13,17 +13,11 @@ Usage:
 
 import argparse
 import logging
-import os
 import re
-import struct
 import sys
-import tarfile
 import time
-import zipfile
-import shutil
 from collections import defaultdict
 from concurrent.futures import ProcessPoolExecutor, as_completed
-from datetime import datetime, timedelta
 from pathlib import Path
 from typing import Dict, List
 from multiprocessing import Manager, cpu_count
@@ -32,6 +26,8 @@ from tqdm import tqdm
 
 # Импорт словарей из parsers/dictionaries/
 from parsers.dictionaries import METRIC_NAME_DICT, RESOURCE_NAME_DICT
+from parsers.dat_decoder import list_zip_tgz_members, format_timestamps, get_column_index
+from parsers.block_cache import iter_source_blocks, BLOCK_CACHE_DIR
 
 # Setup logging
 logging.basicConfig(
@@ -40,6 +36,9 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Формат даты в CSV для PerfMonkey (UTC)
+PERFMONKEY_TIME_FORMAT = '%m/%d/%y %H:%M:%S'
+
 # Resource configuration - ALL METRICS for each resource type
 RESOURCE_CONFIG = {
     '207': {  # Controller
@@ -227,61 +226,6 @@ RESOURCE_CONFIG = {
 }
 
 
-def construct_data_header(result):
-    """Построить заголовок данных."""
-    data_header = {}
-    if result:
-        result = result.groups()
-        map_header = result[0]
-        map_content = result[1]
-
-        list_map_header = map_header.split(",")
-        for each_key in list_map_header:
-            list_key_value = each_key.split(":")
-            map_key = list_key_value[0].replace('"', '')
-            map_value = list_key_value[1].replace('"', '')
-            data_header[map_key] = map_value.strip()
-
-        data_header['Map'] = []
-        result = re.findall(
-            '"([0-9]+)":{"IDs":\\[(("[0-9a-zA-Z]+",?)+)\\],'
-            '"Names":\\[(("[.0-9A-Za-z$ \\[\\]\\(\\):_-]*",?)+)\\],'
-            '"DataTypes":\\[(([0-9]+,?)+)\\]}',
-            map_content
-        )
-        if result:
-            for each_result in result:
-                object_type = {}
-                object_type['ObjectTypes'] = each_result[0]
-                object_type['IDs'] = each_result[1].replace('"', '').split(',')
-                object_type['Names'] = each_result[3].replace('"', '').split(',')
-                object_type['DataTypes'] = each_result[5].replace('"', '').split(',')
-                data_header['Map'].append(object_type)
-    return data_header
-
-
-def construct_data_type(data_header):
-    """Построить структуру типов данных."""
-    list_data_type = []
-    size_collect_once = 0
-    if 'Map' in data_header:
-        for resource_type in data_header['Map']:
-            size_collect_once += (
-                len(resource_type['IDs']) *
-                len(resource_type['DataTypes']) * 4
-            )
-            for index_ids, _ in enumerate(resource_type['IDs']):
-                for index_data_type in resource_type['DataTypes']:
-                    list_index = [
-                        resource_type['ObjectTypes'],
-                        index_data_type,
-                        resource_type['Names'][index_ids], []
-                    ]
-                    list_data_type.append(list_index)
-
-    return list_data_type, size_collect_once
-
-
 def extract_serial_from_filename(filename: str) -> str:
     """Extract serial number from filename."""
     # Try pattern like: PerfData_OceanStorDorado5000V6_SN_2102355TJUFSQ4100015_SP0_...
@@ -347,110 +291,59 @@ def parse_element_metadata(element: str, resource_id: str) -> dict:
     return metadata
 
 
-def process_perf_file_to_wide_format(file_path: Path, serial_number: str) -> Dict[str, dict]:
+# Выборка PerfMonkey: resource_id -> набор нужных metric_id (для индекса колонок)
+PERFMONKEY_SELECTION = {
+    resource_id: frozenset(config['metrics'])
+    for resource_id, config in RESOURCE_CONFIG.items()
+}
+
+
+def is_perfmonkey_column(resource_id: str, metric_id: str) -> bool:
+    """Нужна ли серия в выгрузке PerfMonkey (известный ресурс и метрика из его конфига)."""
+    return metric_id in PERFMONKEY_SELECTION.get(resource_id, ())
+
+
+def new_wide_format() -> dict:
+    """Пустая wide-структура: resource_id -> element -> timestamp -> {metric_id: value}."""
+    return defaultdict(lambda: defaultdict(lambda: defaultdict(dict)))
+
+
+def add_block_to_wide_format(block, result: dict):
+    """Добавить серии PerfMonkey из декодированного блока в wide-структуру result."""
+    # Генерируем timestamps (UTC, MM/DD/YY HH:MM:SS) - один раз на блок
+    time_list = format_timestamps(block.timestamps_ms, PERFMONKEY_TIME_FORMAT)
+
+    # Забираем только известные ресурсы и метрики из их конфига
+    columns = get_column_index(block.layout, 'perfmonkey', is_perfmonkey_column)
+    
+    # Организуем данные по ресурсам/элементам/timestamp/метрикам
+    for column, series_values in zip(columns.tolist(), block.select(columns)):
+        resource_id, metric_id, element = block.list_data_type[column]
+        
+        for timestamp, point_value in zip(time_list, series_values.tolist()):
+            result[resource_id][element][timestamp][metric_id] = str(point_value)
+
+
+def process_perf_file_to_wide_format(file_path: Path, serial_number: str, cache_dir: str = None) -> Dict[str, dict]:
     """
-    Парсинг бинарного файла и возврат данных в wide format.
+    Парсинг бинарного файла (.dat или .tgz - потоково, без распаковки) и возврат данных в wide format.
+    С cache_dir (или BLOCK_CACHE_DIR) блоки читаются из кэша декодированных блоков.
     
     Returns:
         Dict {
             resource_id: {
                 element_name: {
-                    timestamp: {metric_id: value, ...}
+                    timestamp: {metric_id: value, ...}  # timestamp - строка MM/DD/YY HH:MM:SS
                 }
             }
         }
     """
-    result = defaultdict(lambda: defaultdict(lambda: defaultdict(dict)))
+    result = new_wide_format()
     
     try:
-        with open(file_path, "rb") as fin:
-            bit_correct = fin.read(32)
-            bit_msg_version = fin.read(4)
-            bit_equip_sn = fin.read(256).decode('utf-8')
-            bit_equip_name = fin.read(41).decode('utf-8')
-            bit_equip_data_length = fin.read(4)
-
-            process_finish_flag = False
-
-            bit_map_type = fin.read(4)
-            bit_map_length, = struct.unpack("<l", fin.read(4))
-            bit_map_value = fin.read(bit_map_length - 8)
-            
-            if len(bit_map_value) < bit_map_length - 8:
-                logger.error(f"Read Data Header Failed for {file_path}")
-                return None
-
-            while not process_finish_flag:
-                result_re = re.match(
-                    '{(.*),"Map":{(.*)}}', bit_map_value.decode('utf-8')
-                )
-                data_header = construct_data_header(result_re)
-                list_data_type, size_collect_once = construct_data_type(data_header)
-
-                times_collect = int(
-                    (int(data_header['EndTime']) - int(data_header['StartTime'])) /
-                    int(data_header['Archive'])
-                )
-
-                # Читаем данные блоками
-                for i in range(times_collect):
-                    buffer_read = fin.read(size_collect_once)
-                    if len(buffer_read) < size_collect_once:
-                        process_finish_flag = True
-                        break
-                    
-                    for index_in_buffer in range(0, size_collect_once, 4):
-                        bytes_read_4 = buffer_read[index_in_buffer: index_in_buffer + 4]
-                        bytes_read_int, = struct.unpack("<l", bytes_read_4)
-                        list_data_type[int(index_in_buffer / 4)][3].append(str(bytes_read_int))
-
-                # Генерируем timestamps
-                start_time = datetime.fromtimestamp(int(data_header['StartTime']))
-                next_time = start_time
-                time_list = []
-                for i, _ in enumerate(list_data_type[0][3]):
-                    time_list.append(next_time)
-                    next_time += timedelta(seconds=int(data_header['Archive']))
-
-                # Организуем данные по ресурсам/элементам/timestamp/метрикам
-                for data_type in list_data_type:
-                    resource_id = str(data_type[0])
-                    metric_id = str(data_type[1])
-                    element = data_type[2]
-                    
-                    # Пропускаем неизвестные ресурсы
-                    if resource_id not in RESOURCE_CONFIG:
-                        continue
-                    
-                    # Сохраняем только нужные метрики
-                    if metric_id not in RESOURCE_CONFIG[resource_id]['metrics']:
-                        continue
-                    
-                    for index, point_value in enumerate(data_type[3]):
-                        try:
-                            timestamp = time_list[index]
-                            result[resource_id][element][timestamp][metric_id] = point_value
-                        except (ValueError, IndexError):
-                            continue
-
-                # Очищаем память
-                for data_type in list_data_type:
-                    data_type[3].clear()
-
-                bit_map_type = fin.read(4)
-                if bit_map_type == b'':
-                    process_finish_flag = True
-                elif bit_map_type == b'\x00\x00\x00\x00':
-                    bit_map_length, = struct.unpack("<l", fin.read(4))
-                    if bit_map_length < 8:
-                        process_finish_flag = True
-                    else:
-                        bit_map_value = fin.read(bit_map_length - 8)
-                        if len(bit_map_value) < bit_map_length - 8:
-                            return None
-                else:
-                    process_finish_flag = True
-                    
+        for block in iter_source_blocks(file_path, cache_dir=cache_dir, resources=PERFMONKEY_SELECTION):
+            add_block_to_wide_format(block, result)
+                
     except Exception as exc_info:
         logger.error(f"Error processing {file_path}: {exc_info}")
         return None
@@ -458,11 +351,6 @@ def process_perf_file_to_wide_format(file_path: Path, serial_number: str) -> Dic
     return result
 
 
-def format_timestamp(dt: datetime) -> str:
-    """Format timestamp as MM/DD/YY HH:MM:SS"""
-    return dt.strftime('%m/%d/%y %H:%M:%S')
-
-
 def write_wide_format_csv(data: dict, serial_number: str, output_dir: Path, file_locks: dict):
     """
     Write data in wide format to CSV files.
@@ -494,9 +382,8 @@ def write_wide_format_csv(data: dict, serial_number: str, output_dir: Path, file
                 # Формируем строку БЕЗ номера - добавим его позже после сортировки
                 row_parts = [config['prefix'], '']  # Пустое место для номера
                 
-                # Даты
-                time_str = format_timestamp(timestamp)
-                row_parts.extend([time_str, time_str])
+                # Даты (timestamp уже в формате MM/DD/YY HH:MM:SS)
+                row_parts.extend([timestamp, timestamp])
                 
                 # Serial
                 row_parts.append(serial_number)
@@ -529,45 +416,16 @@ def write_wide_format_csv(data: dict, serial_number: str, output_dir: Path, file
     return stats
 
 
-def decompress_tgz(file_tgz: Path) -> Path:
-    """Распаковать .tgz файл."""
-    tar = tarfile.open(file_tgz)
-    names = tar.getnames()
-    temp_file_path = Path("temp") / f"temp_{os.getpid()}_{time.time()}"
-    temp_file_path.mkdir(parents=True, exist_ok=True)
-    
-    if len(names) == 1:
-        tar.extract(names[0], temp_file_path)
-        return temp_file_path / names[0]
-    
-    logger.error(f"perf file content error: {file_tgz}")
-    return None
-
-
 def process_single_tgz_worker(args):
     """Worker для обработки одного .tgz файла."""
-    tgz_file, output_dir, file_locks = args
+    tgz_file, output_dir, file_locks, cache_dir = args
     
     try:
         # Extract serial from filename
         serial_number = extract_serial_from_filename(tgz_file.name)
         
-        # Decompress
-        decompressed_file = decompress_tgz(tgz_file)
-        if not decompressed_file:
-            return {'success': False, 'stats': {}}
-        
-        # Process to wide format
-        wide_data = process_perf_file_to_wide_format(decompressed_file, serial_number)
-        
-        # Cleanup decompressed file
-        if decompressed_file.exists():
-            decompressed_file.unlink()
-            if decompressed_file.parent.exists():
-                try:
-                    decompressed_file.parent.rmdir()
-                except:
-                    pass
+        # Process to wide format (.tgz is streamed, nothing is extracted to disk)
+        wide_data = process_perf_file_to_wide_format(tgz_file, serial_number, cache_dir)
         
         if wide_data is None:
             return {'success': False, 'stats': {}}
@@ -582,23 +440,6 @@ def process_single_tgz_worker(args):
         return {'success': False, 'stats': {}}
 
 
-def decompress_zip(zip_path: Path, extract_to: Path = None):
-    """Распаковать ZIP архив."""
-    if extract_to is None:
-        extract_to = Path("temp_zip_extract")
-    
-    if extract_to.exists():
-        shutil.rmtree(extract_to)
-    extract_to.mkdir(parents=True)
-    
-    logger.info(f"Extracting zip archive {zip_path} to {extract_to}")
-    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-        zip_ref.extractall(extract_to)
-    
-    logger.info(f"Successfully extracted zip archive to {extract_to}")
-    return extract_to
-
-
 def create_csv_headers(output_dir: Path):
     """Create CSV headers for all resource types."""
     for resource_id, config in RESOURCE_CONFIG.items():
@@ -688,7 +529,8 @@ def sort_and_renumber_csv_files(output_dir: Path):
             raise
 
 
-def process_archive(archive_path: str, output_dir: str, workers: int = None, verbose: bool = False):
+def process_archive(archive_path: str, output_dir: str, workers: int = None, verbose: bool = False,
+                    cache_dir: str = None):
     """Основная функция обработки."""
     if verbose:
         logger.setLevel(logging.DEBUG)
@@ -706,23 +548,17 @@ def process_archive(archive_path: str, output_dir: str, workers: int = None, ver
     logger.info(f"Workers: {workers}")
     logger.info("="*80)
     
-    # Распаковка ZIP если нужно
-    temp_extract_dir = None
+    # Находим .tgz файлы (ZIP не распаковываем - workers читают members напрямую)
     if archive_path.is_file() and archive_path.suffix.lower() == '.zip':
-        temp_extract_dir = decompress_zip(archive_path)
-        search_path = temp_extract_dir
+        tgz_files = list_zip_tgz_members(archive_path)
     elif archive_path.is_dir():
-        search_path = archive_path
+        tgz_files = list(archive_path.rglob("*.tgz"))
     else:
         logger.error(f"{archive_path} is not a valid path or zip file!")
         return
     
-    # Находим .tgz файлы
-    tgz_files = list(search_path.rglob("*.tgz"))
     if not tgz_files:
         logger.error("No .tgz files found!")
-        if temp_extract_dir and temp_extract_dir.exists():
-            shutil.rmtree(temp_extract_dir)
         return
     
     logger.info(f"Found {len(tgz_files)} .tgz files")
@@ -741,7 +577,7 @@ def process_archive(archive_path: str, output_dir: str, workers: int = None, ver
     logger.info(f"Processing {len(tgz_files)} files with {workers} workers...")
     
     all_stats = []
-    process_args = [(tgz, output_dir, file_locks) for tgz in tgz_files]
+    process_args = [(tgz, output_dir, file_locks, cache_dir) for tgz in tgz_files]
     
     start_time = time.time()
     
@@ -793,20 +629,6 @@ def process_archive(archive_path: str, output_dir: str, workers: int = None, ver
     sort_and_renumber_csv_files(output_dir)
     
     logger.info(f"✓ Complete! Output: {output_dir}")
-    
-    # Cleanup
-    if temp_extract_dir and temp_extract_dir.exists():
-        logger.info(f"Cleaning up {temp_extract_dir}")
-        shutil.rmtree(temp_extract_dir)
-    
-    temp_path = Path("temp")
-    if temp_path.exists():
-        for item in temp_path.iterdir():
-            if item.is_dir() and item.name.startswith("temp_"):
-                try:
-                    shutil.rmtree(item)
-                except:
-                    pass
 
 
 def main():
@@ -850,6 +672,13 @@ Features:
         help='Enable verbose logging'
     )
     
+    parser.add_argument(
+        '--cache-dir',
+        default=BLOCK_CACHE_DIR or None,
+        help='Decoded block cache directory (.npz): the first run fills it, '
+             're-exports read it without decompression (default: $BLOCK_CACHE_DIR)'
+    )
+    
     args = parser.parse_args()
     
     try:
@@ -857,7 +686,8 @@ Features:
             archive_path=args.archive,
             output_dir=args.output,
             workers=args.workers,
-            verbose=args.verbose
+            verbose=args.verbose,
+            cache_dir=args.cache_dir
         )
     except KeyboardInterrupt:
         logger.warning("\nInterrupted by user")
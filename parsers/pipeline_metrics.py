@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+PIPELINE METRICS: время стадий pipeline -> huperf_pipeline_* в VictoriaMetrics.
+
+ResourceMonitor печатает одну сводку в конце запуска - на долгом импорте
+не видно, куда уходит время. Каждый процесс копит время стадий:
+
+    extract   - чтение и распаковка .dat (gzip/tar/zip, диск, .npz кэш блоков)
+    header    - разбор карты header-блока (JSON, раскладка колонок)
+    decode    - сэмплы блока в массив (окно --from/--to, сборка блока)
+    encode    - серии блока в текст Prometheus / JSON Lines
+    compress  - сжатие тела запроса (gzip/zstd)
+    send      - HTTP запрос к VM до ответа
+
+и счётчики: блоки, строки сэмплов и байты .dat, метрики, запросы, байты тел
+запросов до и после сжатия. Время стадии исключительное: вложенная стадия
+(распаковка внутри декодирования, сжатие потока внутри отправки) ставит
+внешнюю на паузу. Это время потоков: потоки отправки работают параллельно
+декодеру, и сумма стадий больше длительности запуска.
+
+Worker отдаёт приращения с SN текущего файла главному процессу
+(multiprocessing.SimpleQueue) раз в PIPELINE_METRICS_SECONDS и в конце
+каждой задачи; PipelineMetrics суммирует их и отправляет в VM счётчики
+    huperf_pipeline_stage_seconds_total{job="streaming_pipeline",SN="...",stage="encode"}
+    huperf_pipeline_rows_total{job="streaming_pipeline",SN="..."}
+    ...
+Панель Grafana: sum by (stage) (rate(huperf_pipeline_stage_seconds_total[1m])).
+
+Настройки (env):
+    PIPELINE_METRICS_SECONDS  - интервал отправки, секунды; 0 - не отправлять (default: 0)
+    PIPELINE_METRICS_JOB      - label job (default: streaming_pipeline)
+"""
+
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+PIPELINE_METRICS_SECONDS = float(os.getenv("PIPELINE_METRICS_SECONDS", "0"))
+PIPELINE_METRICS_JOB = os.getenv("PIPELINE_METRICS_JOB", "streaming_pipeline")
+
+STAGES = ('extract', 'header', 'decode', 'encode', 'compress', 'send')
+
+# Счётчик -> имя серии (huperf_pipeline_<name>_total)
+COUNTERS = {
+    'blocks': 'blocks',
+    'rows': 'rows',
+    'dat_bytes': 'dat_bytes',
+    'samples': 'samples',
+    'batches': 'requests',
+    'retries': 'retries',
+    'payload_bytes': 'payload_bytes',
+    'wire_bytes': 'wire_bytes',
+}
+
+T = TypeVar('T')
+
+# Приращения процесса с последнего take_stats(): стадия или счётчик -> значение
+_pending: Dict[str, float] = {}
+_pending_lock = threading.Lock()
+# Стек стадий потока: [[стадия, начало отрезка], ...]
+_local = threading.local()
+
+# Worker: куда отдавать приращения и SN текущей задачи
+_queue = None
+_task_sn: Optional[str] = None
+_report_lock = threading.Lock()
+_reporter: Optional[threading.Thread] = None
+
+
+def _add(name: str, value: float):
+    with _pending_lock:
+        _pending[name] = _pending.get(name, 0) + value
+
+
+def count(**values: float):
+    """Прибавить к счётчикам процесса: count(rows=15, dat_bytes=4096)."""
+    with _pending_lock:
+        for name, value in values.items():
+            if value:
+                _pending[name] = _pending.get(name, 0) + value
+
+
+class _Stage:
+    """Замер стадии в потоке; вложенная стадия ставит внешнюю на паузу."""
+
+    __slots__ = ('name',)
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        now = time.perf_counter()
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        elif stack:
+            outer = stack[-1]
+            _add(outer[0], now - outer[1])
+        stack.append([self.name, now])
+        return self
+
+    def __exit__(self, *exc_info):
+        now = time.perf_counter()
+        stack = _local.stack
+        name, started = stack.pop()
+        _add(name, now - started)
+        if stack:
+            stack[-1][1] = now
+        return False
+
+
+def stage(name: str) -> _Stage:
+    """
+    Замер стадии: with stage('extract'): ...
+
+    Время вложенной стадии не входит во внешнюю (стек стадий на поток).
+    """
+    return _Stage(name)
+
+
+def timed(iterable: Iterable[T], name: str) -> Iterator[T]:
+    """Итерация с замером стадии name на каждом next() (время потребителя не входит)."""
+    iterator = iter(iterable)
+    end = object()
+    while True:
+        with _Stage(name):
+            item = next(iterator, end)
+        if item is end:
+            return
+        yield item
+
+
+def take_stats() -> Dict[str, float]:
+    """Забрать приращения процесса (стадии и счётчики) и обнулить их."""
+    global _pending
+    with _pending_lock:
+        taken, _pending = _pending, {}
+    return taken
+
+
+def _report():
+    """Отдать приращения главному процессу с SN текущей задачи (вне задачи - отбросить)."""
+    with _report_lock:
+        taken = take_stats()
+        if _queue is not None and _task_sn is not None and taken:
+            _queue.put((_task_sn, taken))
+
+
+def _report_loop(interval: float):
+    while True:
+        time.sleep(interval)
+        _report()
+
+
+def set_metrics_queue(metrics_queue, interval: float = 0):
+    """
+    Куда worker отдаёт приращения (PipelineMetrics.queue; None - никуда).
+
+    interval > 0 - ещё и раз в interval секунд из фонового потока, чтобы
+    долгий файл был виден до конца задачи. Вызывается в initializer пула.
+    """
+    global _queue, _reporter
+    _queue = metrics_queue
+    take_stats()
+    if metrics_queue is not None and interval > 0 and _reporter is None:
+        _reporter = threading.Thread(target=_report_loop, args=(interval,), daemon=True)
+        _reporter.start()
+
+
+def begin_task(array_sn: str):
+    """Начало задачи worker'а: дальнейшие приращения относятся к SN."""
+    global _task_sn
+    _report()
+    with _report_lock:
+        _task_sn = array_sn
+
+
+def end_task():
+    """Конец задачи: отдать приращения (синхронно - пул может завершить процесс сразу после)."""
+    global _task_sn
+    _report()
+    with _report_lock:
+        _task_sn = None
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class PipelineMetrics:
+    """
+    Сумма приращений workers по SN (главный процесс) и отправка в VM.
+
+    queue передаётся workers через initializer пула (set_metrics_queue).
+    send(lines, vm_url) -> bool отправляет строки Prometheus (vm_sender.send_batch_to_vm);
+    без vm_url или с interval 0 метрики только копятся для итога (stage_seconds).
+    """
+
+    def __init__(self, vm_url: Optional[str] = None,
+                 send: Optional[Callable[[List[bytes], str], bool]] = None,
+                 interval: float = PIPELINE_METRICS_SECONDS, job: str = PIPELINE_METRICS_JOB):
+        self.vm_url = vm_url
+        self.send = send
+        self.interval = interval
+        self.job = job
+        self.queue = multiprocessing.SimpleQueue()
+        self.pushes = 0
+        self.push_errors = 0
+        self._totals: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._reader = threading.Thread(target=self._read_loop, daemon=True)
+        self._reader.start()
+        self._pusher = None
+        if vm_url and send is not None and interval > 0:
+            self._pusher = threading.Thread(target=self._push_loop, daemon=True)
+            self._pusher.start()
+
+    def _read_loop(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            self.add(*item)
+
+    def _push_loop(self):
+        while not self._stopped.wait(self.interval):
+            self.push()
+
+    def add(self, array_sn: str, stats: Dict[str, float]):
+        """Прибавить приращения worker'а (take_stats) к итогам SN."""
+        with self._lock:
+            totals = self._totals.setdefault(array_sn, {})
+            for name, value in stats.items():
+                totals[name] = totals.get(name, 0) + value
+
+    def totals(self) -> Dict[str, Dict[str, float]]:
+        """Итоги по SN: {SN: {стадия или счётчик: значение}}."""
+        with self._lock:
+            return {array_sn: dict(totals) for array_sn, totals in self._totals.items()}
+
+    def stage_seconds(self) -> Dict[str, float]:
+        """Время стадий по всем SN, секунды."""
+        totals = self.totals()
+        return {name: sum(sn_totals.get(name, 0) for sn_totals in totals.values()) for name in STAGES}
+
+    def lines(self, timestamp_ms: Optional[int] = None) -> List[bytes]:
+        """Строки Prometheus huperf_pipeline_* с накопленными счётчиками."""
+        if timestamp_ms is None:
+            timestamp_ms = int(time.time() * 1000)
+        lines = []
+        for array_sn, totals in sorted(self.totals().items()):
+            labels = f'job="{self.job}",SN="{array_sn}"'
+            for name in STAGES:
+                lines.append(f'huperf_pipeline_stage_seconds_total{{{labels},stage="{name}"}} '
+                             f'{_format_value(totals.get(name, 0))} {timestamp_ms}\n'.encode('utf-8'))
+            for name, metric in COUNTERS.items():
+                lines.append(f'huperf_pipeline_{metric}_total{{{labels}}} '
+                             f'{_format_value(totals.get(name, 0))} {timestamp_ms}\n'.encode('utf-8'))
+        return lines
+
+    def push(self) -> bool:
+        """Отправить текущие итоги в VM (ошибка только в лог - импорт не прерывается)."""
+        lines = self.lines()
+        if not lines or not self.vm_url or self.send is None:
+            return True
+        try:
+            sent = self.send(lines, self.vm_url)
+        except Exception as e:
+            logger.warning(f"Could not push pipeline metrics: {e}")
+            sent = False
+        if sent:
+            self.pushes += 1
+        else:
+            self.push_errors += 1
+        return sent
+
+    def close(self) -> bool:
+        """Дочитать приращения (пул уже завершён), остановить потоки и отправить итог."""
+        self.queue.put(None)
+        self._reader.join()
+        self._stopped.set()
+        if self._pusher is not None:
+            self._pusher.join()
+            return self.push()
+        return True
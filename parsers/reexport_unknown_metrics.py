@@ -13,15 +13,20 @@
 """
 
 import sys
-import json
+import time
 import argparse
-import subprocess
 from pathlib import Path
 
+import requests
+
 # Импорт словарей
 sys.path.insert(0, str(Path(__file__).parent / "dictionaries"))
 from METRIC_DICT import METRIC_NAME_DICT
 
+# Общий отправитель в VM (пул keep-alive соединений)
+sys.path.insert(0, str(Path(__file__).parent))
+from vm_sender import get_session, send_payload, vm_timeout
+
 # Функция sanitize из streaming_pipeline
 def sanitize_metric_name(name: str) -> str:
     """Преобразует название метрики в формат Prometheus."""
@@ -51,19 +56,23 @@ def discover_unknown_metrics() -> dict:
     Returns:
         dict: {metric_id: old_metric_name} для метрик, которые можно реэкспортировать
     """
-    import re
-    
     # Получаем все имена метрик из VM за последние 120 дней
-    cmd = f'''curl -s "{vm_url}/api/v1/label/__name__/values?start=$(date -d '120 days ago' +%s)&end=$(date +%s)" | jq -r '.data[]' '''
-    result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-    
-    if result.returncode != 0:
+    now = int(time.time())
+    try:
+        response = get_session().get(
+            f"{vm_url}/api/v1/label/__name__/values",
+            params={"start": now - 120 * 86400, "end": now},
+            timeout=vm_timeout(),
+        )
+        response.raise_for_status()
+        metric_names = response.json().get("data", [])
+    except (requests.RequestException, ValueError):
         print(f"⚠️  Ошибка получения списка метрик из VM")
         return {}
     
     unknown_metrics = {}
     
-    for line in result.stdout.strip().split('\n'):
+    for line in metric_names:
         if line.startswith(UNKNOWN_METRIC_PREFIX):
             # Извлекаем ID из имени: huawei_unknown_metric_1212 → 1212
             metric_id = line.replace(UNKNOWN_METRIC_PREFIX, "")
@@ -87,33 +96,33 @@ def get_new_metric_name(metric_id: str) -> str:
 
 def export_metric(old_name: str) -> str:
     """Экспортировать метрику из VM."""
-    cmd = f'curl -s "{vm_url}/api/v1/export?match[]={old_name}"'
-    result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-    return result.stdout
+    try:
+        response = get_session().get(f"{vm_url}/api/v1/export", params={"match[]": old_name},
+                                     timeout=vm_timeout())
+        response.raise_for_status()
+        return response.text
+    except requests.RequestException:
+        return ""
 
 
 def import_metric(data: str) -> bool:
     """Импортировать данные в VM."""
-    cmd = f'curl -s -X POST "{vm_url}/api/v1/import" --data-binary @-'
-    result = subprocess.run(cmd, shell=True, input=data, capture_output=True, text=True)
-    return result.returncode == 0
+    return send_payload(data, f"{vm_url}/api/v1/import")
 
 
 def delete_metric(metric_name: str) -> bool:
     """Удалить метрику из VM."""
-    cmd = f'curl -s -X POST "{vm_url}/api/v1/admin/tsdb/delete_series?match[]={metric_name}"'
-    result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-    return result.returncode == 0
+    try:
+        response = get_session().post(f"{vm_url}/api/v1/admin/tsdb/delete_series",
+                                      params={"match[]": metric_name}, timeout=vm_timeout())
+        return response.status_code in (200, 204)
+    except requests.RequestException:
+        return False
 
 
 def count_series(metric_name: str) -> int:
     """Подсчитать количество time series для метрики."""
-    cmd = f'curl -s "{vm_url}/api/v1/export?match[]={metric_name}" | wc -l'
-    result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-    try:
-        return int(result.stdout.strip())
-    except:
-        return 0
+    return len(export_metric(metric_name).splitlines())
 
 
 def main():
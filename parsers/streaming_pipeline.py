@@ -14,27 +14,28 @@ STREAMING PIPELINE: Huawei Performance Data → VictoriaMetrics
 import sys
 import os
 import re
-import struct
-import tarfile
-import zipfile
 import time
 import argparse
 import logging
 import uuid
 import json
+import queue
+import threading
 from logging.handlers import RotatingFileHandler
 from pathlib import Path
 
 # Поддержка .7z архивов
 try:
     import py7zr
+    from py7zr.callbacks import ExtractCallback
     PY7ZR_AVAILABLE = True
 except ImportError:
     PY7ZR_AVAILABLE = False
-from datetime import datetime, timedelta
 from multiprocessing import Pool, cpu_count, Manager
-import requests
-from typing import Generator, Tuple
+from datetime import datetime, timezone
+from typing import Generator, NamedTuple, Tuple
+
+import numpy as np
 import shutil
 
 try:
@@ -48,33 +49,87 @@ except ImportError:
 # Поддержка запуска как модуля и напрямую
 try:
     from parsers.dictionaries import METRIC_NAME_DICT, RESOURCE_NAME_DICT, METRIC_CONVERSION
+    from parsers.dat_decoder import (
+        list_zip_tgz_members, get_column_index, parse_time_bound,
+        source_size, split_parts, SPLIT_MIN_BYTES,
+    )
+    from parsers.block_cache import iter_source_blocks, BLOCK_CACHE_DIR
+    from parsers.block_dedup import ImportedBlockIndex, IMPORTED_BLOCKS_DIR
+    from parsers.import_ledger import (
+        ImportCheckpoint, ImportLedger, IMPORT_LEDGER, ledger_key, zip_member_ledger_keys,
+    )
+    from parsers.vm_sender import (
+        COMPRESSION_ALGORITHMS, IMPORT_FORMATS, SHARDING_MODES, VM_COMPRESSION, VM_COMPRESSION_LEVEL,
+        VM_IMPORT_FORMAT, VM_BATCH_BYTES, VM_SHARDING, VM_UPLOAD_QUEUE, VM_UPLOAD_THREADS, BatchUploader,
+        compression_settings, configure_compression, get_send_stats, import_url, parse_endpoints,
+        send_batch_to_vm, set_ingest_controller, shard_key_for,
+    )
+    from parsers.ingest_controller import IngestController, INGEST_TARGET_LATENCY
+    from parsers.pipeline_metrics import (
+        PipelineMetrics, PIPELINE_METRICS_SECONDS, begin_task, count as count_stats, end_task,
+        set_metrics_queue, stage, timed,
+    )
+    from parsers.block_sinks import (
+        CsvSink, PerfmonkeySink, create_perfmonkey_output, finish_perfmonkey_output, parse_targets,
+    )
 except ImportError:
     # Запуск напрямую из директории parsers или корня проекта
     sys.path.insert(0, str(Path(__file__).parent))
     sys.path.insert(0, str(Path(__file__).parent.parent))
     from dictionaries import METRIC_NAME_DICT, RESOURCE_NAME_DICT, METRIC_CONVERSION
+    from dat_decoder import (
+        list_zip_tgz_members, get_column_index, parse_time_bound,
+        source_size, split_parts, SPLIT_MIN_BYTES,
+    )
+    from block_cache import iter_source_blocks, BLOCK_CACHE_DIR
+    from block_dedup import ImportedBlockIndex, IMPORTED_BLOCKS_DIR
+    from import_ledger import (
+        ImportCheckpoint, ImportLedger, IMPORT_LEDGER, ledger_key, zip_member_ledger_keys,
+    )
+    from vm_sender import (
+        COMPRESSION_ALGORITHMS, IMPORT_FORMATS, SHARDING_MODES, VM_COMPRESSION, VM_COMPRESSION_LEVEL,
+        VM_IMPORT_FORMAT, VM_BATCH_BYTES, VM_SHARDING, VM_UPLOAD_QUEUE, VM_UPLOAD_THREADS, BatchUploader,
+        compression_settings, configure_compression, get_send_stats, import_url, parse_endpoints,
+        send_batch_to_vm, set_ingest_controller, shard_key_for,
+    )
+    from ingest_controller import IngestController, INGEST_TARGET_LATENCY
+    from pipeline_metrics import (
+        PipelineMetrics, PIPELINE_METRICS_SECONDS, begin_task, count as count_stats, end_task,
+        set_metrics_queue, stage, timed,
+    )
+    from block_sinks import (
+        CsvSink, PerfmonkeySink, create_perfmonkey_output, finish_perfmonkey_output, parse_targets,
+    )
 
 # Настройка логирования с ротацией (50MB max, 5 backups = ~300MB total)
 LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(50 * 1024 * 1024)))  # 50MB
 LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
 
-file_handler = RotatingFileHandler(
-    'streaming_pipeline.log',
-    maxBytes=LOG_MAX_BYTES,
-    backupCount=LOG_BACKUP_COUNT,
-    encoding='utf-8'
-)
-file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-
-stream_handler = logging.StreamHandler(sys.stdout)
-stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-
-logging.basicConfig(
-    level=logging.INFO,
-    handlers=[file_handler, stream_handler]
-)
 logger = logging.getLogger(__name__)
 
+
+def setup_logging():
+    """
+    Лог в streaming_pipeline.log и stdout - только при запуске CLI (main):
+    импорт модуля (perf_watcher, тесты) не создаёт файлов и не перехватывает
+    настройку логирования.
+    """
+    file_handler = RotatingFileHandler(
+        'streaming_pipeline.log',
+        maxBytes=LOG_MAX_BYTES,
+        backupCount=LOG_BACKUP_COUNT,
+        encoding='utf-8'
+    )
+    file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+
+    logging.basicConfig(
+        level=logging.INFO,
+        handlers=[file_handler, stream_handler]
+    )
+
 # Константы
 BATCH_SIZE = 100000  # Строк в батче для отправки в VM (оптимизировано)
 DEFAULT_RESOURCES = ["207", "212", "225", "216", "266", "10", "11", "21"]
@@ -83,29 +138,55 @@ DEFAULT_METRICS = ["18", "22", "25", "28", "23", "26", "1079", "1073", "627", "1
 
 
 class ResourceMonitor:
-    """Мониторинг использования ресурсов."""
+    """
+    Мониторинг использования ресурсов.
     
-    def __init__(self):
+    Память - RSS главного процесса и workers - замеряется в фоне раз в
+    interval секунд: пик виден, даже если update() вызван один раз в конце.
+    """
+    
+    def __init__(self, interval: float = 5):
         self.start_time = time.time()
         self.start_memory = None
         self.peak_memory = 0
         self.metrics_sent = 0
+        self.raw_bytes = 0
+        self.wire_bytes = 0
+        self._stopped = threading.Event()
         
         if PSUTIL_AVAILABLE:
-            process = psutil.Process()
-            self.start_memory = process.memory_info().rss / (1024**3)  # GB
+            self.start_memory = self.sample_memory()
+            threading.Thread(target=self._sample_loop, args=(interval,), daemon=True).start()
+    
+    def sample_memory(self) -> float:
+        """Замер RSS главного процесса и workers (GB), обновляет пик."""
+        process = psutil.Process()
+        rss = process.memory_info().rss
+        for child in process.children(recursive=True):
+            try:
+                rss += child.memory_info().rss
+            except psutil.Error:
+                pass  # worker уже завершился
+        current_memory = rss / (1024**3)
+        self.peak_memory = max(self.peak_memory, current_memory)
+        return current_memory
     
-    def update(self, metrics_count=0):
-        """Обновить статистику."""
+    def _sample_loop(self, interval: float):
+        while not self._stopped.wait(interval):
+            self.sample_memory()
+    
+    def update(self, metrics_count=0, raw_bytes=0, wire_bytes=0):
+        """Обновить статистику (raw_bytes / wire_bytes - тела запросов к VM до и после сжатия)."""
         self.metrics_sent += metrics_count
+        self.raw_bytes += raw_bytes
+        self.wire_bytes += wire_bytes
         
         if PSUTIL_AVAILABLE:
-            process = psutil.Process()
-            current_memory = process.memory_info().rss / (1024**3)
-            self.peak_memory = max(self.peak_memory, current_memory)
+            self.sample_memory()
     
     def report(self):
         """Вывести отчет."""
+        self._stopped.set()
         elapsed = time.time() - self.start_time
         
         logger.info("="*80)
@@ -113,8 +194,7 @@ class ResourceMonitor:
         logger.info("="*80)
         
         if PSUTIL_AVAILABLE:
-            process = psutil.Process()
-            current_memory = process.memory_info().rss / (1024**3)
+            current_memory = self.sample_memory()
             memory_delta = current_memory - self.start_memory if self.start_memory else 0
             
             logger.info(f"💾 Memory:")
@@ -131,6 +211,14 @@ class ResourceMonitor:
         logger.info(f"   Sent:    {self.metrics_sent:,}")
         logger.info(f"   Rate:    {self.metrics_sent/elapsed:,.0f} metrics/sec")
         
+        if self.wire_bytes:
+            ratio = self.raw_bytes / self.wire_bytes
+            logger.info(f"🌐 Network:")
+            per_sample = self.raw_bytes / self.metrics_sent if self.metrics_sent else 0
+            logger.info(f"   Payload: {self.raw_bytes / (1024**2):,.1f} MB ({per_sample:.1f} bytes/metric)")
+            logger.info(f"   Wire:    {self.wire_bytes / (1024**2):,.1f} MB (ratio {ratio:.1f}x)")
+            logger.info(f"   Rate:    {self.wire_bytes / (1024**2) / elapsed:,.2f} MB/sec on wire")
+        
         logger.info(f"⏱️  Time:    {elapsed:.1f} seconds ({elapsed/60:.1f} minutes)")
         logger.info("="*80)
 
@@ -151,76 +239,243 @@ def sanitize_metric_name(name: str) -> str:
     return result.strip("_")
 
 
-def construct_data_header(result):
-    """Построить заголовок данных."""
-    data_header = {}
-    if result:
-        result = result.groups()
-        map_header = result[0]
-        map_content = result[1]
-
-        list_map_header = map_header.split(",")
-        for each_key in list_map_header:
-            list_key_value = each_key.split(":")
-            map_key = list_key_value[0].replace('"', '')
-            map_value = list_key_value[1].replace('"', '')
-            data_header[map_key] = map_value.strip()
-
-        data_header['Map'] = []
-        result = re.findall(
-            '"([0-9]+)":{"IDs":\\[(("[0-9a-zA-Z]+",?)+)\\],'
-            '"Names":\\[(("[.0-9A-Za-z$ \\[\\]\\(\\):_-]*",?)+)\\],'
-            '"DataTypes":\\[(([0-9]+,?)+)\\]}',
-            map_content
-        )
-        if result:
-            for each_result in result:
-                object_type = {}
-                object_type['ObjectTypes'] = each_result[0]
-                object_type['IDs'] = each_result[1].replace('"', '').split(',')
-                object_type['Names'] = each_result[3].replace('"', '').split(',')
-                object_type['DataTypes'] = each_result[5].replace('"', '').split(',')
-                data_header['Map'].append(object_type)
-    return data_header
-
-
-def construct_data_type(data_header):
-    """Построить структуру типов данных."""
-    list_data_type = []
-    size_collect_once = 0
-    if 'Map' in data_header:
-        for resource_type in data_header['Map']:
-            size_collect_once += (
-                len(resource_type['IDs']) *
-                len(resource_type['DataTypes']) * 4
-            )
-            for index_ids, _ in enumerate(resource_type['IDs']):
-                for index_data_type in resource_type['DataTypes']:
-                    list_index = [
-                        resource_type['ObjectTypes'],
-                        index_data_type,
-                        resource_type['Names'][index_ids], []
-                    ]
-                    list_data_type.append(list_index)
+class SeriesTable(NamedTuple):
+    """
+    Таблица дескрипторов серий для одного layout блока.
+    
+    columns: Индекс выбранных колонок блока (get_column_index)
+    prefixes: Готовое начало серии (bytes) в формате импорта - по одному на
+              выбранную колонку, в том же порядке: prometheus - label-префикс
+              строки ('%' экранирован для %-форматирования), jsonl - JSON объект
+              серии до массива values
+    factors: Делители конверсии единиц (float64) для тех же колонок
+    converted: Маска колонок с конверсией - их значения пишутся как float,
+               остальные как целые сэмплы
+    unknown_resources / unknown_metrics: ID отправляемых серий, которых нет в словарях
+    """
+    columns: np.ndarray
+    prefixes: Tuple[bytes, ...]
+    factors: np.ndarray
+    converted: np.ndarray
+    unknown_resources: frozenset
+    unknown_metrics: frozenset
+
+
+# Максимум закэшированных таблиц серий (layout × Archive × SN × выборка × формат) на процесс
+SERIES_TABLE_CACHE_SIZE = int(os.getenv("SERIES_TABLE_CACHE_SIZE", "256"))
+
+_series_table_cache = {}
 
-    return list_data_type, size_collect_once
+
+def get_series_table(layout, archive_interval: int, array_sn: str,
+                     resources: frozenset, metrics: frozenset,
+                     import_format: str = 'prometheus') -> SeriesTable:
+    """
+    Построить (или взять из кэша) таблицу дескрипторов серий для layout блока.
+    
+    Всё, что зависит только от колонки - sanitize_metric_name, поиск в словарях,
+    METRIC_CONVERSION и форматирование labels - делается один раз на layout,
+    а не для каждой серии каждого блока.
+    """
+    key = (layout.layout_hash, archive_interval, array_sn, resources, metrics, import_format)
+    table = _series_table_cache.get(key)
+    if table is not None:
+        return table
+    
+    # Фильтруем нужные ресурсы и метрики: выборка компилируется в индекс колонок
+    columns = get_column_index(
+        layout, (resources, metrics),
+        lambda resource_id, metric_id: resource_id in resources and metric_id in metrics
+    )
+    
+    prefixes = []
+    factors = []
+    converted = []
+    unknown_resources = set()
+    unknown_metrics = set()
+    for column in columns.tolist():
+        resource_id, metric_id, element = layout.columns[column]
+        
+        # Проверяем, известны ли ID
+        resource_name = RESOURCE_NAME_DICT.get(resource_id, f"UNKNOWN_RESOURCE_{resource_id}")
+        metric_base_name = METRIC_NAME_DICT.get(metric_id, f"UNKNOWN_METRIC_{metric_id}")
+        
+        # Собираем ТОЛЬКО те ID, которых НЕТ в словарях (для логирования)
+        # Если ID уже добавлен в словарь (даже с именем UNKNOWN_XXX), warning не нужен
+        if resource_id not in RESOURCE_NAME_DICT:
+            unknown_resources.add(resource_id)
+        if metric_id not in METRIC_NAME_DICT:
+            unknown_metrics.add(metric_id)
+        
+        metric_name = "huawei_" + sanitize_metric_name(metric_base_name)
+        
+        # Формат Prometheus с добавлением scrape_interval для универсальности
+        # scrape_interval (в секундах) - реальный интервал сбора данных из .dat файла
+        if import_format == 'jsonl':
+            labels = {
+                '__name__': metric_name, 'Element': element, 'Resource': resource_name,
+                'SN': array_sn, 'scrape_interval': str(archive_interval),
+            }
+            series_prefix = '{"metric":' + json.dumps(labels, ensure_ascii=False, separators=(',', ':')) + ',"values":['
+            prefixes.append(series_prefix.encode('utf-8'))
+        else:
+            label_prefix = f'{metric_name}{{Element="{element}",Resource="{resource_name}",SN="{array_sn}",scrape_interval="{archive_interval}"}} '
+            prefixes.append(label_prefix.encode('utf-8').replace(b'%', b'%%'))
+        # Конверсия единиц измерения (KB/s→MB/s, us→ms); без конверсии - делитель 1
+        factors.append(METRIC_CONVERSION.get(metric_id, 1))
+        converted.append(metric_id in METRIC_CONVERSION)
+    
+    table = SeriesTable(columns, tuple(prefixes), np.array(factors, dtype=np.float64),
+                        np.array(converted, dtype=bool),
+                        frozenset(unknown_resources), frozenset(unknown_metrics))
+    if len(_series_table_cache) >= SERIES_TABLE_CACHE_SIZE:
+        _series_table_cache.pop(next(iter(_series_table_cache)))
+    _series_table_cache[key] = table
+    return table
+
+
+# Максимум сэмплов в одном закодированном куске Prometheus текста (срез серий блока)
+ENCODE_CHUNK_SAMPLES = int(os.getenv("ENCODE_CHUNK_SAMPLES", "20000"))
+
+
+def encode_prometheus_block(table: SeriesTable, selected: np.ndarray, ts_list: list,
+                            chunk_samples: int = ENCODE_CHUNK_SAMPLES) -> Generator[Tuple[bytes, int], None, None]:
+    """
+    Закодировать выбранные серии блока в текст Prometheus срезами целых серий.
+    
+    Серия кодируется одной операцией: шаблон из label-префикса и ' <timestamp>\n'
+    строк блока собирается prefix.join(...), значения подставляются одним
+    bytes % tuple - без форматирования и конкатенации на каждую точку.
+    Сэмплы без конверсии пишутся как целые (%d), с конверсией - как float (%r).
+    
+    Args:
+        table: Таблица серий layout блока (get_series_table)
+        selected: Сэмплы выбранных колонок (series × rows, block.select)
+        ts_list: Timestamps строк блока (epoch ms)
+        chunk_samples: Сэмплов в куске не больше (но минимум одна серия)
+    
+    Yields:
+        (payload, samples): Кусок Prometheus текста и число сэмплов в нём
+    """
+    rows = len(ts_list)
+    if not rows or not len(table.prefixes):
+        return
+    
+    # Куски шаблона между значениями: prefix.join даёт prefix %d ts0\n prefix %d ts1\n ...
+    int_formats = [b''] + [b'%%d %d\n' % ts for ts in ts_list]
+    converted = table.converted.tolist()
+    if any(converted):
+        float_formats = [b''] + [b'%%r %d\n' % ts for ts in ts_list]
+        scaled = iter((selected[table.converted] / table.factors[table.converted, None]).tolist())
+    
+    series_per_chunk = max(1, chunk_samples // rows)
+    chunk = []
+    for prefix, is_converted, series_values in zip(table.prefixes, converted, selected.tolist()):
+        if is_converted:
+            chunk.append(prefix.join(float_formats) % tuple(next(scaled)))
+        else:
+            chunk.append(prefix.join(int_formats) % tuple(series_values))
+        if len(chunk) >= series_per_chunk:
+            yield b''.join(chunk), len(chunk) * rows
+            chunk = []
+    if chunk:
+        yield b''.join(chunk), len(chunk) * rows
+
+
+def encode_jsonl_block(table: SeriesTable, selected: np.ndarray, ts_list: list,
+                       chunk_samples: int = ENCODE_CHUNK_SAMPLES) -> Generator[Tuple[bytes, int], None, None]:
+    """
+    Закодировать выбранные серии блока в JSON Lines для /api/v1/import.
+    
+    Строка на серию: labels пишутся один раз, timestamps блока - один раз
+    на блок (общий хвост строки), значения подставляются одним bytes % tuple,
+    как в encode_prometheus_block.
+    
+    Yields:
+        (payload, samples): Кусок JSON Lines и число сэмплов в нём
+    """
+    rows = len(ts_list)
+    if not rows or not len(table.prefixes):
+        return
+    
+    int_values = b','.join([b'%d'] * rows)
+    timestamps_suffix = b'],"timestamps":[' + ','.join(map(str, ts_list)).encode('ascii') + b']}\n'
+    converted = table.converted.tolist()
+    if any(converted):
+        float_values = b','.join([b'%r'] * rows)
+        scaled = iter((selected[table.converted] / table.factors[table.converted, None]).tolist())
+    
+    series_per_chunk = max(1, chunk_samples // rows)
+    chunk = []
+    for prefix, is_converted, series_values in zip(table.prefixes, converted, selected.tolist()):
+        if is_converted:
+            values = float_values % tuple(next(scaled))
+        else:
+            values = int_values % tuple(series_values)
+        chunk.append(prefix + values + timestamps_suffix)
+        if len(chunk) >= series_per_chunk:
+            yield b''.join(chunk), len(chunk) * rows
+            chunk = []
+    if chunk:
+        yield b''.join(chunk), len(chunk) * rows
+
+
+# Кодировщик блока для формата импорта (vm_sender.IMPORT_FORMATS)
+BLOCK_ENCODERS = {
+    'prometheus': encode_prometheus_block,
+    'jsonl': encode_jsonl_block,
+}
 
 
 def stream_prometheus_metrics(file_path: Path, array_sn: str, resources: list, 
-                              metrics: list, allow_unknown: bool = True) -> Generator[str, None, int]:
+                              metrics: list, allow_unknown: bool = True,
+                              time_from: int = None, time_to: int = None,
+                              part: int = 0, parts: int = 1,
+                              cache_dir: str = None,
+                              data_span: list = None,
+                              block_sinks: list = (),
+                              import_format: str = 'prometheus',
+                              position: list = None,
+                              imported_blocks=None,
+                              errors: list = None) -> Generator[Tuple[bytes, int], None, int]:
     """
-    STREAMING генератор метрик в формате Prometheus.
-    Возвращает строки готовые для отправки в VictoriaMetrics.
+    STREAMING генератор метрик в формате Prometheus (или JSON Lines).
+    Возвращает куски текста (bytes, UTF-8) готовые для отправки в VictoriaMetrics:
+    серии блока кодируются пачкой (encode_prometheus_block / encode_jsonl_block).
     
     Args:
-        file_path: Путь к .dat файлу
+        file_path: Путь к .dat, .tgz или ZipMember (.tgz внутри ZIP) - читается потоково
         array_sn: Серийный номер массива
         resources: Список ID ресурсов для обработки
         metrics: Список ID метрик для обработки
         allow_unknown: Если True, обрабатывает ВСЕ ID (даже неизвестные)
+        time_from: Начало окна (epoch-секунды, включительно) - блоки раньше не декодируются
+        time_to: Конец окна (epoch-секунды, не включительно)
+        part: Номер части файла (0..parts-1) - декодируются только её блоки
+        parts: На сколько частей делится файл между workers
+        cache_dir: Каталог кэша декодированных блоков (None - BLOCK_CACHE_DIR)
+        data_span: Если передан список [first_ms, last_ms], в него пишется
+                   время первой и последней отданной точки
+        block_sinks: Файловые выходы (block_sinks.CsvSink, PerfmonkeySink) - получают
+                     каждый декодированный блок того же прохода; при ошибке
+                     прохода у них выставляется error
+        import_format: 'prometheus' (/api/v1/import/prometheus) или 'jsonl' (/api/v1/import)
+        position: [block, series] - позиция в файле (номер блока .dat, число серий
+                  выборки этого блока). На входе - откуда начать: блоки до block
+                  пропускаются без декодирования, в самом блоке - первые series
+                  серий. Перед каждым куском сюда пишется позиция после него -
+                  checkpoint для продолжения прерванного импорта
+        imported_blocks: block_dedup.ImportedBlocks - блоки, уже импортированные из
+                         других архивов, пропускаются без декодирования; отданные
+                         блоки копятся в нём для записи в индекс
+        errors: Если передан список, в него добавляется ошибка чтения или
+                декодирования файла: проход оборван, отданы не все блоки
+    
+    Время декодирования блоков (decode) и кодирования серий (encode), блоки,
+    строки и метрики учитываются в pipeline_metrics.
     
     Yields:
-        str: Метрика в формате Prometheus
+        (payload, samples): Кусок строк Prometheus (JSON Lines) и число метрик в нём
     
     Returns:
         int: Количество обработанных метрик
@@ -228,125 +483,75 @@ def stream_prometheus_metrics(file_path: Path, array_sn: str, resources: list,
     metrics_count = 0
     unknown_resources = set()
     unknown_metrics = set()
+    resources = frozenset(resources)
+    metrics = frozenset(metrics)
+    # Из кэша блоков читаем ресурсы, нужные хотя бы одному выходу
+    load_resources = resources.union(*(sink.resources for sink in block_sinks))
+    encode_block = BLOCK_ENCODERS[import_format]
+    start_block, start_series = position if position is not None else (0, 0)
     
     try:
-        with open(file_path, "rb") as fin:
-            # Читаем заголовок
-            bit_correct = fin.read(32)
-            bit_msg_version = fin.read(4)
-            bit_equip_sn = fin.read(256).decode('utf-8')
-            bit_equip_name = fin.read(41).decode('utf-8')
-            bit_equip_data_length = fin.read(4)
-
-            process_finish_flag = False
-
-            bit_map_type = fin.read(4)
-            bit_map_length, = struct.unpack("<l", fin.read(4))
-            bit_map_value = fin.read(bit_map_length - 8)
+        blocks = iter_source_blocks(file_path, cache_dir=cache_dir, resources=load_resources,
+                                    time_from=time_from, time_to=time_to,
+                                    part=part, parts=parts, start_block=start_block,
+                                    skip_block=imported_blocks)
+        for block in timed(blocks, 'decode'):
+            count_stats(blocks=1, rows=block.rows, dat_bytes=block.values.nbytes)
             
-            if len(bit_map_value) < bit_map_length - 8:
-                logger.error(f"Read Data Header Failed for {file_path}")
-                return metrics_count
-
-            while not process_finish_flag:
-                result = re.match(
-                    '{(.*),"Map":{(.*)}}', bit_map_value.decode('utf-8')
-                )
-                data_header = construct_data_header(result)
-                list_data_type, size_collect_once = construct_data_type(data_header)
-
-                times_collect = int(
-                    (int(data_header['EndTime']) - int(data_header['StartTime'])) /
-                    int(data_header['Archive'])
+            # Один декодированный блок - всем файловым выходам
+            for sink in block_sinks:
+                sink.add_block(block)
+            
+            # Извлекаем интервал сбора для добавления в label
+            archive_interval = int(block.header['Archive'])
+            
+            table = get_series_table(block.layout, archive_interval, array_sn, resources, metrics,
+                                     import_format)
+            # Продолжение с середины блока: серии до checkpoint уже в VM
+            first_series = start_series if block.number == start_block else 0
+            if first_series:
+                table = table._replace(
+                    columns=table.columns[first_series:], prefixes=table.prefixes[first_series:],
+                    factors=table.factors[first_series:], converted=table.converted[first_series:],
                 )
+            unknown_resources |= table.unknown_resources
+            unknown_metrics |= table.unknown_metrics
+            
+            with stage('encode'):
+                # Timestamps (epoch ms, UTC) - один вектор на блок
+                ts_list = block.timestamps_ms.tolist()
                 
-                # Извлекаем интервал сбора для добавления в label
-                archive_interval = int(data_header['Archive'])
-
-                # Читаем данные блоками
-                for i in range(times_collect):
-                    buffer_read = fin.read(size_collect_once)
-                    if len(buffer_read) < size_collect_once:
-                        process_finish_flag = True
-                        break
-                    
-                    for index_in_buffer in range(0, size_collect_once, 4):
-                        bytes_read_4 = buffer_read[index_in_buffer: index_in_buffer + 4]
-                        bytes_read_int, = struct.unpack("<l", bytes_read_4)
-                        list_data_type[int(index_in_buffer / 4)][3].append(str(bytes_read_int))
-
-                # Генерируем timestamps
-                start_time = datetime.fromtimestamp(int(data_header['StartTime']))
-                next_time = start_time
-                time_list = []
-                for i, _ in enumerate(list_data_type[0][3]):
-                    time_list.append(next_time)
-                    next_time += timedelta(seconds=int(data_header['Archive']))
-
-                # STREAMING: отдаем метрики по одной, не накапливая в памяти
-                for data_type in list_data_type:
-                    resource_id = str(data_type[0])
-                    metric_id = str(data_type[1])
-                    
-                    # Фильтруем нужные ресурсы и метрики
-                    if resource_id not in resources or metric_id not in metrics:
-                        continue
-
-                    # Проверяем, известны ли ID
-                    resource_name = RESOURCE_NAME_DICT.get(resource_id, f"UNKNOWN_RESOURCE_{resource_id}")
-                    metric_base_name = METRIC_NAME_DICT.get(metric_id, f"UNKNOWN_METRIC_{metric_id}")
-                    
-                    # Собираем ТОЛЬКО те ID, которых НЕТ в словарях (для логирования)
-                    # Если ID уже добавлен в словарь (даже с именем UNKNOWN_XXX), warning не нужен
-                    if resource_id not in RESOURCE_NAME_DICT:
-                        unknown_resources.add(resource_id)
-                    if metric_id not in METRIC_NAME_DICT:
-                        unknown_metrics.add(metric_id)
-                    
-                    metric_name = "huawei_" + sanitize_metric_name(metric_base_name)
-                    element = data_type[2]
-
-                    # Генерируем метрики для каждого временного интервала
-                    for index, point_value in enumerate(data_type[3]):
-                        try:
-                            ts_unix_ms = int(time.mktime(time_list[index].timetuple()) * 1000)
-                            
-                            # Применяем конверсию единиц измерения если нужно
-                            # Для метрик, где сырые данные в других единицах (KB/s→MB/s, us→ms)
-                            value = float(point_value)
-                            if metric_id in METRIC_CONVERSION:
-                                value = value / METRIC_CONVERSION[metric_id]
-                            
-                            # Формат Prometheus с добавлением scrape_interval для универсальности
-                            # scrape_interval (в секундах) - реальный интервал сбора данных из .dat файла
-                            prom_line = f'{metric_name}{{Element="{element}",Resource="{resource_name}",SN="{array_sn}",scrape_interval="{archive_interval}"}} {value} {ts_unix_ms}\n'
-                            
-                            yield prom_line
-                            metrics_count += 1
-                            
-                        except (ValueError, IndexError) as e:
-                            continue
-
-                # Очищаем данные для освобождения памяти
-                for data_type in list_data_type:
-                    data_type[3].clear()
-
-                bit_map_type = fin.read(4)
-                if bit_map_type == b'':
-                    process_finish_flag = True
-                elif bit_map_type == b'\x00\x00\x00\x00':
-                    bit_map_length, = struct.unpack("<l", fin.read(4))
-                    if bit_map_length < 8:
-                        process_finish_flag = True
+                # Забираем из блока только выбранные колонки (по серии на строку)
+                selected = block.select(table.columns)
+            
+            if data_span is not None and len(table.prefixes):
+                data_span[0] = ts_list[0] if data_span[0] is None else min(data_span[0], ts_list[0])
+                data_span[1] = ts_list[-1] if data_span[1] is None else max(data_span[1], ts_list[-1])
+            
+            # STREAMING: отдаем срезы серий блока, не накапливая файл в памяти
+            series_done = first_series
+            for payload, samples in timed(encode_block(table, selected, ts_list), 'encode'):
+                count_stats(samples=samples)
+                if position is not None:
+                    series_done += samples // len(ts_list)
+                    # Блок отдан целиком - позиция на следующем блоке
+                    if series_done - first_series == len(table.prefixes):
+                        position[:] = [block.number + 1, 0]
                     else:
-                        bit_map_value = fin.read(bit_map_length - 8)
-                        if len(bit_map_value) < bit_map_length - 8:
-                            return metrics_count
-                else:
-                    process_finish_flag = True
+                        position[:] = [block.number, series_done]
+                yield payload, samples
+                metrics_count += samples
+            
+            # Все серии блока отданы
+            if imported_blocks is not None:
+                imported_blocks.add(block)
                     
     except Exception as exc_info:
         logger.error(f"Error processing {file_path}: {exc_info}")
+        for sink in block_sinks:
+            sink.error = exc_info
+        if errors is not None:
+            errors.append(exc_info)
     
     # Логируем неизвестные ID если они есть
     if unknown_resources:
@@ -357,117 +562,272 @@ def stream_prometheus_metrics(file_path: Path, array_sn: str, resources: list,
     return metrics_count
 
 
-def send_batch_to_vm(batch: list, vm_url: str) -> bool:
-    """Отправить батч метрик в VictoriaMetrics."""
-    if not batch:
-        return True
-    
-    payload = "".join(batch).encode('utf-8')
-    
-    try:
-        response = requests.post(vm_url, data=payload, timeout=30)
-        if response.status_code not in (200, 204):
-            logger.error(f"VM returned {response.status_code}: {response.text[:200]}")
-            return False
-        return True
-    except requests.RequestException as e:
-        logger.error(f"Failed to send batch to VM: {e}")
-        return False
+def sent_bytes_since(before: dict) -> dict:
+    """Байты тел запросов к VM этого процесса с момента снимка get_send_stats()."""
+    after = get_send_stats()
+    return {
+        'raw_bytes': after['raw_bytes'] - before['raw_bytes'],
+        'wire_bytes': after['wire_bytes'] - before['wire_bytes'],
+    }
 
 
-def decompress_tgz(file_tgz: Path) -> Path:
-    """Распаковать .tgz файл."""
-    tar = tarfile.open(file_tgz)
-    names = tar.getnames()
-    temp_file_path = Path("temp") / f"temp_{os.getpid()}_{time.time()}"
-    temp_file_path.mkdir(parents=True, exist_ok=True)
-    
-    if len(names) == 1:
-        tar.extract(names[0], temp_file_path)
-        return temp_file_path / names[0]
-    
-    logger.error(f"perf file content error: {file_tgz}")
-    return None
+def init_worker(compression: tuple, ingest_controller, metrics_queue=None, metrics_interval: float = 0):
+    """
+    Initializer пула: сжатие, контроллер нагрузки на VM (--adaptive) и очередь
+    метрик pipeline (PipelineMetrics.queue, раз в metrics_interval секунд) в каждом worker.
+    """
+    configure_compression(*compression)
+    set_ingest_controller(ingest_controller)
+    set_metrics_queue(metrics_queue, metrics_interval)
 
 
 def process_single_tgz_streaming(args) -> dict:
     """
-    Обработать один .tgz файл в streaming режиме.
+    Обработать один .tgz файл (или его часть) в streaming режиме.
     Парсит данные и сразу отправляет в VictoriaMetrics батчами.
+    
+    Крупный файл делится на parts частей: worker с номером part декодирует
+    только блоки своего непрерывного диапазона .dat (block_part).
+    
+    targets: выходы комбинированного режима - те же декодированные блоки
+    дописываются в long CSV ('csv') и wide CSV PerfMonkey ('perfmonkey')
+    в output_dir; без 'grafana' в VictoriaMetrics ничего не отправляется.
+    
+    upload_threads / upload_queue: батчи отправляет BatchUploader - до
+    upload_threads запросов в пути и upload_queue готовых батчей в очереди,
+    пока worker декодирует дальше. Батч уходит по batch_size метрик или
+    batch_bytes байт; stream_upload - один chunked запрос на файл (часть).
+    
+    checkpoint: (ledger_path, ledger_key, ledger_target, (block, series), metrics) -
+    подтверждённые VM позиции части пишутся в журнал импортов, импорт
+    начинается с (block, series) - продолжение прерванного запуска; None - без
+    checkpoints.
+    
+    vm_url - один endpoint или список через запятую; shard_key - SN массива,
+    если батчи массива должны уходить на один shard (None - по кругу).
+    
+    dedup: (index_dir, target, skip_known) - блоки, уже импортированные в target
+    из других архивов (индекс block_dedup по SN), не декодируются; отправленные
+    блоки дописываются в индекс; None - без дедупликации.
+    
+    Время стадий и счётчики задачи уходят в главный процесс с label SN
+    (pipeline_metrics.begin_task / end_task).
     """
-    tgz_file, vm_url, batch_size, resources, metrics, array_sn = args
+    (tgz_file, vm_url, batch_size, resources, metrics, array_sn, time_from, time_to, part, parts,
+     cache_dir, targets, output_dir, file_locks, import_format, upload_threads, upload_queue,
+     batch_bytes, stream_upload, checkpoint, shard_key, dedup) = args
     
     worker_id = os.getpid()
-    logger.info(f"[Worker {worker_id}] Processing {tgz_file.name}")
+    file_label = tgz_file.name if parts == 1 else f"{tgz_file.name} [part {part + 1}/{parts}]"
+    logger.info(f"[Worker {worker_id}] Processing {file_label}")
     
     start_time = time.time()
-    metrics_sent = 0
-    batches_sent = 0
+    data_span = [None, None]
+    # Ошибка чтения .tgz обрывает генератор - файл отправлен не целиком
+    read_errors = []
+    send_stats = get_send_stats()
+    begin_task(array_sn)
     
     try:
-        # Распаковываем
-        decompressed_file = decompress_tgz(tgz_file)
-        if not decompressed_file:
+        # Файловые выходы получают блоки того же прохода (SN - из имени файла, как в их CLI)
+        file_sn = extract_serial_from_filename(tgz_file.name)
+        block_sinks = []
+        if 'csv' in targets:
+            block_sinks.append(CsvSink(output_dir, file_sn, resources, metrics))
+        if 'perfmonkey' in targets:
+            block_sinks.append(PerfmonkeySink(output_dir, file_sn, file_locks))
+        if 'grafana' not in targets:
+            resources, metrics = (), ()
+        
+        # Стримим метрики прямо из .tgz (без распаковки на диск) и отправляем батчами
+        # по batch_size метрик или batch_bytes байт: батч уходит в потоке uploader'а,
+        # а worker тем временем декодирует следующий. stream_upload - весь файл
+        # (часть) одним chunked запросом
+        position = None
+        import_checkpoint = None
+        if checkpoint:
+            ledger_path, ledger_key_value, ledger_target, start_position, resumed_metrics = checkpoint
+            position = list(start_position)
+            if start_position != (0, 0):
+                logger.info(f"[Worker {worker_id}] Resuming {file_label} from block {position[0]}, "
+                            f"series {position[1]} ({resumed_metrics:,} metrics already sent)")
+            import_checkpoint = ImportCheckpoint(
+                ImportLedger(ledger_path), ledger_key_value, ledger_target, part, parts,
+                metrics=resumed_metrics, time_from=time_from, time_to=time_to,
+            )
+        
+        imported_blocks = None
+        if dedup:
+            index_dir, dedup_target, skip_known = dedup
+            imported_blocks = ImportedBlockIndex(index_dir).session(array_sn, dedup_target, skip_known)
+        
+        chunks = stream_prometheus_metrics(tgz_file, array_sn, resources, metrics,
+                                           time_from=time_from, time_to=time_to,
+                                           part=part, parts=parts, cache_dir=cache_dir,
+                                           data_span=data_span, block_sinks=block_sinks,
+                                           import_format=import_format, position=position,
+                                           imported_blocks=imported_blocks, errors=read_errors)
+        uploader = BatchUploader(vm_url, upload_threads, upload_queue,
+                                 on_sent=import_checkpoint.on_sent if import_checkpoint else None,
+                                 shard_key=shard_key)
+        
+        try:
+            if stream_upload and 'grafana' in targets:
+                uploader.upload_stream(chunks)
+            else:
+                uploader.upload(chunks, batch_size, batch_bytes,
+                                position=(lambda: tuple(position)) if position is not None else None)
+        finally:
+            uploaded = uploader.close()
+            if import_checkpoint:
+                # После ошибки чтения - только последняя подтверждённая позиция
+                import_checkpoint.finish(uploaded and not read_errors, uploader.metrics_sent)
+        metrics_sent = uploader.metrics_sent
+        batches_sent = uploader.batches_sent
+        
+        if not uploaded or read_errors:
+            if not uploaded:
+                logger.error(f"[Worker {worker_id}] Failed to send batch")
+            else:
+                logger.error(f"[Worker {worker_id}] Failed to read {file_label}: {read_errors[0]}")
             return {
                 'file': tgz_file.name,
+                'source': str(tgz_file),
                 'success': False,
-                'metrics': 0,
-                'time': time.time() - start_time
+                'metrics': metrics_sent,
+                'time': time.time() - start_time,
+                **sent_bytes_since(send_stats),
             }
         
-        # Стримим метрики и отправляем батчами
-        batch = []
-        
-        for metric_line in stream_prometheus_metrics(decompressed_file, array_sn, resources, metrics):
-            batch.append(metric_line)
-            
-            # Когда батч заполнен - отправляем
-            if len(batch) >= batch_size:
-                if send_batch_to_vm(batch, vm_url):
-                    metrics_sent += len(batch)
-                    batches_sent += 1
-                    batch = []
-                else:
-                    logger.error(f"[Worker {worker_id}] Failed to send batch")
-                    return {
-                        'file': tgz_file.name,
-                        'success': False,
-                        'metrics': metrics_sent,
-                        'time': time.time() - start_time
-                    }
-        
-        # Отправляем остаток
-        if batch:
-            if send_batch_to_vm(batch, vm_url):
-                metrics_sent += len(batch)
-                batches_sent += 1
+        # Дописываем строки файла в CSV выходы
+        rows = {}
+        for sink in block_sinks:
+            rows[sink.target] = sink.close(file_label)
+            if rows[sink.target] is None:
+                logger.error(f"[Worker {worker_id}] Failed to write {sink.target} output for {file_label}")
+                return {
+                    'file': tgz_file.name,
+                    'source': str(tgz_file),
+                    'success': False,
+                    'metrics': metrics_sent,
+                    'time': time.time() - start_time,
+                    **sent_bytes_since(send_stats),
+                }
         
-        # Cleanup
-        if decompressed_file.exists():
-            decompressed_file.unlink()
+        # VM принял все батчи - блоки файла больше не импортируются из других архивов
+        skipped_blocks = 0
+        if imported_blocks is not None:
+            imported_blocks.commit()
+            skipped_blocks = imported_blocks.skipped
         
         elapsed = time.time() - start_time
         rate = metrics_sent / elapsed if elapsed > 0 else 0
         
-        logger.info(f"[Worker {worker_id}] ✅ {tgz_file.name}: {metrics_sent:,} metrics in {elapsed:.1f}s ({rate:,.0f} m/s)")
+        rows_info = ''.join(f", {count:,} {target} rows" for target, count in rows.items())
+        skipped_info = f", {skipped_blocks:,} blocks already imported" if skipped_blocks else ''
+        logger.info(f"[Worker {worker_id}] ✅ {file_label}: {metrics_sent:,} metrics{rows_info}{skipped_info} "
+                    f"in {elapsed:.1f}s ({rate:,.0f} m/s)")
         
         return {
             'file': tgz_file.name,
+            'source': str(tgz_file),
             'success': True,
             'metrics': metrics_sent,
             'batches': batches_sent,
             'time': elapsed,
-            'rate': rate
+            'rate': rate,
+            'data_span': data_span,
+            'rows': rows,
+            'skipped_blocks': skipped_blocks,
+            **sent_bytes_since(send_stats),
         }
         
     except Exception as e:
         logger.error(f"[Worker {worker_id}] Error: {e}")
         return {
             'file': tgz_file.name,
+            'source': str(tgz_file),
             'success': False,
             'metrics': 0,
-            'time': time.time() - start_time
+            'time': time.time() - start_time,
+            **sent_bytes_since(send_stats),
         }
+    finally:
+        end_task()
+
+
+if PY7ZR_AVAILABLE:
+    class TgzReadyCallback(ExtractCallback):
+        """
+        Callback py7zr: публикует путь к .tgz в очередь, как только файл
+        полностью записан на диск (report_end вызывается после закрытия файла).
+        """
+        
+        def __init__(self, extract_dir: Path, ready_queue: queue.Queue):
+            self.extract_dir = extract_dir
+            self.ready_queue = ready_queue
+        
+        def report_start_preparation(self):
+            pass
+        
+        def report_start(self, processing_file_path, processing_bytes):
+            pass
+        
+        def report_update(self, decompressed_bytes):
+            pass
+        
+        def report_end(self, processing_file_path, wrote_bytes):
+            if processing_file_path.lower().endswith('.tgz'):
+                self.ready_queue.put(self.extract_dir / processing_file_path)
+        
+        def report_warning(self, message):
+            logger.warning(f"py7zr: {message}")
+        
+        def report_postprocess(self):
+            pass
+
+
+_EXTRACT_DONE = object()
+
+
+def iter_extracted_7z_tgz(archive_path: Path, extract_dir: Path) -> Generator[Path, None, None]:
+    """
+    Pipelined распаковка .7z: extractor thread распаковывает архив, генератор
+    отдаёт каждый .tgz сразу после записи на диск.
+    
+    Генератор передаётся прямо в Pool.imap_unordered - workers начинают
+    парсинг, пока py7zr (медленный, однопоточный) ещё распаковывает остальное.
+    """
+    ready_queue = queue.Queue()
+    
+    def extractor():
+        try:
+            with py7zr.SevenZipFile(archive_path, mode='r') as archive:
+                archive.extractall(extract_dir, callback=TgzReadyCallback(extract_dir, ready_queue))
+        except Exception as e:
+            ready_queue.put(e)
+        finally:
+            ready_queue.put(_EXTRACT_DONE)
+    
+    thread = threading.Thread(target=extractor, name="7z-extractor", daemon=True)
+    thread.start()
+    
+    published = set()
+    while True:
+        item = ready_queue.get()
+        if item is _EXTRACT_DONE:
+            break
+        if isinstance(item, Exception):
+            logger.error(f"❌ 7z extraction failed: {item}")
+            raise item
+        published.add(item)
+        yield item
+    thread.join()
+    
+    # Страховка: .tgz, о которых callback не сообщил
+    for tgz_file in sorted(extract_dir.rglob("*.tgz")):
+        if tgz_file not in published:
+            yield tgz_file
 
 
 def extract_serial_from_filename(filename: str) -> str:
@@ -485,6 +845,7 @@ def extract_serial_from_filename(filename: str) -> str:
 
 
 def main():
+    setup_logging()
     parser = argparse.ArgumentParser(
         description="STREAMING Pipeline: Huawei Performance → VictoriaMetrics (БЕЗ промежуточных CSV)",
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -505,15 +866,42 @@ def main():
   # С мониторингом
   %(prog)s -i logs.zip --monitor
   
+  # Время стадий (распаковка, декодирование, кодирование, сжатие, отправка) в VM раз в 15s:
+  # huperf_pipeline_stage_seconds_total{job, SN, stage} и счётчики huperf_pipeline_*_total
+  %(prog)s -i logs.zip --pipeline-metrics 15
+  
   # Указать другой VM URL
   %(prog)s -i logs.zip --vm-url http://10.5.10.163:8428/api/v1/import/prometheus
+  
+  # Несколько vminsert: серии массива - на один shard по SN, при сбое - на соседний
+  %(prog)s -i logs.zip --vm-url http://vminsert-1:8480/insert/0/prometheus/api/v1/import/prometheus,http://vminsert-2:8480/insert/0/prometheus/api/v1/import/prometheus --sharding sn
+  
+  # Только последняя неделя (остальные блоки не декодируются)
+  %(prog)s -i logs.zip --from 2024-05-01 --to 2024-05-08
+  
+  # Не импортировать повторно уже загруженные .tgz (журнал импортов)
+  %(prog)s -i logs.zip --ledger import_ledger.jsonl
+  
+  # Ежедневный архив за 7 дней: импортировать только блоки, которых ещё нет в VM
+  %(prog)s -i Perf_day2.zip --dedup-dir imported_blocks
+  
+  # Один проход: VictoriaMetrics + long CSV + PerfMonkey CSV в out/
+  %(prog)s -i logs.zip --targets all -o out
+  
+  # Общий VM: нагрузка подстраивается под задержку и ошибки VM
+  %(prog)s -i logs.zip --adaptive --upload-threads 2 --target-latency 1
         """)
     
     parser.add_argument('-i', '--input', type=str, required=True,
                        help='ZIP архив с .tgz файлами')
     parser.add_argument('--vm-url', type=str, 
                        default='http://localhost:8428/api/v1/import/prometheus',
-                       help='VictoriaMetrics import endpoint (default: http://localhost:8428/api/v1/import/prometheus)')
+                       help='VictoriaMetrics import endpoint или несколько через запятую (VM / vminsert shards) '
+                            '(default: http://localhost:8428/api/v1/import/prometheus)')
+    parser.add_argument('--sharding', choices=SHARDING_MODES, default=VM_SHARDING,
+                       help='Выбор endpoint из списка --vm-url: round-robin - по кругу, sn - серии массива '
+                            'на один shard (consistent hashing по SN); недоступный endpoint обходится '
+                            '(default: env VM_SHARDING или round-robin)')
     parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
                        help=f'Размер батча (default: {BATCH_SIZE})')
     parser.add_argument('-w', '--workers', type=int, default=None,
@@ -522,9 +910,97 @@ def main():
                        help='Парсить ВСЕ метрики (по умолчанию: True)')
     parser.add_argument('--monitor', action='store_true',
                        help='Включить подробный мониторинг ресурсов')
+    parser.add_argument('--pipeline-metrics', type=float, default=PIPELINE_METRICS_SECONDS, metavar='SECONDS',
+                       help='Раз в SECONDS отправлять в VM время стадий pipeline и объёмы данных по SN '
+                            '(huperf_pipeline_*), 0 - только итог в логе '
+                            f'(default: env PIPELINE_METRICS_SECONDS или {PIPELINE_METRICS_SECONDS:g})')
+    parser.add_argument('--split-min-mb', type=int, default=SPLIT_MIN_BYTES // (1024 * 1024),
+                       help='Файлы крупнее средней доли на worker и этого размера делятся на части '
+                            f'по блокам между workers, 0 - не делить (default: {SPLIT_MIN_BYTES // (1024 * 1024)})')
+    parser.add_argument('--from', dest='time_from', type=str, default=None,
+                       help='Начало временного окна: epoch-секунды или ISO 8601, без TZ = UTC (включительно)')
+    parser.add_argument('--to', dest='time_to', type=str, default=None,
+                       help='Конец временного окна: epoch-секунды или ISO 8601, без TZ = UTC (не включительно)')
+    parser.add_argument('--cache-dir', type=str, default=BLOCK_CACHE_DIR or None,
+                       help='Каталог кэша декодированных блоков (.npz): первый проход пишет кэш, '
+                            'повторные выгрузки читают его без распаковки (default: $BLOCK_CACHE_DIR)')
+    parser.add_argument('--ledger', type=str, default=IMPORT_LEDGER or None,
+                       help='Журнал импортов (JSON Lines): .tgz, уже импортированные в этот --vm-url '
+                            'с покрывающим окном, пропускаются, прерванные - продолжаются с checkpoint '
+                            '(default: $IMPORT_LEDGER)')
+    parser.add_argument('--force', action='store_true',
+                       help='Импортировать заново файлы, уже записанные в журнале импортов (без продолжения с checkpoint)')
+    parser.add_argument('--dedup-dir', type=str, default=IMPORTED_BLOCKS_DIR or None,
+                       help='Индекс импортированных блоков (по SN): блоки .dat, уже отправленные в этот VM '
+                            'из перекрывающихся архивов, пропускаются без декодирования; только для '
+                            '--targets grafana, --force импортирует их заново (default: env IMPORTED_BLOCKS_DIR)')
+    parser.add_argument('--format', dest='import_format', choices=IMPORT_FORMATS,
+                       default=VM_IMPORT_FORMAT,
+                       help='Формат импорта: prometheus (строка на точку, /api/v1/import/prometheus) или '
+                            'jsonl (строка на серию, /api/v1/import); --vm-url переключается на endpoint формата '
+                            '(default: env VM_IMPORT_FORMAT или prometheus)')
+    parser.add_argument('--compress', choices=COMPRESSION_ALGORITHMS, default=VM_COMPRESSION.lower() or 'none',
+                       help='Сжатие тела запросов к VictoriaMetrics: none, gzip, zstd (нужен пакет zstandard) '
+                            '(default: env VM_COMPRESSION или none)')
+    parser.add_argument('--compress-level', type=int,
+                       default=int(VM_COMPRESSION_LEVEL) if VM_COMPRESSION_LEVEL else None,
+                       help='Уровень сжатия (default: env VM_COMPRESSION_LEVEL, иначе gzip 1 / zstd 3)')
+    parser.add_argument('--batch-mb', type=int, default=max(1, VM_BATCH_BYTES // (1024 * 1024)),
+                       help='Размер батча в MB (тело запроса до сжатия): батч уходит по этому порогу '
+                            f'или по --batch-size - что раньше (default: {max(1, VM_BATCH_BYTES // (1024 * 1024))})')
+    parser.add_argument('--stream-upload', action='store_true',
+                       help='Без батчей: каждый файл (часть) одним chunked запросом, память не зависит от объёма')
+    parser.add_argument('--upload-threads', type=int, default=VM_UPLOAD_THREADS,
+                       help='Потоков отправки в каждом worker: декодирование идёт, пока батчи в пути; '
+                            f'0 - отправка синхронно (default: {VM_UPLOAD_THREADS})')
+    parser.add_argument('--upload-queue', type=int, default=VM_UPLOAD_QUEUE,
+                       help='Готовых батчей в очереди отправки worker до паузы декодирования '
+                            f'(память: до queue + threads батчей на worker, default: {VM_UPLOAD_QUEUE})')
+    parser.add_argument('--adaptive', action='store_true',
+                       help='AIMD контроль нагрузки на VM: число одновременных запросов (до workers x '
+                            '--upload-threads) и размер батча (до --batch-mb) снижаются при ошибках и '
+                            'задержке выше --target-latency и растут, пока VM отвечает быстро')
+    parser.add_argument('--target-latency', type=float, default=INGEST_TARGET_LATENCY,
+                       help='Целевая задержка import запроса для --adaptive, секунды '
+                            f'(default: env INGEST_TARGET_LATENCY или {INGEST_TARGET_LATENCY:g})')
+    parser.add_argument('--targets', type=str, default='grafana',
+                       help='Выходы одного прохода декодирования: all или через запятую из '
+                            'grafana (VictoriaMetrics), csv (long CSV <SN>.csv), perfmonkey (wide CSV) '
+                            '(default: grafana)')
+    parser.add_argument('-o', '--output-dir', type=str, default=None,
+                       help='Каталог CSV выходов (нужен для targets csv и perfmonkey)')
     
     args = parser.parse_args()
     
+    try:
+        targets = parse_targets(args.targets)
+    except ValueError as e:
+        parser.error(str(e))
+    file_targets = [target for target in targets if target != 'grafana']
+    
+    # Сжатие проверяем здесь, а включаем в каждом worker (initializer пула)
+    try:
+        configure_compression(args.compress, args.compress_level)
+    except ValueError as e:
+        parser.error(str(e))
+    compression = compression_settings()
+    # Endpoint формата; журнал импортов ведётся по --vm-url (те же данные в том же VM)
+    try:
+        send_url = import_url(args.vm_url, args.import_format)
+    except ValueError as e:
+        parser.error(str(e))
+    if file_targets and not args.output_dir:
+        parser.error(f"--output-dir is required for targets: {', '.join(file_targets)}")
+    
+    # Временное окно: блоки вне окна пропускаются без декодирования
+    try:
+        time_from = parse_time_bound(args.time_from) if args.time_from else None
+        time_to = parse_time_bound(args.time_to) if args.time_to else None
+    except ValueError as e:
+        parser.error(f"Invalid --from/--to value: {e}")
+    if time_from is not None and time_to is not None and time_from >= time_to:
+        parser.error("--from must be earlier than --to")
+    
     # Инициализация
     input_path = Path(args.input)
     if not input_path.exists():
@@ -537,8 +1013,29 @@ def main():
     logger.info("🚀 STREAMING PIPELINE STARTED")
     logger.info("="*80)
     logger.info(f"Input:  {input_path}")
-    logger.info(f"VM URL: {args.vm_url}")
-    logger.info(f"Batch:  {args.batch_size:,} metrics")
+    if 'grafana' in targets:
+        endpoints = parse_endpoints(send_url)
+        logger.info(f"VM URL: {', '.join(endpoints)}")
+        if len(endpoints) > 1:
+            logger.info(f"Shards: {len(endpoints)} endpoints, {args.sharding}")
+    if file_targets:
+        logger.info(f"Output: {args.output_dir} ({', '.join(file_targets)})")
+    if args.stream_upload:
+        logger.info("Batch:  chunked stream per file")
+    else:
+        logger.info(f"Batch:  {args.batch_size:,} metrics / {args.batch_mb} MB")
+    if 'grafana' in targets and compression[0]:
+        logger.info(f"Compress: {compression[0]} (level {compression[1]})")
+    if time_from is not None or time_to is not None:
+        window_from = datetime.fromtimestamp(time_from, timezone.utc).isoformat() if time_from is not None else '-∞'
+        window_to = datetime.fromtimestamp(time_to, timezone.utc).isoformat() if time_to is not None else '+∞'
+        logger.info(f"Window: [{window_from}, {window_to})")
+    if args.cache_dir:
+        logger.info(f"Cache:  {args.cache_dir}")
+    if args.ledger:
+        logger.info(f"Ledger: {args.ledger}{' (force)' if args.force else ''}")
+    if args.dedup_dir:
+        logger.info(f"Dedup:  {args.dedup_dir}{' (force)' if args.force else ''}")
     
     if args.all_metrics:
         resources = list(RESOURCE_NAME_DICT.keys())
@@ -552,42 +1049,111 @@ def main():
     # Определяем workers
     num_workers = args.workers if args.workers else max(1, cpu_count() - 2)
     logger.info(f"Workers: {num_workers}")
+    
+    # Лимит запросов общий на все workers: потолок - все потоки отправки пула
+    ingest_controller = None
+    if args.adaptive and 'grafana' in targets:
+        ingest_controller = IngestController(
+            num_workers * max(1, args.upload_threads), args.batch_mb * 1024 * 1024,
+            target_latency=args.target_latency,
+        )
+        control = ingest_controller.snapshot()
+        logger.info(f"Adaptive: {control['limit']}/{control['max_uploads']} concurrent uploads, "
+                    f"target latency {args.target_latency:g}s")
+    
+    # Время стадий и счётчики workers суммируются здесь; в VM - только вместе с данными
+    metrics_url = import_url(args.vm_url, 'prometheus') if 'grafana' in targets and args.pipeline_metrics > 0 else None
+    pipeline_metrics = PipelineMetrics(metrics_url, send_batch_to_vm, args.pipeline_metrics)
+    if metrics_url:
+        logger.info(f"Self-metrics: huperf_pipeline_* every {args.pipeline_metrics:g}s (job={pipeline_metrics.job})")
     logger.info("="*80)
     
     start_time = time.time()
     
-    # Извлекаем архив (поддержка .zip и .7z)
-    # Используем уникальную директорию для каждого запуска (fix race condition)
-    unique_id = str(uuid.uuid4())[:8]
-    temp_dir = Path(f"temp_streaming_extract_{unique_id}")
-    logger.info(f"📂 Using temp directory: {temp_dir}")
-    if temp_dir.exists():
-        shutil.rmtree(temp_dir)
-    temp_dir.mkdir()
-    
-    # Определяем тип архива и извлекаем
+    # Определяем тип архива (поддержка .zip и .7z)
     input_suffix = input_path.suffix.lower()
+    temp_dir = None
     
     if input_suffix == '.7z':
         if not PY7ZR_AVAILABLE:
             logger.error("❌ py7zr не установлен! Установите: pip install py7zr")
             sys.exit(1)
-        logger.info(f"📦 Extracting 7z archive...")
+        # Используем уникальную директорию для каждого запуска (fix race condition)
+        unique_id = str(uuid.uuid4())[:8]
+        temp_dir = Path(f"temp_streaming_extract_{unique_id}")
+        logger.info(f"📂 Using temp directory: {temp_dir}")
+        if temp_dir.exists():
+            shutil.rmtree(temp_dir)
+        temp_dir.mkdir()
+        
+        # Список .tgz берём из заголовка архива (без распаковки), а сами файлы
+        # отдаются workers по мере распаковки (extractor thread + imap_unordered)
         with py7zr.SevenZipFile(input_path, mode='r') as archive:
-            archive.extractall(temp_dir)
+            tgz_infos = [info for info in archive.list() if info.filename.lower().endswith('.tgz')]
+        tgz_files = [temp_dir / info.filename for info in tgz_infos]
+        tgz_sizes = {str(temp_dir / info.filename): info.uncompressed for info in tgz_infos}
+        tgz_keys = {
+            str(temp_dir / info.filename): ledger_key(Path(info.filename).name, info.uncompressed, info.crc32)
+            for info in tgz_infos
+        }
+        logger.info(f"📦 Extracting 7z archive (pipelined with parsing)...")
     elif input_suffix == '.zip':
-        logger.info(f"📦 Extracting ZIP...")
-        with zipfile.ZipFile(input_path, 'r') as zip_ref:
-            zip_ref.extractall(temp_dir)
+        # Без extractall: workers получают имена .tgz внутри ZIP и
+        # распаковывают их параллельно на лету, каждый своим ZipFile
+        logger.info(f"📦 Reading ZIP members (no extraction)...")
+        tgz_files = list_zip_tgz_members(input_path)
+        tgz_sizes = {str(f): source_size(f) for f in tgz_files}
+        member_keys = zip_member_ledger_keys(input_path)
+        tgz_keys = {str(f): member_keys[f.member] for f in tgz_files}
     else:
         logger.error(f"❌ Неподдерживаемый формат архива: {input_suffix}")
         logger.error("   Поддерживаются: .zip, .7z")
         sys.exit(1)
     
-    # Находим .tgz файлы
-    tgz_files = list(temp_dir.rglob("*.tgz"))
+    logger.info(f"✅ Found {len(tgz_files)} .tgz files")
+    
+    # Журнал импортов: уже импортированные в этот VM файлы пропускаем (по содержимому).
+    # Журнал ведёт только импорт в VM: с CSV выходами файлы не пропускаются, только записываются
+    ledger = ImportLedger(args.ledger) if args.ledger and 'grafana' in targets else None
+    skipped_sources = set()
+    if ledger and not args.force and not file_targets:
+        skipped_sources = {
+            str(f) for f in tgz_files
+            if ledger.lookup(tgz_keys[str(f)], args.vm_url, time_from, time_to)
+        }
+        if skipped_sources:
+            logger.info(f"⏭️  Skipping {len(skipped_sources)} files already imported (ledger: {args.ledger})")
+            if len(skipped_sources) == len(tgz_files):
+                print(f"PROGRESS_JSON: {json.dumps({'total_files': 0, 'processed_files': 0, 'phase': 'done'})}", flush=True)
+                if temp_dir and temp_dir.exists():
+                    shutil.rmtree(temp_dir)
+                print(f"\n✅ Done! All {len(tgz_files)} files already imported, nothing to send")
+                return
+            tgz_files = [f for f in tgz_files if str(f) not in skipped_sources]
+            tgz_sizes = {source: size for source, size in tgz_sizes.items() if source not in skipped_sources}
+    
+    # Прерванные импорты: части файла продолжают с checkpoint (подтверждённой VM позиции),
+    # части, отправленные целиком, не запускаются заново
+    use_checkpoints = ledger is not None and not file_targets
+    resume_points = {}
+    if use_checkpoints and not args.force:
+        for f in tgz_files:
+            found = ledger.checkpoints(tgz_keys[str(f)], args.vm_url, time_from, time_to)
+            if found:
+                resume_points[str(f)] = found
+        if resume_points:
+            logger.info(f"↩️  Resuming {len(resume_points)} interrupted files from checkpoints (ledger: {args.ledger})")
+    
+    # Блоки, уже импортированные из перекрывающихся архивов, не декодируются; индекс по SN
+    # ведётся по --vm-url, как журнал. CSV выходам нужны все блоки - там без дедупликации
+    dedup = None
+    if args.dedup_dir:
+        if file_targets:
+            logger.warning(f"--dedup-dir ignored: targets {', '.join(file_targets)} need every block")
+        else:
+            dedup = (args.dedup_dir, args.vm_url, not args.force)
+    
     total_files = len(tgz_files)
-    logger.info(f"✅ Found {total_files} .tgz files")
     
     # Выводим начальный прогресс для API (JSON формат для парсинга)
     print(f"PROGRESS_JSON: {json.dumps({'total_files': total_files, 'processed_files': 0, 'phase': 'starting'})}", flush=True)
@@ -601,11 +1167,65 @@ def main():
     logger.info(f"📌 Array SN: {array_sn}")
     logger.info("="*80)
     
+    # Крупные файлы делим на части по блокам, чтобы не было длинного
+    # однопоточного хвоста: время ~ общий объём / cores, а не самый большой файл
+    total_bytes = sum(tgz_sizes.values())
+    # PerfMonkey собирает строку по timestamp из всех блоков файла - такие файлы не делим
+    split_min_bytes = args.split_min_mb * 1024 * 1024 if 'perfmonkey' not in targets else 0
+    file_parts = {
+        source: split_parts(size, total_bytes, num_workers, split_min_bytes)
+        for source, size in tgz_sizes.items()
+    }
+    # Продолжаемый файл делится так же, как в прерванном запуске (позиции - по частям)
+    for source, (parts, _) in resume_points.items():
+        file_parts[source] = parts
+    split_count = sum(1 for parts in file_parts.values() if parts > 1)
+    if split_count:
+        logger.info(f"✂️  Splitting {split_count} large files into {sum(file_parts.values()) - total_files + split_count} block parts")
+    
     # Параллельная обработка
-    process_args = [
-        (f, args.vm_url, args.batch_size, resources, metrics, array_sn)
-        for f in tgz_files
-    ]
+    if input_suffix == '.7z':
+        tgz_source = (
+            f for f in iter_extracted_7z_tgz(input_path, temp_dir)
+            if str(f) not in skipped_sources
+        )
+    else:
+        tgz_source = tgz_files
+    
+    # CSV выходы: каталог, заголовки PerfMonkey и locks на его файлы (пишут все workers)
+    output_dir = Path(args.output_dir) if file_targets else None
+    file_locks = None
+    manager = None
+    if output_dir:
+        output_dir.mkdir(parents=True, exist_ok=True)
+    if 'perfmonkey' in targets:
+        manager = Manager()
+        file_locks = create_perfmonkey_output(output_dir, manager)
+    
+    def part_checkpoint(source: str, part: int):
+        """Аргумент checkpoint worker'а: журнал, ключ файла, target и позиция старта части."""
+        if not use_checkpoints:
+            return None
+        entry = resume_points.get(source, (1, {}))[1].get(part)
+        if entry is None:
+            return args.ledger, tgz_keys[source], args.vm_url, (0, 0), 0
+        position = entry['checkpoint']
+        return args.ledger, tgz_keys[source], args.vm_url, (position['block'], position['series']), entry['metrics']
+    
+    def part_done(source: str, part: int) -> bool:
+        entry = resume_points.get(source, (1, {}))[1].get(part)
+        return entry is not None and entry['checkpoint']['done']
+    
+    process_args = (
+        (f, send_url, args.batch_size, resources, metrics, array_sn, time_from, time_to,
+         part, file_parts.get(str(f), 1), args.cache_dir, targets, output_dir, file_locks,
+         args.import_format, args.upload_threads, args.upload_queue,
+         args.batch_mb * 1024 * 1024, args.stream_upload, part_checkpoint(str(f), part),
+         shard_key_for(args.sharding, array_sn), dedup)
+        for f in tgz_source
+        for part in range(file_parts.get(str(f), 1))
+        if not part_done(str(f), part)
+    )
     
     logger.info(f"🔥 Processing {total_files} files with {num_workers} workers...")
     
@@ -613,11 +1233,52 @@ def main():
     # Это позволяет выводить реальный прогресс обработки
     results = []
     processed_files = 0
+    parts_left = {
+        source: parts - sum(1 for part in range(parts) if part_done(source, part))
+        for source, parts in file_parts.items()
+    }
+    file_success = {}
+    # Метрики, отправленные прерванным запуском, входят в итог файла
+    file_metrics = {
+        source: sum(entry['metrics'] for entry in positions.values())
+        for source, (_, positions) in resume_points.items()
+    }
+    file_spans = {}
     
-    with Pool(processes=num_workers) as pool:
+    # Все части отправлены прерванным запуском - не записан только итог
+    for source, left in parts_left.items():
+        if left <= 0 and source in resume_points:
+            file_success[source] = True
+            processed_files += 1
+            ledger.record(tgz_keys[source], args.vm_url, file_metrics[source],
+                          time_from=time_from, time_to=time_to)
+    
+    with Pool(processes=num_workers, initializer=init_worker,
+              initargs=(compression, ingest_controller, pipeline_metrics.queue,
+                        args.pipeline_metrics if metrics_url else 0)) as pool:
         for result in pool.imap_unordered(process_single_tgz_streaming, process_args):
             results.append(result)
-            processed_files += 1
+            
+            # Файл обработан, когда завершены все его части
+            source = result.get('source', '')
+            file_success[source] = file_success.get(source, True) and result.get('success', False)
+            file_metrics[source] = file_metrics.get(source, 0) + result.get('metrics', 0)
+            first_ms, last_ms = result.get('data_span') or (None, None)
+            if first_ms is not None:
+                span = file_spans.setdefault(source, [first_ms, last_ms])
+                span[0], span[1] = min(span[0], first_ms), max(span[1], last_ms)
+            parts_left[source] = parts_left.get(source, 1) - 1
+            if parts_left[source] <= 0:
+                processed_files += 1
+                # Файл целиком импортирован - записываем в журнал сразу (прерванный запуск не теряет прогресс)
+                if ledger and file_success[source] and source in tgz_keys:
+                    span = file_spans.get(source, [None, None])
+                    ledger.record(
+                        tgz_keys[source], args.vm_url, file_metrics[source],
+                        data_from=span[0] // 1000 if span[0] is not None else None,
+                        data_to=span[1] // 1000 if span[1] is not None else None,
+                        time_from=time_from, time_to=time_to,
+                    )
             
             # Выводим прогресс после каждого завершенного файла (JSON формат для API)
             progress_data = {
@@ -629,14 +1290,32 @@ def main():
             }
             print(f"PROGRESS_JSON: {json.dumps(progress_data)}", flush=True)
     
+    # Workers завершены - итог метрик pipeline
+    pipeline_metrics.close()
+    
     # Статистика
     total_time = time.time() - start_time
     total_metrics = sum(r['metrics'] for r in results)
     total_batches = sum(r.get('batches', 0) for r in results)
-    success_count = sum(1 for r in results if r['success'])
+    total_rows = {
+        target: sum(r.get('rows', {}).get(target, 0) for r in results)
+        for target in file_targets
+    }
+    success_count = sum(
+        1 for source, ok in file_success.items() if ok and parts_left.get(source, 0) <= 0
+    )
+    
+    if 'perfmonkey' in targets:
+        logger.info("Sorting and renumbering PerfMonkey CSV files...")
+        finish_perfmonkey_output(output_dir)
+        manager.shutdown()
     
     if monitor:
-        monitor.update(total_metrics)
+        monitor.update(
+            total_metrics,
+            raw_bytes=sum(r.get('raw_bytes', 0) for r in results),
+            wire_bytes=sum(r.get('wire_bytes', 0) for r in results),
+        )
         monitor.report()
     
     logger.info("="*80)
@@ -644,8 +1323,25 @@ def main():
     logger.info("="*80)
     logger.info(f"📊 Results:")
     logger.info(f"   Files processed: {success_count}/{len(tgz_files)}")
+    if skipped_sources:
+        logger.info(f"   Files skipped:   {len(skipped_sources)} (already in ledger)")
     logger.info(f"   Metrics sent:    {total_metrics:,}")
     logger.info(f"   Batches sent:    {total_batches:,}")
+    if dedup:
+        logger.info(f"   Blocks skipped:  {sum(r.get('skipped_blocks', 0) for r in results):,} (already imported)")
+    if ingest_controller:
+        control = ingest_controller.snapshot()
+        logger.info(f"   Adaptive:        {control['limit']}/{control['max_uploads']} uploads, "
+                    f"batch {control['batch_bytes'] / (1024 * 1024):.1f} MB, latency {control['latency']:.2f}s "
+                    f"({control['increases']} up / {control['decreases']} down, "
+                    f"{control['errors']} errors in {control['requests']:,} requests)")
+    for target, count in total_rows.items():
+        logger.info(f"   {target + ' rows:':<17}{count:,}")
+    stage_seconds = pipeline_metrics.stage_seconds()
+    if any(stage_seconds.values()):
+        logger.info("   Stage time:      " + ', '.join(f"{name} {seconds:.2f}s" for name, seconds in stage_seconds.items()))
+    if metrics_url:
+        logger.info(f"   Self-metrics:    {pipeline_metrics.pushes} pushes, {pipeline_metrics.push_errors} failed")
     logger.info(f"   Total time:      {total_time:.1f}s ({total_time/60:.1f} min)")
     logger.info(f"   Throughput:      {total_metrics/total_time:,.0f} metrics/sec")
     logger.info(f"   Array SN:        {array_sn}")
@@ -655,20 +1351,16 @@ def main():
     logger.info("="*80)
     
     # Cleanup
-    if temp_dir.exists():
+    if temp_dir and temp_dir.exists():
         shutil.rmtree(temp_dir)
     
-    temp_path = Path("temp")
-    if temp_path.exists():
-        for item in temp_path.iterdir():
-            if item.is_dir():
-                try:
-                    shutil.rmtree(item)
-                except:
-                    pass
-    
-    print(f"\n✅ Done! Sent {total_metrics:,} metrics in {total_time:.1f}s")
-    print(f"📊 Check VictoriaMetrics: {args.vm_url.replace('/api/v1/import/prometheus', '')}")
+    if 'grafana' in targets:
+        print(f"\n✅ Done! Sent {total_metrics:,} metrics in {total_time:.1f}s")
+        print(f"📊 Check VictoriaMetrics: {args.vm_url.replace('/api/v1/import/prometheus', '')}")
+    else:
+        print(f"\n✅ Done! Processed {success_count} files in {total_time:.1f}s")
+    if file_targets:
+        print(f"📁 CSV output: {output_dir}")
     
     # Автоматическое обновление словарей если есть unknown IDs
     auto_update_script = Path(__file__).parent / "auto_update_dictionaries.py"
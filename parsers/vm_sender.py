@@ -0,0 +1,708 @@
+#!/usr/bin/env python3
+"""
+VM SENDER: отправка данных в VictoriaMetrics через пул keep-alive соединений.
+
+Одна requests.Session на процесс: батчи идут по уже открытым соединениям
+вместо TCP handshake на каждый requests.post, и под десятками workers сокеты
+не копятся в TIME_WAIT. После fork (workers multiprocessing.Pool) процесс
+создаёт свою Session - соединения родителя не делятся между процессами.
+
+Тело import запроса можно сжимать (Content-Encoding gzip или zstd): label'ы
+Element/Resource/SN/scrape_interval повторяются в каждой строке, и текст
+сжимается в 10-20 раз - важно, когда VM за медленным каналом. Сжатие идёт в
+процессе, который отправляет (в workers), не в главном процессе.
+
+Неудачный запрос (сетевая ошибка, 429, 5xx) повторяется с экспоненциальной
+паузой; 4xx (ошибка в данных) не повторяется.
+
+BatchUploader отправляет батчи из фоновых потоков: пока батч в пути, вызывающий
+поток декодирует следующий (CPU и сеть работают одновременно), а ограниченная
+очередь не даёт декодеру уйти далеко вперёд медленного VM.
+
+С set_ingest_controller() каждый запрос проходит через IngestController
+(ingest_controller): общий на все процессы лимит запросов в пути и размер
+батча подстраиваются под задержку и ошибки VM.
+
+URL импорта может быть списком endpoints через запятую (несколько VM или
+vminsert): каждый запрос уходит на один из них - по кругу (round-robin) или,
+с shard_key (SN массива), на endpoint по rendezvous hashing, чтобы серии
+одного массива жили на одном shard. У каждого endpoint своё здоровье в
+процессе: после неудачи он обходится VM_ENDPOINT_COOLDOWN секунд (дальше x2),
+а запрос сразу повторяется на следующем endpoint (failover).
+
+Форматы импорта (IMPORT_PATHS): prometheus - строка на сэмпл, jsonl - строка
+на серию блока ({"metric": {...}, "values": [...], "timestamps": [...]}),
+labels в ней пишутся один раз на серию, а не на каждую точку.
+
+Время сжатия и запросов, запросы и байты тел учитываются в pipeline_metrics
+(стадии compress и send).
+
+Используется streaming_pipeline, perf_watcher, reexport_unknown_metrics и
+VictoriaMetricsClient (tools/batch_import).
+
+Настройки (env):
+    VM_POOL_SIZE          - соединений в пуле на хост (default: 4)
+    VM_CONNECT_TIMEOUT    - таймаут установки соединения, секунды (default: 5)
+    VM_READ_TIMEOUT       - таймаут ответа, секунды (default: 30)
+    VM_COMPRESSION        - сжатие тела запроса: none, gzip, zstd (default: none)
+    VM_COMPRESSION_LEVEL  - уровень сжатия (default: gzip 1, zstd 3)
+    VM_IMPORT_FORMAT      - формат импорта: prometheus, jsonl (default: prometheus)
+    VM_UPLOAD_THREADS     - потоков отправки BatchUploader, 0 - синхронно (default: 1)
+    VM_UPLOAD_QUEUE       - батчей в очереди BatchUploader до блокировки декодера (default: 2)
+    VM_SEND_RETRIES       - повторов неудачного запроса (default: 3)
+    VM_RETRY_BACKOFF      - пауза перед первым повтором, секунды; дальше x2 (default: 1)
+    VM_RETRY_BACKOFF_MAX  - максимальная пауза между повторами, секунды (default: 30)
+    VM_BATCH_BYTES        - байт в батче (до сжатия), батч уходит по этому порогу или
+                            по числу метрик - что раньше (default: 16MB)
+    VM_SHARDING           - выбор endpoint из списка: round-robin или sn (default: round-robin)
+    VM_ENDPOINT_COOLDOWN  - сколько секунд обходить endpoint после неудачи; дальше x2 (default: 5)
+"""
+
+import gzip
+import hashlib
+import itertools
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import zlib
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# zstd - опционально (pip install zstandard)
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+try:
+    from .pipeline_metrics import count, stage
+except ImportError:
+    from pipeline_metrics import count, stage
+
+logger = logging.getLogger(__name__)
+
+VM_POOL_SIZE = int(os.getenv("VM_POOL_SIZE", "4"))
+VM_CONNECT_TIMEOUT = float(os.getenv("VM_CONNECT_TIMEOUT", "5"))
+VM_READ_TIMEOUT = float(os.getenv("VM_READ_TIMEOUT", "30"))
+VM_COMPRESSION = os.getenv("VM_COMPRESSION", "none")
+VM_COMPRESSION_LEVEL = os.getenv("VM_COMPRESSION_LEVEL", "")
+VM_IMPORT_FORMAT = os.getenv("VM_IMPORT_FORMAT", "prometheus").strip().lower() or "prometheus"
+VM_UPLOAD_THREADS = int(os.getenv("VM_UPLOAD_THREADS", "1"))
+VM_UPLOAD_QUEUE = int(os.getenv("VM_UPLOAD_QUEUE", "2"))
+VM_SEND_RETRIES = int(os.getenv("VM_SEND_RETRIES", "3"))
+VM_RETRY_BACKOFF = float(os.getenv("VM_RETRY_BACKOFF", "1"))
+VM_RETRY_BACKOFF_MAX = float(os.getenv("VM_RETRY_BACKOFF_MAX", "30"))
+VM_BATCH_BYTES = int(os.getenv("VM_BATCH_BYTES", str(16 * 1024 * 1024)))  # 16MB, с запасом до -maxInsertRequestSize
+VM_SHARDING = os.getenv("VM_SHARDING", "round-robin")
+VM_ENDPOINT_COOLDOWN = float(os.getenv("VM_ENDPOINT_COOLDOWN", "5"))
+
+COMPRESSION_ALGORITHMS = ('none', 'gzip', 'zstd')
+# gzip 1 / zstd 3: почти тот же коэффициент на повторяющихся labels при малой цене CPU
+DEFAULT_COMPRESSION_LEVELS = {'gzip': 1, 'zstd': 3}
+
+# Endpoint импорта VM для формата тела запроса
+IMPORT_PATHS = {
+    'prometheus': '/api/v1/import/prometheus',
+    'jsonl': '/api/v1/import',
+}
+IMPORT_FORMATS = tuple(IMPORT_PATHS)
+
+# Формат по умолчанию для обоих CLI (--format) - только из IMPORT_FORMATS
+if VM_IMPORT_FORMAT not in IMPORT_FORMATS:
+    logger.warning(f"VM_IMPORT_FORMAT ignored: unknown format {VM_IMPORT_FORMAT!r} "
+                   f"(expected: {', '.join(IMPORT_FORMATS)})")
+    VM_IMPORT_FORMAT = 'prometheus'
+
+# Выбор endpoint из списка: по кругу или по SN массива (shard_key)
+SHARDING_MODES = ('round-robin', 'sn')
+
+_session: Optional[requests.Session] = None
+_session_pid: Optional[int] = None
+
+_compression: Optional[str] = None
+_compression_level: Optional[int] = None
+# ZstdCompressor не потокобезопасен - свой на каждый поток отправки
+_zstd_local = threading.local()
+
+# AIMD контроллер нагрузки на VM (ingest_controller.IngestController) или None
+_ingest_controller = None
+
+# Здоровье endpoints в этом процессе: {url: EndpointHealth}
+_endpoints: Dict[str, 'EndpointHealth'] = {}
+_endpoints_lock = threading.Lock()
+_round_robin = itertools.count()
+
+# Счётчики процесса: отправлено батчей, повторов, байт до сжатия и байт на проводе
+_send_stats = {'batches': 0, 'retries': 0, 'raw_bytes': 0, 'wire_bytes': 0}
+_send_stats_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """Session процесса с пулом keep-alive соединений (новая после fork)."""
+    global _session, _session_pid
+    if _session is None or _session_pid != os.getpid():
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=VM_POOL_SIZE, pool_maxsize=VM_POOL_SIZE)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _session, _session_pid = session, os.getpid()
+    return _session
+
+
+def configure_compression(algorithm: Optional[str], level: Optional[int] = None):
+    """
+    Включить сжатие тела запросов в этом процессе.
+    
+    Вызывается в главном процессе и как initializer multiprocessing.Pool -
+    чтобы workers сжимали свои батчи сами.
+    
+    Raises:
+        ValueError: Неизвестный алгоритм, неверный уровень или нет модуля zstandard
+    """
+    global _compression, _compression_level
+    algorithm = (algorithm or 'none').lower()
+    if algorithm not in COMPRESSION_ALGORITHMS:
+        raise ValueError(f"Unknown compression {algorithm!r} (expected: {', '.join(COMPRESSION_ALGORITHMS)})")
+    if algorithm == 'zstd' and not ZSTD_AVAILABLE:
+        raise ValueError("zstd compression requires the zstandard package (pip install zstandard)")
+
+    if algorithm == 'none':
+        _compression, _compression_level = None, None
+        return
+
+    level = DEFAULT_COMPRESSION_LEVELS[algorithm] if level is None else int(level)
+    if algorithm == 'gzip' and not 0 <= level <= 9:
+        raise ValueError(f"gzip compression level must be 0..9, got {level}")
+    _compression, _compression_level = algorithm, level
+
+
+def set_ingest_controller(controller):
+    """
+    Пропускать запросы этого процесса через IngestController (None - без контроля).
+    
+    Как configure_compression, вызывается и в initializer multiprocessing.Pool.
+    """
+    global _ingest_controller
+    _ingest_controller = controller
+
+
+def compression_settings() -> Tuple[Optional[str], Optional[int]]:
+    """(алгоритм, уровень) сжатия этого процесса; (None, None) - без сжатия."""
+    return _compression, _compression_level
+
+
+def compress_payload(payload: bytes) -> Tuple[bytes, Optional[str]]:
+    """Сжать payload настроенным алгоритмом -> (тело, Content-Encoding или None)."""
+    if _compression == 'gzip':
+        return gzip.compress(payload, compresslevel=_compression_level, mtime=0), 'gzip'
+    if _compression == 'zstd':
+        level, compressor = getattr(_zstd_local, 'compressor', (None, None))
+        if level != _compression_level:
+            compressor = zstandard.ZstdCompressor(level=_compression_level)
+            _zstd_local.compressor = (_compression_level, compressor)
+        return compressor.compress(payload), 'zstd'
+    return payload, None
+
+
+def get_send_stats() -> dict:
+    """Счётчики отправки процесса: batches, retries, raw_bytes (до сжатия), wire_bytes (тела запросов)."""
+    with _send_stats_lock:
+        return dict(_send_stats)
+
+
+@lru_cache(maxsize=64)
+def parse_endpoints(vm_url: str) -> Tuple[str, ...]:
+    """Список endpoints из URL через запятую: 'http://a:8480/...,http://b:8480/...'."""
+    endpoints = tuple(url.strip() for url in vm_url.split(',') if url.strip())
+    if not endpoints:
+        raise ValueError(f"No VictoriaMetrics URL in {vm_url!r}")
+    return endpoints
+
+
+def import_url(vm_url: str, import_format: str) -> str:
+    """
+    URL импорта для формата: vm_url - базовый URL VM или любой его import endpoint
+    (список через запятую - для каждого endpoint).
+    
+    import_url('http://vm:8428/api/v1/import/prometheus', 'jsonl') -> 'http://vm:8428/api/v1/import'
+    """
+    urls = []
+    for endpoint in parse_endpoints(vm_url):
+        base = endpoint.rstrip('/')
+        # Длинные пути первыми: /api/v1/import - префикс /api/v1/import/prometheus
+        for path in sorted(IMPORT_PATHS.values(), key=len, reverse=True):
+            if base.endswith(path):
+                base = base[:-len(path)]
+                break
+        urls.append(base + IMPORT_PATHS[import_format])
+    return ','.join(urls)
+
+
+def shard_key_for(sharding: str, array_sn: str) -> Optional[str]:
+    """
+    shard_key запросов для режима sharding: 'sn' - SN массива, 'round-robin' - None.
+    
+    Raises:
+        ValueError: Неизвестный режим
+    """
+    if sharding not in SHARDING_MODES:
+        raise ValueError(f"Unknown sharding {sharding!r} (expected: {', '.join(SHARDING_MODES)})")
+    return array_sn if sharding == 'sn' else None
+
+
+class EndpointHealth:
+    """Здоровье endpoint VM в процессе: неудач подряд, до какого момента обходить, отправлено запросов."""
+    
+    def __init__(self):
+        self.failures = 0
+        self.down_until = 0.0
+        self.requests = 0
+    
+    def is_up(self, now: float) -> bool:
+        return self.down_until <= now
+
+
+def _endpoint_health(url: str) -> EndpointHealth:
+    with _endpoints_lock:
+        health = _endpoints.get(url)
+        if health is None:
+            health = _endpoints[url] = EndpointHealth()
+        return health
+
+
+def _endpoint_ok(url: str):
+    health = _endpoint_health(url)
+    with _endpoints_lock:
+        recovered = health.failures > 0
+        health.failures = 0
+        health.down_until = 0.0
+        health.requests += 1
+    if recovered:
+        logger.info(f"VM endpoint {url} is back")
+
+
+def _endpoint_failed(url: str):
+    health = _endpoint_health(url)
+    with _endpoints_lock:
+        health.failures += 1
+        health.requests += 1
+        cooldown = min(VM_ENDPOINT_COOLDOWN * 2 ** (health.failures - 1), VM_RETRY_BACKOFF_MAX)
+        health.down_until = time.monotonic() + cooldown
+        failures = health.failures
+    logger.warning(f"VM endpoint {url} marked down for {cooldown:.0f}s ({failures} failures in a row)")
+
+
+def _shard_rank(shard_key: str, url: str) -> bytes:
+    # Не hash(): он разный в каждом процессе (PYTHONHASHSEED)
+    return hashlib.blake2b(f"{shard_key}|{url}".encode('utf-8'), digest_size=8).digest()
+
+
+def endpoint_order(vm_url: str, shard_key: Optional[str] = None) -> List[str]:
+    """
+    Порядок попыток по endpoints vm_url: первый - куда отправлять, дальше - failover.
+    
+    shard_key (SN массива): rendezvous hashing - у ключа всегда один и тот же
+    порядок, а добавление endpoint переносит на него только часть ключей;
+    без shard_key - по кругу. Endpoints после неудачи (cooldown) - в конце.
+    """
+    endpoints = parse_endpoints(vm_url)
+    if len(endpoints) == 1:
+        return list(endpoints)
+    if shard_key is not None:
+        endpoints = sorted(endpoints, key=lambda url: _shard_rank(shard_key, url), reverse=True)
+    now = time.monotonic()
+    up = [url for url in endpoints if _endpoint_health(url).is_up(now)]
+    down = [url for url in endpoints if url not in up]
+    if shard_key is None and up:
+        # По кругу среди доступных; счётчик копируется при fork - сдвиг по pid,
+        # чтобы workers не начинали с одного endpoint
+        start = (next(_round_robin) + os.getpid()) % len(up)
+        up = up[start:] + up[:start]
+    return up + down
+
+
+def get_endpoint_stats() -> Dict[str, dict]:
+    """Здоровье endpoints процесса: {url: {requests, failures, up}}."""
+    now = time.monotonic()
+    with _endpoints_lock:
+        return {
+            url: {'requests': health.requests, 'failures': health.failures, 'up': health.is_up(now)}
+            for url, health in _endpoints.items()
+        }
+
+
+def vm_timeout(read_timeout: Optional[float] = None) -> Tuple[float, float]:
+    """(connect, read) таймаут для запросов к VM."""
+    return VM_CONNECT_TIMEOUT, (VM_READ_TIMEOUT if read_timeout is None else read_timeout)
+
+
+def _stream_compressor():
+    """Потоковый компрессор тела chunked запроса (compress/flush) или None."""
+    if _compression == 'gzip':
+        return zlib.compressobj(_compression_level, zlib.DEFLATED, 31)  # wbits 31 - формат gzip
+    if _compression == 'zstd':
+        return zstandard.ZstdCompressor(level=_compression_level).compressobj()
+    return None
+
+
+def _count_sent(batches: int, raw_bytes: int, wire_bytes: int, retries: int = 0):
+    with _send_stats_lock:
+        _send_stats['batches'] += batches
+        _send_stats['retries'] += retries
+        _send_stats['raw_bytes'] += raw_bytes
+        _send_stats['wire_bytes'] += wire_bytes
+    count(batches=batches, retries=retries, payload_bytes=raw_bytes, wire_bytes=wire_bytes)
+
+
+def retry_delay(attempt: int) -> float:
+    """Пауза перед повтором attempt (с 1): VM_RETRY_BACKOFF * 2^(attempt-1), не больше максимума, с jitter."""
+    delay = min(VM_RETRY_BACKOFF * 2 ** (attempt - 1), VM_RETRY_BACKOFF_MAX)
+    # Jitter: workers после общего сбоя VM не повторяют запросы синхронно
+    return delay * random.uniform(0.5, 1.0)
+
+
+def _post_once(url: str, data, headers: Optional[dict]) -> Optional[bool]:
+    """Один запрос: True - принят, False - отклонён (4xx), None - повторить (сеть, 429, 5xx)."""
+    try:
+        with stage('send'):
+            response = get_session().post(url, data=data, headers=headers, timeout=vm_timeout())
+    except requests.RequestException as e:
+        logger.error(f"Failed to send batch to VM: {e}")
+        return None
+    if response.status_code in (200, 204):
+        return True
+    logger.error(f"VM returned {response.status_code}: {response.text[:200]}")
+    # 4xx - ошибка в данных, повтор не поможет
+    if response.status_code != 429 and response.status_code < 500:
+        return False
+    return None
+
+
+def _post(url: str, data, headers: Optional[dict], retries: int = VM_SEND_RETRIES,
+          shard_key: Optional[str] = None, failover: bool = True) -> bool:
+    """
+    POST на endpoint из url (список - по endpoint_order) с повторами.
+    
+    Неудача на endpoint - повтор сразу на следующем доступном (failover), на
+    том же или недоступном - после паузы retry_delay. С failover попыток не
+    меньше, чем endpoints; failover=False - тело нельзя отправить повторно.
+    """
+    endpoints = endpoint_order(url, shard_key)
+    attempts = retries + 1
+    if failover:
+        attempts = max(attempts, len(endpoints))
+    endpoint = None
+    for attempt in range(attempts):
+        previous, endpoint = endpoint, endpoints[attempt % len(endpoints)]
+        if attempt:
+            _count_sent(0, 0, 0, retries=1)
+            if endpoint == previous or not _endpoint_health(endpoint).is_up(time.monotonic()):
+                delay = retry_delay(attempt)
+                logger.warning(f"Retrying VM request in {delay:.1f}s (attempt {attempt + 1}/{attempts})")
+                time.sleep(delay)
+            else:
+                logger.warning(f"Retrying VM request on {endpoint} (attempt {attempt + 1}/{attempts})")
+        
+        controller = _ingest_controller
+        if controller is None:
+            accepted = _post_once(endpoint, data, headers)
+        else:
+            # Слот контроллера - только на сам запрос, пауза перед повтором его не держит;
+            # задержка chunked потока (тело - генератор) говорит о размере файла, а не о VM
+            nbytes = len(data) if isinstance(data, (bytes, bytearray, memoryview)) else 0
+            started = controller.acquire(nbytes)
+            accepted = None
+            try:
+                accepted = _post_once(endpoint, data, headers)
+            finally:
+                controller.release(
+                    nbytes, started, 'ok' if accepted else ('rejected' if accepted is False else 'error'),
+                    timed=bool(nbytes),
+                )
+        # Здоровье endpoints нужно только для выбора из нескольких
+        if accepted is None:
+            if len(endpoints) > 1:
+                _endpoint_failed(endpoint)
+            continue
+        if len(endpoints) > 1:
+            _endpoint_ok(endpoint)  # 4xx - данные отклонены, но endpoint жив
+        return accepted
+    return False
+
+
+def send_payload(payload: Union[bytes, bytearray, memoryview, str], url: str,
+                 shard_key: Optional[str] = None) -> bool:
+    """POST готового payload в import endpoint VM (prometheus, jsonl, ...); shard_key - см. endpoint_order."""
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+
+    raw_size = len(payload)
+    with stage('compress'):
+        payload, encoding = compress_payload(payload)
+    _count_sent(1, raw_size, len(payload))
+    return _post(url, payload, {'Content-Encoding': encoding} if encoding else None, shard_key=shard_key)
+
+
+def send_stream(chunks: Iterable[bytes], url: str, shard_key: Optional[str] = None) -> bool:
+    """
+    POST потока кусков одним chunked запросом (Transfer-Encoding: chunked).
+    
+    Куски читаются из итератора по мере отправки и сжимаются потоково -
+    память не зависит от объёма тела. Без повторов: итератор уже прочитан.
+    """
+    def body():
+        compressor = _stream_compressor()
+        for chunk in chunks:
+            if compressor:
+                with stage('compress'):
+                    data = compressor.compress(chunk)
+            else:
+                data = chunk
+            _count_sent(0, len(chunk), len(data))
+            if data:
+                yield data
+        if compressor:
+            with stage('compress'):
+                tail = compressor.flush()
+            _count_sent(0, 0, len(tail))
+            yield tail
+
+    _count_sent(1, 0, 0)
+    return _post(url, body(), {'Content-Encoding': _compression} if _compression else None,
+                 retries=0, shard_key=shard_key, failover=False)
+
+
+def send_batch_to_vm(batch: list, vm_url: str, shard_key: Optional[str] = None) -> bool:
+    """Отправить батч метрик (куски bytes или строки) в VictoriaMetrics."""
+    if not batch:
+        return True
+
+    if isinstance(batch[0], bytes):
+        payload = b"".join(batch)
+    else:
+        payload = "".join(batch).encode('utf-8')
+    return send_payload(payload, vm_url, shard_key)
+
+
+def _batch_bytes_limit(batch_bytes: int) -> int:
+    """Порог батча в байтах: batch_bytes или меньше, если IngestController снизил размер батча."""
+    controller = _ingest_controller
+    return min(batch_bytes, controller.batch_bytes()) if controller is not None else batch_bytes
+
+
+class PayloadBuffer:
+    """
+    Тело батча в одном переиспользуемом bytearray.
+    
+    Куски копируются в буфер по месту (без списка кусков, join и encode копий);
+    reset() только сбрасывает размер - память буфера остаётся для следующего
+    батча. Отправляется memoryview на заполненную часть.
+    """
+    
+    def __init__(self):
+        self.data = bytearray()
+        self.size = 0
+        self.samples = 0
+    
+    def append(self, payload: bytes, samples: int):
+        end = self.size + len(payload)
+        self.data[self.size:end] = payload  # за пределами емкости bytearray растёт
+        self.size = end
+        self.samples += samples
+    
+    def send(self, vm_url: str, shard_key: Optional[str] = None) -> bool:
+        with memoryview(self.data)[:self.size] as payload:
+            return send_payload(payload, vm_url, shard_key)
+    
+    def reset(self):
+        self.size = 0
+        self.samples = 0
+
+
+class BatchUploader:
+    """
+    Отправка батчей в VictoriaMetrics из фоновых потоков.
+    
+    submit() кладёт батч в очередь глубиной queue_depth и сразу возвращается -
+    вызывающий поток продолжает декодирование, пока threads потоков отправляют
+    предыдущие батчи. Полная очередь блокирует submit() (backpressure): в памяти
+    не больше queue_depth + threads батчей. threads=0 - синхронная отправка
+    в submit(), как send_batch_to_vm.
+    
+    upload() собирает куски в батчи по числу метрик и по байтам в буферах
+    PayloadBuffer из пула uploader'а: отправленный буфер возвращается в пул
+    и заполняется снова. upload_stream() - вместо батчей один chunked запрос
+    на весь поток кусков (send_stream), в вызывающем потоке.
+    
+    После первой неудачной отправки (с повторами) submit() возвращает False,
+    остальные батчи из очереди не отправляются. close() дожидается отправки
+    и возвращает итог.
+    
+    on_sent(mark, metrics): вызывается по порядку батчей, когда VM подтвердил
+    батч и все предыдущие; mark - позиция, снятая upload(position=...) при
+    отправке батча, metrics - подтверждённых метрик всего. Так пишутся
+    checkpoints: с несколькими потоками батчи завершаются не по порядку.
+    
+    shard_key: ключ выбора endpoint из списка vm_url (SN массива) - все
+    батчи uploader'а уходят на один shard; None - по кругу.
+    """
+    
+    _STOP = object()
+    
+    def __init__(self, vm_url: str, threads: int = VM_UPLOAD_THREADS,
+                 queue_depth: int = VM_UPLOAD_QUEUE,
+                 on_sent: Optional[Callable[[object, int], None]] = None,
+                 shard_key: Optional[str] = None):
+        self.vm_url = vm_url
+        self.shard_key = shard_key
+        self.metrics_sent = 0
+        self.batches_sent = 0
+        self.failed = False
+        self.on_sent = on_sent
+        self._lock = threading.Lock()
+        # Подтверждение по порядку: номер следующего батча, ожидаемого подтверждения
+        self._next_seq = 0
+        self._confirmed_seq = 0
+        self._confirmed_metrics = 0
+        self._sent_out_of_order = {}
+        self._queue = queue.Queue(maxsize=max(1, queue_depth))
+        # Буферы: в очереди, в отправке и один заполняемый
+        self._free_buffers = queue.Queue()
+        self._buffers_left = max(0, threads) + max(1, queue_depth) + 1
+        self._threads = [
+            threading.Thread(target=self._upload_loop, name=f"vm-uploader-{n}", daemon=True)
+            for n in range(max(0, threads))
+        ]
+        for thread in self._threads:
+            thread.start()
+    
+    def _send(self, batch, samples: int, seq: int, mark):
+        try:
+            if self.failed:
+                return
+            if isinstance(batch, PayloadBuffer):
+                ok = batch.send(self.vm_url, self.shard_key)
+            else:
+                ok = send_batch_to_vm(batch, self.vm_url, self.shard_key)
+            with self._lock:
+                if not ok:
+                    self.failed = True
+                    return
+                self.metrics_sent += samples
+                self.batches_sent += 1
+                self._sent_out_of_order[seq] = (mark, samples)
+                while self._confirmed_seq in self._sent_out_of_order:
+                    confirmed_mark, confirmed_samples = self._sent_out_of_order.pop(self._confirmed_seq)
+                    self._confirmed_seq += 1
+                    self._confirmed_metrics += confirmed_samples
+                    if self.on_sent is not None and confirmed_mark is not None:
+                        self.on_sent(confirmed_mark, self._confirmed_metrics)
+        finally:
+            if isinstance(batch, PayloadBuffer):
+                batch.reset()
+                self._free_buffers.put(batch)
+    
+    def _upload_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is self._STOP:
+                return
+            self._send(*item)
+    
+    def get_buffer(self) -> PayloadBuffer:
+        """Пустой буфер батча из пула; все буферы заняты - ждём, пока отправится один."""
+        try:
+            return self._free_buffers.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._buffers_left > 0:
+                self._buffers_left -= 1
+                return PayloadBuffer()
+        return self._free_buffers.get()
+    
+    def submit(self, batch, samples: Optional[int] = None, mark=None) -> bool:
+        """
+        Поставить батч в очередь отправки; False - отправка уже не удалась.
+        
+        batch: PayloadBuffer (метрики - его samples) или список кусков bytes/str
+        (метрик - samples); mark - позиция для on_sent
+        """
+        if isinstance(batch, PayloadBuffer):
+            samples = batch.samples
+        if self.failed:
+            if isinstance(batch, PayloadBuffer):
+                batch.reset()
+                self._free_buffers.put(batch)
+            return False
+        seq, self._next_seq = self._next_seq, self._next_seq + 1
+        if self._threads:
+            self._queue.put((batch, samples, seq, mark))
+        else:
+            self._send(batch, samples, seq, mark)
+        return not self.failed
+    
+    def upload(self, chunks: Iterable[Tuple[bytes, int]], batch_size: int,
+               batch_bytes: int = VM_BATCH_BYTES, position: Optional[Callable[[], object]] = None) -> bool:
+        """
+        Отправить куски (payload, samples) батчами: батч уходит, когда в нём
+        batch_size метрик или batch_bytes байт (с IngestController - не больше
+        его текущего размера батча). После неудачной отправки куски дальше не
+        читаются; False - отправка не удалась.
+        
+        position: снимок позиции источника после последнего куска батча -
+        передаётся в on_sent, когда VM подтвердит батч
+        """
+        buffer = self.get_buffer()
+        limit_bytes = _batch_bytes_limit(batch_bytes)
+        for payload, samples in chunks:
+            buffer.append(payload, samples)
+            if buffer.samples >= batch_size or buffer.size >= limit_bytes:
+                if not self.submit(buffer, mark=position() if position else None):
+                    return False
+                buffer = self.get_buffer()
+                limit_bytes = _batch_bytes_limit(batch_bytes)
+        if buffer.size:
+            return self.submit(buffer, mark=position() if position else None)
+        self._free_buffers.put(buffer)
+        return not self.failed
+    
+    def upload_stream(self, chunks: Iterable[Tuple[bytes, int]]) -> bool:
+        """Отправить все куски (payload, samples) одним chunked запросом; False - не удалось."""
+        streamed = [0]
+        
+        def payloads():
+            for payload, samples in chunks:
+                yield payload
+                streamed[0] += samples
+        
+        ok = send_stream(payloads(), self.vm_url, self.shard_key)
+        with self._lock:
+            if ok:
+                self.metrics_sent += streamed[0]
+                self.batches_sent += 1
+            else:
+                self.failed = True
+        return ok
+    
+    def close(self) -> bool:
+        """Дождаться отправки всех батчей и остановить потоки; True - всё отправлено."""
+        for _ in self._threads:
+            self._queue.put(self._STOP)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        return not self.failed
+
+
+try:
+    configure_compression(VM_COMPRESSION, int(VM_COMPRESSION_LEVEL) if VM_COMPRESSION_LEVEL else None)
+except ValueError as e:
+    logger.warning(f"VM_COMPRESSION ignored: {e}")
@@ -0,0 +1,74 @@
+"""
+Shared pytest fixtures: a stub VictoriaMetrics import endpoint.
+"""
+
+import gzip
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+
+class ImportHandler(BaseHTTPRequestHandler):
+    """Keep-alive import endpoint: records bodies and client connections."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            body = b''
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                body += self.rfile.read(size)
+                self.rfile.readline()
+                if not size:
+                    break
+        else:
+            body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.release.wait(5)
+        self.server.encodings.append(self.headers.get('Content-Encoding'))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        self.server.bodies.append(body)
+        self.server.clients.add(self.client_address)
+        if self.server.unavailable:
+            self.server.unavailable -= 1
+            status = 503
+        else:
+            status = 400 if body.startswith(b'bad') else 204
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def start_vm_server():
+    """Factory: start a stub import endpoint -> (server, import URL); all are stopped at teardown."""
+    servers = []
+
+    def start():
+        server = ThreadingHTTPServer(('127.0.0.1', 0), ImportHandler)
+        server.bodies = []
+        server.encodings = []
+        server.release = threading.Event()
+        server.release.set()
+        server.clients = set()
+        server.unavailable = 0
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        servers.append(server)
+        return server, f"http://127.0.0.1:{server.server_address[1]}/api/v1/import/prometheus"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def vm_server(start_vm_server):
+    """One stub import endpoint: (server, import URL)."""
+    return start_vm_server()
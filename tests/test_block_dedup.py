@@ -0,0 +1,106 @@
+"""
+Unit tests for parsers/block_dedup.py
+"""
+
+import io
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from parsers.block_dedup import ImportedBlockIndex, block_key
+from parsers.dat_decoder import iter_dat_blocks
+from tests.test_dat_decoder import make_block, make_dat
+
+
+TARGET = 'http://vm:8428/api/v1/import/prometheus'
+SN = '2102355TJUFSQ4100015'
+
+
+def header(start, archive=60, rows=15, ctrl_id='1129'):
+    return {'StartTime': str(start), 'EndTime': str(start + archive * rows),
+            'Archive': str(archive), 'CtrlID': ctrl_id}
+
+
+def block(start, rows=15, written_rows=None, layout_hash='abc'):
+    """Just the fields ImportedBlocks.add() reads from a DataBlock."""
+    return SimpleNamespace(header=header(start, rows=rows),
+                           rows=rows if written_rows is None else written_rows,
+                           layout=SimpleNamespace(layout_hash=layout_hash), windowed=False)
+
+
+def test_block_key_includes_archive_and_layout():
+    assert block_key(header(1664312040), 'abc') == ('1129', 1664312040, 60, 'abc')
+    assert block_key(header(1664312040, archive=300), 'abc') != block_key(header(1664312040), 'abc')
+    assert block_key(header(1664312040), 'def') != block_key(header(1664312040), 'abc')
+
+
+def test_recorded_blocks_are_seen_by_other_instances(tmp_path):
+    """Index files are per SN and per target; a second reader picks up appended lines."""
+    writer = ImportedBlockIndex(tmp_path / 'idx')
+    reader = ImportedBlockIndex(tmp_path / 'idx')
+    assert reader.imported(SN, TARGET) == set()
+
+    keys = [block_key(header(1664312040), 'abc'), block_key(header(1664312940), 'abc')]
+    assert writer.record(SN, TARGET, keys)
+    assert writer.record(SN, TARGET, [])
+    assert reader.imported(SN, TARGET) == set(keys)
+    assert reader.imported(SN, 'http://other:8428/api/v1/import/prometheus') == set()
+    assert reader.imported('OTHER_SN', TARGET) == set()
+    assert [p.name for p in (tmp_path / 'idx').iterdir()] == [f'{SN}.jsonl']
+
+    more = [block_key(header(1664313840), 'abc')]
+    writer.record(SN, TARGET, more)
+    assert reader.imported(SN, TARGET) == set(keys + more)
+
+
+def test_broken_and_partial_lines(tmp_path):
+    index = ImportedBlockIndex(tmp_path)
+    index.record(SN, TARGET, [block_key(header(1664312040), 'abc')])
+    with open(index.path(SN), 'ab') as f:
+        f.write(b'{not json\n{"target": "' + TARGET.encode() + b'", "blocks": [["1129", 16')
+
+    assert len(ImportedBlockIndex(tmp_path).imported(SN, TARGET)) == 1
+
+
+def test_session_skips_known_and_records_complete_blocks(tmp_path):
+    index = ImportedBlockIndex(tmp_path)
+    first = index.session(SN, TARGET)
+    assert not first(header(1664312040), 'abc')
+    first.add(block(1664312040))
+    first.add(block(1664312940, written_rows=7))  # truncated tail: import again next time
+    assert first.commit()
+
+    second = index.session(SN, TARGET)
+    assert second(header(1664312040), 'abc')
+    assert not second(header(1664312940), 'abc')
+    assert not second(header(1664312040), 'changed-layout')
+    assert second.skipped == 1
+
+    # --force: nothing is skipped, blocks are still recorded
+    forced = index.session(SN, TARGET, skip_known=False)
+    assert not forced(header(1664312040), 'abc')
+    assert forced.skipped == 0
+
+
+def test_windowed_blocks_are_not_recorded(tmp_path):
+    """A block cut by --from/--to has a shifted header and is not marked imported."""
+    first, _ = make_block(1664312040, 60, 10)
+    second, _ = make_block(1664312640, 60, 10, seed=5)
+    data = make_dat(first, second)
+    session = ImportedBlockIndex(tmp_path).session(SN, TARGET)
+
+    decoded = list(iter_dat_blocks(io.BytesIO(data), time_from=1664312040 + 5 * 60))
+    assert [(b.rows, b.windowed) for b in decoded] == [(5, True), (10, False)]
+    for data_block in decoded:
+        session.add(data_block)
+
+    # The cut block would otherwise be recorded as a complete 5-row block at 1664312340
+    assert session.pending == [('1129', 1664312640, 60, decoded[1].layout.layout_hash)]
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
@@ -0,0 +1,374 @@
+"""
+Unit tests for parsers/dat_decoder.py
+"""
+
+import io
+import json
+import os
+import struct
+import sys
+import tarfile
+import zipfile
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from parsers.dat_decoder import (
+    DAT_FILE_HEADER_SIZE,
+    DatFormatError,
+    format_timestamps,
+    get_column_index,
+    iter_dat_blocks,
+    list_zip_tgz_members,
+    open_dat_source,
+    parse_time_bound,
+    dat_source_size,
+    split_parts,
+)
+from parsers.block_cache import iter_source_blocks
+from parsers.block_sinks import CsvSink, parse_targets
+from parsers.dat_index import block_index_path, get_block_index, iter_indexed_blocks
+
+
+GROUPS = [
+    ("207", ["0A", "0B"], ["CTE0.A", "CTE0.B"], [22, 18, 23]),
+    ("11", ["1", "2", "3"], ["lun_1", "lun.2", "lun-3"], [22, 25]),
+]
+
+
+def make_block(start, archive, rows, groups=GROUPS, written_rows=None, seed=0):
+    """Build one header block (map + samples) of a .dat file."""
+    header = {"EndTime": str(start + archive * rows), "StartTime": str(start),
+              "Archive": str(archive), "CtrlID": "1129"}
+    data_map = {ot: {"IDs": ids, "Names": names, "DataTypes": dts}
+                for ot, ids, names, dts in groups}
+    series = sum(len(ids) * len(dts) for _, ids, _, dts in groups)
+    text = json.dumps(header, separators=(',', ':'))[:-1] + ',"Map":' + \
+        json.dumps(data_map, separators=(',', ':')) + '}'
+    raw_map = text.encode('utf-8')
+
+    samples = [
+        [(seed + row * 1000 + col * 7) * (-1 if col % 5 == 4 else 1) for col in range(series)]
+        for row in range(rows if written_rows is None else written_rows)
+    ]
+    body = b''.join(struct.pack('<%dl' % series, *row) for row in samples)
+    return struct.pack('<l', 0) + struct.pack('<l', len(raw_map) + 8) + raw_map + body, samples
+
+
+def make_dat(*blocks):
+    return b'\0' * DAT_FILE_HEADER_SIZE + b''.join(blocks)
+
+
+def test_iter_dat_blocks_decodes_samples():
+    """Samples are decoded into a (rows x series) int32 matrix."""
+    block, samples = make_block(1664312040, 60, 15)
+    blocks = list(iter_dat_blocks(io.BytesIO(make_dat(block))))
+
+    assert len(blocks) == 1
+    decoded = blocks[0]
+    assert decoded.values.shape == (15, 12)
+    assert decoded.values.tolist() == samples
+    assert decoded.header['StartTime'] == '1664312040'
+    assert decoded.list_data_type[0] == ('207', '22', 'CTE0.A')
+    assert decoded.list_data_type[-1] == ('11', '25', 'lun-3')
+
+
+def test_iter_dat_blocks_multiple_and_truncated():
+    """All header blocks are read; the truncated tail keeps only full rows."""
+    first, first_samples = make_block(1664312040, 60, 15)
+    second, second_samples = make_block(1664312940, 5, 20, groups=GROUPS[:1],
+                                        written_rows=7, seed=3)
+    data = make_dat(first, second) + b'\x01\x02'  # partial row
+
+    blocks = list(iter_dat_blocks(io.BytesIO(data)))
+
+    assert [b.rows for b in blocks] == [15, 7]
+    assert blocks[0].values.tolist() == first_samples
+    assert blocks[1].values.tolist() == second_samples
+    assert blocks[1].header['Archive'] == '5'
+
+
+def test_block_timestamps_utc():
+    """Row timestamps are an int64 epoch-ms vector rendered in UTC."""
+    block, _ = make_block(1664312040, 60, 3)
+    decoded = next(iter_dat_blocks(io.BytesIO(make_dat(block))))
+
+    assert decoded.timestamps_ms.tolist() == [1664312040000, 1664312100000, 1664312160000]
+    assert format_timestamps(decoded.timestamps_ms, '%m/%d/%y %H:%M:%S') == \
+        ['09/27/22 20:54:00', '09/27/22 20:55:00', '09/27/22 20:56:00']
+
+
+def test_block_layout_is_cached():
+    """Blocks with the same map share one BlockLayout with column offsets."""
+    first, _ = make_block(1664312040, 60, 3)
+    second, _ = make_block(1664312220, 60, 3, seed=9)
+    blocks = list(iter_dat_blocks(io.BytesIO(make_dat(first, second))))
+
+    assert blocks[0].layout is blocks[1].layout
+    layout = blocks[0].layout
+    assert [(g.object_type, g.offset, g.series_count) for g in layout.groups] == \
+        [('207', 0, 6), ('11', 6, 6)]
+    assert layout.size_collect_once == 12 * 4
+
+
+def test_iter_dat_blocks_time_window():
+    """Blocks outside [from, to) are skipped; boundary blocks are sliced by row."""
+    first, _ = make_block(1664312040, 60, 15)
+    second, second_samples = make_block(1664312940, 60, 15, seed=5)
+    third, _ = make_block(1664313840, 60, 15, seed=7)
+    data = make_dat(first, second, third)
+
+    blocks = list(iter_dat_blocks(io.BytesIO(data), time_from=1664313000, time_to=1664313300))
+
+    assert len(blocks) == 1
+    assert blocks[0].values.tolist() == second_samples[1:6]
+    assert blocks[0].timestamps_ms[[0, -1]].tolist() == [1664313000000, 1664313240000]
+    assert parse_time_bound('2022-09-27T21:10:00') == 1664313000
+    assert parse_time_bound('2022-09-28T00:10:00+03:00') == 1664313000
+
+
+def test_column_index_selects_only_requested_series():
+    """A compiled column index gathers just the selected series."""
+    block, samples = make_block(1664312040, 60, 4)
+    decoded = next(iter_dat_blocks(io.BytesIO(make_dat(block))))
+
+    index = get_column_index(decoded.layout, 'test-23', lambda r, m: m == '23')
+    assert index.tolist() == [2, 5]
+    assert get_column_index(decoded.layout, 'test-23', lambda r, m: False) is index
+    assert decoded.select(index).tolist() == [[row[2] for row in samples],
+                                              [row[5] for row in samples]]
+
+
+def test_iter_dat_blocks_truncated_header():
+    """A cut-off block map raises DatFormatError."""
+    block, _ = make_block(1664312040, 60, 15)
+    data = make_dat(block) + struct.pack('<l', 0) + struct.pack('<l', 500) + b'{"End'
+
+    with pytest.raises(DatFormatError):
+        list(iter_dat_blocks(io.BytesIO(data)))
+
+
+def test_zip_member_streamed_without_extraction(tmp_path):
+    """A .tgz inside a ZIP is decoded straight from the archive."""
+    block, samples = make_block(1664312040, 60, 15)
+    data = make_dat(block)
+
+    tgz_buffer = io.BytesIO()
+    with tarfile.open(fileobj=tgz_buffer, mode='w:gz') as tar:
+        info = tarfile.TarInfo('perf.dat')
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+
+    zip_path = tmp_path / 'upload.zip'
+    with zipfile.ZipFile(zip_path, 'w') as zf:
+        zf.writestr('dir/PerfData_X_SN_ABC_SP0_0_20240101.tgz', tgz_buffer.getvalue())
+        zf.writestr('dir/readme.txt', 'x')
+
+    members = list_zip_tgz_members(zip_path)
+    assert [m.name for m in members] == ['PerfData_X_SN_ABC_SP0_0_20240101.tgz']
+
+    with open_dat_source(members[0]) as fin:
+        blocks = list(iter_dat_blocks(fin))
+    assert blocks[0].values.tolist() == samples
+    assert list(tmp_path.iterdir()) == [zip_path]
+
+
+def test_block_index_sidecar_and_indexed_reads(tmp_path):
+    """The block index is cached next to the file and lets readers skip blocks."""
+    first, _ = make_block(1664312040, 60, 15)
+    second, second_samples = make_block(1664312940, 60, 15, seed=5)
+    third, third_samples = make_block(1664313840, 5, 20, groups=GROUPS[:1],
+                                      written_rows=7, seed=3)
+    dat_path = tmp_path / 'perf.dat'
+    dat_path.write_bytes(make_dat(first, second, third))
+
+    entries = get_block_index(dat_path)
+    assert [(e.start_time, e.archive, e.rows) for e in entries] == \
+        [(1664312040, 60, 15), (1664312940, 60, 15), (1664313840, 5, 7)]
+    assert entries[0].offset == DAT_FILE_HEADER_SIZE
+    assert entries[2].data_end_time == 1664313840 + 7 * 5
+    assert block_index_path(dat_path).exists()
+    assert get_block_index(dat_path) == entries
+
+    with open(dat_path, 'rb') as fin:
+        blocks = list(iter_indexed_blocks(fin, entries[1:]))
+    assert [b.values.tolist() for b in blocks] == [second_samples, third_samples]
+
+
+def test_partial_reads_use_block_index(tmp_path):
+    """A full pass writes the block index; windowed, part and resume reads seek by it."""
+    blocks = [make_block(1664312040 + i * 900, 60, 15, seed=i) for i in range(4)]
+    data = make_dat(*(block for block, _ in blocks))
+    dat_path = tmp_path / 'PerfData_X_SN_ABC_SP0_0_20240101.dat'
+    dat_path.write_bytes(data)
+    index_dir = tmp_path / 'index'
+
+    assert [b.number for b in iter_source_blocks(dat_path, time_from=1664313000,
+                                                 index_dir=index_dir)] == [1, 2, 3]
+    assert not block_index_path(dat_path, index_dir).exists()
+    # Without an index directory a full pass leaves nothing next to the source
+    assert len(list(iter_source_blocks(dat_path))) == 4
+    assert sorted(p.name for p in tmp_path.iterdir()) == [dat_path.name]
+    assert len(list(iter_source_blocks(dat_path, index_dir=index_dir))) == 4
+    assert block_index_path(dat_path, index_dir).exists()
+    entries = get_block_index(dat_path, index_dir)
+    assert [(e.number, e.offset) for e in entries] == \
+        [(b.number, b.offset) for b in iter_dat_blocks(io.BytesIO(data))]
+
+    # Blocks that are not selected are never parsed: break the first map in place
+    stat = dat_path.stat()
+    broken = bytearray(data)
+    broken[DAT_FILE_HEADER_SIZE + 8:DAT_FILE_HEADER_SIZE + 20] = b'#' * 12
+    dat_path.write_bytes(bytes(broken))
+    os.utime(dat_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    windowed = list(iter_source_blocks(dat_path, time_from=1664312940, time_to=1664313840,
+                                       index_dir=index_dir))
+    assert [(b.number, b.rows) for b in windowed] == [(1, 15)]
+    assert windowed[0].values.tolist() == blocks[1][1]
+    assert [b.number for b in iter_source_blocks(dat_path, start_block=2, index_dir=index_dir)] == [2, 3]
+    assert [b.number for b in iter_source_blocks(dat_path, part=1, parts=2, index_dir=index_dir)] == [2, 3]
+    assert [b.number for b in iter_source_blocks(
+        dat_path, start_block=1, index_dir=index_dir,
+        skip_block=lambda header, _: header['StartTime'] == str(1664312040 + 1800))] == [1, 3]
+
+
+def test_split_parts_cover_every_block_once(tmp_path):
+    """Parts are contiguous block ranges that together yield each block exactly once."""
+    blocks = [make_block(1664312040 + i * 900, 60, 15, seed=i) for i in range(6)]
+    data = make_dat(*(block for block, _ in blocks))
+
+    parts = split_parts(400, 1000, workers=4, split_min_bytes=100)
+    assert parts == 2
+    assert split_parts(50, 1000, workers=4, split_min_bytes=100) == 1
+
+    with pytest.raises(ValueError):
+        list(iter_dat_blocks(io.BytesIO(data), part=0, parts=3))
+
+    decoded = []
+    for part in range(3):
+        fin = io.BytesIO(data)
+        decoded.append([b.number for b in iter_dat_blocks(fin, part=part, parts=3, dat_size=len(data))])
+        # A part stops reading after its own range
+        assert fin.tell() < len(data) or part == 2
+    assert decoded == [[0, 1], [2, 3], [4, 5]]
+
+    # The block cache and a .tgz source split the same way
+    dat_path = tmp_path / 'PerfData_X_SN_ABC_SP0_0_20240101.dat'
+    dat_path.write_bytes(data)
+    tgz_path = tmp_path / 'PerfData_X_SN_ABC_SP0_0_20240101.tgz'
+    with tarfile.open(tgz_path, 'w:gz') as tar:
+        tar.add(dat_path, arcname=dat_path.name)
+    assert dat_source_size(tgz_path) == dat_source_size(dat_path) == len(data)
+
+    cache_dir = tmp_path / 'cache'
+    assert len(list(iter_source_blocks(dat_path, cache_dir=cache_dir))) == 6
+    for source, source_cache in ((tgz_path, None), (dat_path, cache_dir)):
+        split = [
+            [b.values.tolist() for b in iter_source_blocks(source, cache_dir=source_cache, part=part, parts=3)]
+            for part in range(3)
+        ]
+        assert sum(split, []) == [samples for _, samples in blocks]
+        assert [len(blocks_of_part) for blocks_of_part in split] == [2, 2, 2]
+
+
+def test_iter_dat_blocks_from_start_block():
+    """Blocks are numbered in file order; resume skips earlier ones."""
+    blocks = [make_block(1664312040 + i * 900, 60, 15, seed=i) for i in range(4)]
+    data = make_dat(*(block for block, _ in blocks))
+
+    assert [b.number for b in iter_dat_blocks(io.BytesIO(data))] == [0, 1, 2, 3]
+    resumed = list(iter_dat_blocks(io.BytesIO(data), start_block=2))
+    assert [b.number for b in resumed] == [2, 3]
+    assert resumed[0].values.tolist() == blocks[2][1]
+    assert [b.number for b in iter_dat_blocks(io.BytesIO(data), part=1, parts=2, start_block=3,
+                                              dat_size=len(data))] == [3]
+
+
+def test_skip_block_by_header(tmp_path):
+    """skip_block sees the header and layout hash; skipped blocks keep their numbers."""
+    blocks = [make_block(1664312040 + i * 900, 60, 15, seed=i) for i in range(3)]
+    data = make_dat(*(block for block, _ in blocks))
+    seen = []
+
+    def skip_block(data_header, layout_hash):
+        seen.append((data_header['StartTime'], layout_hash))
+        return data_header['StartTime'] == str(1664312040 + 900)
+
+    decoded = list(iter_dat_blocks(io.BytesIO(data), skip_block=skip_block))
+    assert [b.number for b in decoded] == [0, 2]
+    assert decoded[1].values.tolist() == blocks[2][1]
+    assert [layout_hash for _, layout_hash in seen] == [decoded[0].layout.layout_hash] * 3
+
+    # Cached blocks are filtered the same way
+    dat_path = tmp_path / 'PerfData_X_SN_ABC_SP0_0_20240101.dat'
+    dat_path.write_bytes(data)
+    cache_dir = tmp_path / 'cache'
+    assert len(list(iter_source_blocks(dat_path, cache_dir=cache_dir))) == 3
+    cached = list(iter_source_blocks(dat_path, cache_dir=cache_dir, skip_block=skip_block))
+    assert [b.number for b in cached] == [0, 2]
+
+
+def test_block_cache_roundtrip(tmp_path):
+    """The first pass fills the .npz cache; re-reads come from it unchanged."""
+    first, first_samples = make_block(1664312040, 60, 15)
+    second, second_samples = make_block(1664312940, 60, 15, seed=5)
+    dat_path = tmp_path / 'PerfData_X_SN_ABC_SP0_0_20240101.dat'
+    dat_path.write_bytes(make_dat(first, second))
+    cache_dir = tmp_path / 'cache'
+
+    blocks = list(iter_source_blocks(dat_path, cache_dir=cache_dir))
+    assert [b.values.tolist() for b in blocks] == [first_samples, second_samples]
+    assert [p.parent.name for p in cache_dir.rglob('*.npz')] == ['ABC']
+
+    # Same size and mtime - the cache is trusted and the source is not decoded
+    stat = dat_path.stat()
+    dat_path.write_bytes(b'\0' * stat.st_size)
+    os.utime(dat_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    cached = list(iter_source_blocks(dat_path, cache_dir=cache_dir))
+    assert [b.values.tolist() for b in cached] == [first_samples, second_samples]
+    assert cached[0].layout is blocks[0].layout
+
+    # Only the requested resource is read; the window slices rows as usual
+    lun_only = list(iter_source_blocks(dat_path, cache_dir=cache_dir, resources={'11'},
+                                       time_from=1664313000))
+    assert len(lun_only) == 1
+    assert lun_only[0].values[:, 6:].tolist() == [row[6:] for row in second_samples[1:]]
+
+
+def test_parse_targets():
+    """'all' or a comma list of known targets, in canonical order."""
+    assert parse_targets('all') == ('grafana', 'csv', 'perfmonkey')
+    assert parse_targets('csv, Grafana') == ('grafana', 'csv')
+    with pytest.raises(ValueError):
+        parse_targets('grafana,influx')
+    with pytest.raises(ValueError):
+        parse_targets(' , ')
+
+
+def test_csv_sink_appends_selected_series(tmp_path):
+    """The CSV sink writes only the selected series of every block it is fed."""
+    first, first_samples = make_block(1664312040, 60, 4)
+    second, _ = make_block(1664312280, 60, 2, seed=5)
+    sink = CsvSink(tmp_path, 'SN1', ['11'], ['25'])
+    for block in iter_dat_blocks(io.BytesIO(make_dat(first, second))):
+        sink.add_block(block)
+
+    assert sink.close('test') == 3 * 4 + 3 * 2
+    lines = (tmp_path / 'SN1.csv').read_text(encoding='utf-8').splitlines()
+    assert len(lines) == 18
+    resource, metric, element, value, _, epoch = lines[0].split(';')
+    assert (element, float(value)) == ('lun_1', float(first_samples[0][7]))
+    assert all(line.split(';')[:2] == [resource, metric] for line in lines)
+    assert float(epoch) == float(lines[1].split(';')[5]) - 60
+
+    sink = CsvSink(tmp_path, 'SN2', ['11'], ['25'])
+    sink.error = ValueError('truncated')
+    assert sink.close() is None
+    assert not (tmp_path / 'SN2.csv').exists()
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
@@ -0,0 +1,95 @@
+"""
+Unit tests for parsers/import_ledger.py
+"""
+
+import sys
+import zipfile
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from parsers.import_ledger import ImportCheckpoint, ImportLedger, file_ledger_key, zip_member_ledger_keys
+
+
+TARGET = 'http://vm:8428/api/v1/import/prometheus'
+
+
+def test_same_content_has_same_key(tmp_path):
+    """A .tgz on disk and the same .tgz inside a ZIP get one key."""
+    tgz = tmp_path / 'PerfData_X_SN_ABC_SP0_0_20240101.tgz'
+    tgz.write_bytes(b'payload' * 1000)
+    zip_path = tmp_path / 'upload.zip'
+    with zipfile.ZipFile(zip_path, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.write(tgz, 'dir/' + tgz.name)
+
+    assert zip_member_ledger_keys(zip_path) == {'dir/' + tgz.name: file_ledger_key(tgz)}
+
+    tgz.write_bytes(b'payload' * 999 + b'changed')
+    assert zip_member_ledger_keys(zip_path)['dir/' + tgz.name] != file_ledger_key(tgz)
+
+
+def test_ledger_lookup_by_target_and_window(tmp_path):
+    """Entries are per target; a windowed import only covers its window."""
+    path = tmp_path / 'ledger.jsonl'
+    ledger = ImportLedger(path)
+    ledger.record('a.tgz:1:00000001', TARGET, 740, data_from=100, data_to=200)
+    ledger.record('b.tgz:1:00000002', TARGET, 10, time_from=1000, time_to=2000)
+
+    # Another process sees the appended lines
+    reader = ImportLedger(path)
+    assert reader.lookup('a.tgz:1:00000001', TARGET)['metrics'] == 740
+    assert reader.lookup('a.tgz:1:00000001', 'http://other/api/v1/import/prometheus') is None
+    assert reader.lookup('a.tgz:1:00000001', TARGET, time_from=150) is not None
+
+    assert reader.lookup('b.tgz:1:00000002', TARGET) is None
+    assert reader.lookup('b.tgz:1:00000002', TARGET, time_from=1200, time_to=1800) is not None
+    assert reader.lookup('b.tgz:1:00000002', TARGET, time_from=500, time_to=1800) is None
+
+    ledger.record('c.tgz:1:00000003', TARGET, 1)
+    assert reader.lookup('c.tgz:1:00000003', TARGET) is not None
+
+
+def test_checkpoints_until_import_completes(tmp_path):
+    """Checkpoints are per window; the completion record clears them."""
+    path = tmp_path / 'ledger.jsonl'
+    ledger = ImportLedger(path)
+    ledger.record_checkpoint('a.tgz:1:00000001', TARGET, 0, 2, block=3, series=40, metrics=500)
+    ledger.record_checkpoint('a.tgz:1:00000001', TARGET, 1, 2, block=4, series=0, metrics=700)
+    ledger.record_checkpoint('a.tgz:1:00000001', TARGET, 0, 2, block=6, series=0, metrics=900)
+    ledger.record_checkpoint('a.tgz:1:00000001', TARGET, 0, 1, block=1, series=0, metrics=5, time_from=1000)
+
+    reader = ImportLedger(path)
+    parts, positions = reader.checkpoints('a.tgz:1:00000001', TARGET)
+    assert parts == 2
+    assert positions[0]['checkpoint']['block'] == 6
+    assert positions[1]['metrics'] == 700
+    assert reader.checkpoints('a.tgz:1:00000001', TARGET, time_from=1000)[0] == 1
+    assert reader.checkpoints('a.tgz:1:00000001', 'http://other/api/v1/import/prometheus') is None
+
+    ledger.record('a.tgz:1:00000001', TARGET, 1600)
+    assert reader.checkpoints('a.tgz:1:00000001', TARGET) is None
+    assert reader.checkpoints('a.tgz:1:00000001', TARGET, time_from=1000) is not None
+
+
+def test_import_checkpoint_writes_confirmed_position(tmp_path):
+    """on_sent is throttled; finish() saves the last confirmed position or 'done'."""
+    ledger = ImportLedger(tmp_path / 'ledger.jsonl')
+    checkpoint = ImportCheckpoint(ledger, 'a.tgz:1:00000001', TARGET, metrics=100, interval=3600)
+    checkpoint.on_sent((0, 10), 50)
+    checkpoint.on_sent((2, 0), 80)
+    assert ledger.checkpoints('a.tgz:1:00000001', TARGET) is None
+
+    checkpoint.finish(False)
+    entry = ledger.checkpoints('a.tgz:1:00000001', TARGET)[1][0]
+    assert (entry['checkpoint']['block'], entry['checkpoint']['series']) == (2, 0)
+    assert entry['metrics'] == 180
+
+    ImportCheckpoint(ledger, 'a.tgz:1:00000001', TARGET, metrics=180).finish(True, 20)
+    entry = ledger.checkpoints('a.tgz:1:00000001', TARGET)[1][0]
+    assert entry['checkpoint']['done'] and entry['metrics'] == 200
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
@@ -0,0 +1,93 @@
+"""
+Unit tests for parsers/ingest_controller.py
+"""
+
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from parsers.ingest_controller import ERROR, OK, REJECTED, IngestController
+
+MB = 1024 * 1024
+
+
+def make_controller(**kwargs):
+    # interval=0: decision on every response
+    options = dict(max_uploads=8, batch_bytes=16 * MB, initial_uploads=4, target_latency=1.0,
+                   interval=0, min_batch_bytes=MB)
+    options.update(kwargs)
+    return IngestController(**options)
+
+
+def test_errors_halve_uploads_and_batch():
+    controller = make_controller()
+    first = controller.acquire(MB)
+    second = controller.acquire(MB)
+    controller.release(MB, first, ERROR)
+    state = controller.snapshot()
+    assert (state['limit'], state['batch_bytes']) == (2, 8 * MB)
+
+    # The second request left before the decrease: no second decrease for the same burst
+    controller.release(MB, second, ERROR)
+    state = controller.snapshot()
+    assert (state['limit'], state['batch_bytes']) == (2, 8 * MB)
+    assert state['errors'] == 2 and state['decreases'] == 1
+
+    # Data errors (4xx) do not mean VM is overloaded
+    controller.release(0, controller.acquire(), REJECTED)
+    assert controller.snapshot()['limit'] == 2
+
+
+def test_additive_increase_only_when_saturated():
+    controller = make_controller(initial_uploads=1, batch_bytes=4 * MB)
+    started = controller.acquire(MB)
+    controller.release(MB, started, OK)  # fast, but the single slot was the limit
+    state = controller.snapshot()
+    assert (state['limit'], state['batch_bytes']) == (2, 4 * MB)
+
+    controller.release(MB, controller.acquire(MB), OK)  # 1 of 2 slots used: no growth
+    assert controller.snapshot()['limit'] == 2
+
+
+def test_latency_above_target_lowers_uploads_then_batch():
+    controller = make_controller(initial_uploads=2, target_latency=0.01)
+    started = controller.acquire(MB)
+    time.sleep(0.05)
+    controller.release(MB, started, OK)
+    state = controller.snapshot()
+    assert (state['limit'], state['batch_bytes']) == (1, 16 * MB)
+
+    started = controller.acquire(MB)
+    time.sleep(0.05)
+    controller.release(MB, started, OK)
+    state = controller.snapshot()
+    assert (state['limit'], state['batch_bytes']) == (1, 8 * MB)
+    assert controller.batch_bytes() == 8 * MB
+
+
+def test_acquire_waits_for_free_slot():
+    controller = make_controller(initial_uploads=1, interval=3600)
+    started = controller.acquire()
+    acquired = threading.Event()
+
+    def second_upload():
+        controller.acquire()
+        acquired.set()
+
+    thread = threading.Thread(target=second_upload, daemon=True)
+    thread.start()
+    assert not acquired.wait(0.2)
+
+    controller.release(0, started, OK)
+    assert acquired.wait(5)
+    thread.join(5)
+    assert controller.snapshot()['in_flight'] == 1
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
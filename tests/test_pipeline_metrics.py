@@ -0,0 +1,129 @@
+"""
+Unit tests for parsers/pipeline_metrics.py
+"""
+
+import queue
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from parsers import pipeline_metrics
+from parsers.pipeline_metrics import PipelineMetrics, count, stage, take_stats, timed
+
+
+@pytest.fixture(autouse=True)
+def clean_stats():
+    take_stats()
+    yield
+    pipeline_metrics.set_metrics_queue(None)
+    take_stats()
+
+
+def test_nested_stage_pauses_outer():
+    with stage('decode'):
+        time.sleep(0.02)
+        with stage('extract'):
+            time.sleep(0.1)
+        time.sleep(0.02)
+
+    stats = take_stats()
+    assert stats['extract'] >= 0.1
+    # Outer stage gets only its own time (0.14s with the nested one)
+    assert 0.04 <= stats['decode'] < 0.1
+    assert take_stats() == {}
+
+
+def test_timed_excludes_consumer_time():
+    def produce():
+        for n in range(3):
+            time.sleep(0.01)
+            yield n
+
+    items = []
+    for item in timed(produce(), 'encode'):
+        items.append(item)
+        time.sleep(0.03)
+
+    stats = take_stats()
+    assert items == [0, 1, 2]
+    assert 0.03 <= stats['encode'] < 0.08
+
+
+def test_stages_are_per_thread():
+    def worker():
+        with stage('send'):
+            time.sleep(0.05)
+
+    with stage('encode'):
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join()
+
+    stats = take_stats()
+    assert stats['send'] >= 0.05
+    # The other thread's stage does not pause this one
+    assert stats['encode'] >= 0.05
+
+
+def test_task_reports_go_to_queue_with_sn():
+    reports = queue.Queue()
+    pipeline_metrics.set_metrics_queue(reports)
+
+    count(rows=10)  # outside a task: dropped
+    pipeline_metrics.begin_task('SN1')
+    count(rows=15, dat_bytes=600, samples=0)
+    pipeline_metrics.end_task()
+    pipeline_metrics.begin_task('SN2')
+    count(samples=7)
+    pipeline_metrics.end_task()
+    pipeline_metrics.end_task()
+
+    assert reports.get_nowait() == ('SN1', {'rows': 15, 'dat_bytes': 600})
+    assert reports.get_nowait() == ('SN2', {'samples': 7})
+    assert reports.empty()
+
+
+def test_pipeline_metrics_sums_workers_and_pushes():
+    pushed = []
+
+    def send(lines, url):
+        pushed.append((url, lines))
+        return True
+
+    metrics = PipelineMetrics('http://vm:8428/api/v1/import/prometheus', send, interval=60, job='test')
+    metrics.queue.put(('SN1', {'encode': 1.5, 'rows': 10}))
+    metrics.queue.put(('SN1', {'encode': 0.5, 'send': 2.0, 'rows': 5}))
+    metrics.queue.put(('SN2', {'extract': 1.0}))
+    assert metrics.close()
+
+    assert metrics.totals()['SN1'] == {'encode': 2.0, 'send': 2.0, 'rows': 15}
+    assert metrics.stage_seconds()['encode'] == 2.0
+    assert metrics.stage_seconds()['extract'] == 1.0
+
+    url, lines = pushed[-1]
+    assert url == 'http://vm:8428/api/v1/import/prometheus'
+    text = b''.join(lines).decode()
+    assert 'huperf_pipeline_stage_seconds_total{job="test",SN="SN1",stage="encode"} 2 ' in text
+    assert 'huperf_pipeline_stage_seconds_total{job="test",SN="SN2",stage="send"} 0 ' in text
+    assert 'huperf_pipeline_rows_total{job="test",SN="SN1"} 15 ' in text
+    assert len(lines) == 2 * (len(pipeline_metrics.STAGES) + len(pipeline_metrics.COUNTERS))
+
+
+def test_push_failure_does_not_raise():
+    def send(lines, url):
+        raise OSError('connection refused')
+
+    metrics = PipelineMetrics('http://vm:8428/api/v1/import/prometheus', send, interval=60)
+    metrics.add('SN1', {'rows': 1})
+    assert not metrics.push()
+    assert metrics.push_errors == 1
+    metrics.close()
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
@@ -0,0 +1,404 @@
+"""
+Unit tests for parsers/streaming_pipeline.py
+"""
+
+import io
+import json
+import sys
+import tarfile
+import threading
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from parsers import streaming_pipeline
+from parsers.dat_decoder import iter_dat_blocks
+from parsers.dictionaries import METRIC_CONVERSION, METRIC_NAME_DICT, RESOURCE_NAME_DICT
+from parsers.import_ledger import ImportLedger, file_ledger_key
+from parsers.streaming_pipeline import (
+    encode_jsonl_block,
+    encode_prometheus_block,
+    get_series_table,
+    iter_extracted_7z_tgz,
+    process_single_tgz_streaming,
+    sanitize_metric_name,
+    stream_prometheus_metrics,
+)
+from tests.test_dat_decoder import GROUPS, make_block, make_dat
+
+
+SN = 'ABC'
+
+# 1090 and 1164 are converted (divided by 1000 and 1/1024); one element name has a '%'
+ENCODE_GROUPS = [
+    ("207", ["0A", "0B"], ["CTE0.A", "CTE%0.B"], [22, 1090]),
+    ("11", ["1"], ["lun_1"], [22, 1164]),
+]
+ENCODE_RESOURCES = frozenset({'207', '11'})
+ENCODE_METRICS = frozenset({'22', '1090', '1164'})
+
+
+@pytest.fixture
+def vm_url(vm_server):
+    return vm_server[1]
+
+
+def write_tgz(path, blocks=40, keep=1.0):
+    """A .tgz with one .dat of `blocks` blocks; keep < 1 cuts the gzip stream."""
+    data = make_dat(*(make_block(1664312040 + i * 900, 60, 15, seed=i)[0] for i in range(blocks)))
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as tar:
+        info = tarfile.TarInfo('perf.dat')
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+    raw = buffer.getvalue()
+    path.write_bytes(raw[:int(len(raw) * keep)])
+    return path
+
+
+def run_worker(tgz_path, vm_url, ledger_path, import_format='prometheus'):
+    checkpoint = (str(ledger_path), file_ledger_key(tgz_path), vm_url, (0, 0), 0)
+    args = (tgz_path, vm_url, 100, ['207', '11'], ['22', '18', '23', '25'], SN, None, None, 0, 1,
+            None, ('grafana',), None, None, import_format, 1, 2, 1024 * 1024, False,
+            checkpoint, None, None)
+    return process_single_tgz_streaming(args)
+
+
+@pytest.fixture
+def series_tables(monkeypatch):
+    """An empty series table cache for the test."""
+    cache = {}
+    monkeypatch.setattr(streaming_pipeline, '_series_table_cache', cache)
+    return cache
+
+
+def decode(raw):
+    return next(iter_dat_blocks(io.BytesIO(make_dat(raw))))
+
+
+def encoder_input(block, import_format='prometheus'):
+    table = get_series_table(block.layout, int(block.header['Archive']), SN,
+                             ENCODE_RESOURCES, ENCODE_METRICS, import_format)
+    return table, block.select(table.columns), block.timestamps_ms.tolist()
+
+
+def baseline_lines(raw_blocks):
+    """Lines as the per-point encoder wrote them: float(value), divided if converted."""
+    lines = []
+    for raw, samples in raw_blocks:
+        block = decode(raw)
+        start, archive = int(block.header['StartTime']), int(block.header['Archive'])
+        for column, (resource_id, metric_id, element) in enumerate(block.list_data_type):
+            if resource_id not in ENCODE_RESOURCES or metric_id not in ENCODE_METRICS:
+                continue
+            metric_name = 'huawei_' + sanitize_metric_name(METRIC_NAME_DICT[metric_id])
+            resource_name = RESOURCE_NAME_DICT[resource_id]
+            for row, sample_row in enumerate(samples):
+                value = float(sample_row[column])
+                if metric_id in METRIC_CONVERSION:
+                    value = value / METRIC_CONVERSION[metric_id]
+                ts_unix_ms = (start + row * archive) * 1000
+                lines.append((f'{metric_name}{{Element="{element}",Resource="{resource_name}",SN="{SN}",'
+                              f'scrape_interval="{archive}"}} {value} {ts_unix_ms}\n',
+                              metric_id in METRIC_CONVERSION))
+    return lines
+
+
+def test_prometheus_block_matches_baseline_lines(tmp_path):
+    """Same series, values and timestamps as before; only integer samples lose '.0'."""
+    raw_blocks = [make_block(1664312040 + i * 900, 60, 15, groups=ENCODE_GROUPS, seed=i * 13)
+                  for i in range(3)]
+    dat_path = tmp_path / 'perf.dat'
+    dat_path.write_bytes(make_dat(*(raw for raw, _ in raw_blocks)))
+
+    chunks = list(stream_prometheus_metrics(dat_path, SN, ['207', '11'], ['22', '1090', '1164']))
+    lines = b''.join(payload for payload, _ in chunks).decode('utf-8').splitlines(keepends=True)
+
+    expected = []
+    for line, converted in baseline_lines(raw_blocks):
+        if not converted:
+            labels, value, ts = line.rsplit(' ', 2)
+            assert value.endswith('.0')  # e.g. 13044.0
+            line = f'{labels} {value[:-2]} {ts}'  # -> 13044
+        expected.append(line)
+    assert lines == expected
+    assert sum(samples for _, samples in chunks) == len(expected) == 3 * 6 * 15
+
+
+def test_prometheus_block_formats_and_escaping():
+    """Plain samples are written as %d, converted ones as %r; '%' in labels survives."""
+    raw, samples = make_block(1664312040, 60, 3, groups=ENCODE_GROUPS, seed=7)
+    table, selected, ts_list = encoder_input(decode(raw))
+
+    assert table.converted.tolist() == [False, True, False, True, False, True]
+    assert table.factors.tolist() == [1, 1000, 1, 1000, 1, 0.0009765625]
+    assert b'Element="CTE%%0.B"' in table.prefixes[2]
+
+    payload, count = next(encode_prometheus_block(table, selected, ts_list))
+    lines = payload.decode('utf-8').splitlines()
+    assert count == len(lines) == 18
+    assert lines[0] == ('huawei_total_iops_io_s{Element="CTE0.A",Resource="Controller",SN="ABC",'
+                        'scrape_interval="60"} %d 1664312040000' % samples[0][0])
+    assert lines[3].endswith(' %r 1664312040000' % (samples[0][1] / 1000))
+    assert lines[6].startswith('huawei_total_iops_io_s{Element="CTE%0.B",')
+    assert lines[17].endswith(' %r 1664312160000' % (samples[2][5] * 1024.0))
+    assert all('.' not in line.rsplit(' ', 2)[1] for line in lines[0:3] + lines[6:9] + lines[12:15])
+
+
+def test_prometheus_block_chunks_whole_series():
+    """Chunks hold whole series, at most chunk_samples samples (but at least one series)."""
+    raw, _ = make_block(1664312040, 60, 15, groups=ENCODE_GROUPS)
+    table, selected, ts_list = encoder_input(decode(raw))
+    whole = b''.join(payload for payload, _ in encode_prometheus_block(table, selected, ts_list))
+
+    for chunk_samples, expected_counts in [(20000, [90]), (40, [30, 30, 30]), (75, [75, 15]),
+                                           (1, [15] * 6)]:
+        chunks = list(encode_prometheus_block(table, selected, ts_list, chunk_samples=chunk_samples))
+        assert [count for _, count in chunks] == expected_counts
+        assert [payload.count(b'\n') for payload, _ in chunks] == expected_counts
+        assert b''.join(payload for payload, _ in chunks) == whole
+
+    assert list(encode_prometheus_block(table, selected[:, :0], [])) == []
+
+
+def test_jsonl_block_lines():
+    """One JSON object per series: labels with __name__, values and timestamps per row."""
+    raw, samples = make_block(1664312040, 60, 15, groups=ENCODE_GROUPS, seed=7)
+    block = decode(raw)
+    table, selected, ts_list = encoder_input(block, 'jsonl')
+
+    chunks = list(encode_jsonl_block(table, selected, ts_list))
+    assert [count for _, count in chunks] == [90]
+    series = [json.loads(line) for line in chunks[0][0].decode('utf-8').splitlines()]
+    assert len(series) == 6
+
+    assert series[2]['metric'] == {
+        '__name__': 'huawei_total_iops_io_s', 'Element': 'CTE%0.B', 'Resource': 'Controller',
+        'SN': SN, 'scrape_interval': '60',
+    }
+    assert series[5]['metric']['__name__'] == 'huawei_avg_full_copy_read_request_size_kb'
+    assert series[5]['metric']['Resource'] == 'LUN'
+    for column, (item, converted) in enumerate(zip(series, table.converted.tolist())):
+        assert len(item['values']) == len(item['timestamps']) == block.rows
+        assert item['timestamps'] == ts_list
+        expected = [row[column] / table.factors[column] if converted else row[column] for row in samples]
+        assert item['values'] == expected
+        assert all(isinstance(value, float if converted else int) for value in item['values'])
+
+
+def test_jsonl_block_chunks_whole_series():
+    """JSON Lines chunks split like Prometheus ones and count samples, not lines."""
+    raw, _ = make_block(1664312040, 60, 15, groups=ENCODE_GROUPS)
+    table, selected, ts_list = encoder_input(decode(raw), 'jsonl')
+
+    chunks = list(encode_jsonl_block(table, selected, ts_list, chunk_samples=40))
+    assert [count for _, count in chunks] == [30, 30, 30]
+    assert [payload.count(b'\n') for payload, _ in chunks] == [2, 2, 2]
+    assert [len(json.loads(line)['values']) for payload, _ in chunks
+            for line in payload.splitlines()] == [15] * 6
+
+
+def test_worker_imports_jsonl(tmp_path, vm_server):
+    """--format jsonl: every body line is a JSON series and all samples arrive."""
+    server, vm_url = vm_server
+    tgz_path = write_tgz(tmp_path / 'PerfData_X_SN_ABC_SP0_0_20240101.tgz', blocks=3)
+
+    result = run_worker(tgz_path, vm_url, tmp_path / 'ledger.jsonl', import_format='jsonl')
+    assert result['success']
+
+    series = [json.loads(line) for body in server.bodies for line in body.splitlines()]
+    assert {item['metric']['__name__'] for item in series} == {
+        'huawei_total_iops_io_s', 'huawei_usage_percent', 'huawei_read_bandwidth_mb_s',
+        'huawei_read_iops_io_s',
+    }
+    assert all(len(item['values']) == len(item['timestamps']) == 15 for item in series)
+    assert sum(len(item['values']) for item in series) == result['metrics'] == 3 * 12 * 15
+
+
+def test_series_table_cache_key(series_tables):
+    """Tables are shared per layout, interval, SN, selection and format."""
+    layout = decode(make_block(1664312040, 60, 3)[0]).layout
+    other_layout = decode(make_block(1664312040, 60, 3, groups=ENCODE_GROUPS)[0]).layout
+    resources, metrics = frozenset({'207', '11'}), frozenset({'22', '18'})
+
+    table = get_series_table(layout, 60, SN, resources, metrics)
+    assert decode(make_block(1664312940, 60, 5, seed=3)[0]).layout is layout
+    assert get_series_table(layout, 60, SN, frozenset({'11', '207'}), frozenset({'18', '22'})) is table
+    assert list(series_tables) == [(layout.layout_hash, 60, SN, resources, metrics, 'prometheus')]
+
+    variants = [
+        get_series_table(other_layout, 60, SN, resources, metrics),
+        get_series_table(layout, 300, SN, resources, metrics),
+        get_series_table(layout, 60, 'XYZ', resources, metrics),
+        get_series_table(layout, 60, SN, frozenset({'207'}), metrics),
+        get_series_table(layout, 60, SN, resources, frozenset({'22'})),
+        get_series_table(layout, 60, SN, resources, metrics, 'jsonl'),
+    ]
+    assert all(variant is not table for variant in variants)
+    assert len(series_tables) == 7
+    assert b'scrape_interval="300"' in variants[1].prefixes[0]
+    assert b'SN="XYZ"' in variants[2].prefixes[0]
+    assert len(variants[3].prefixes) == 4 and len(variants[4].prefixes) == 5
+    assert variants[5].prefixes[0].startswith(b'{"metric":{"__name__":"huawei_total_iops_io_s"')
+
+
+def test_series_table_cache_evicts_oldest(series_tables, monkeypatch):
+    """At SERIES_TABLE_CACHE_SIZE the oldest table is dropped first (FIFO)."""
+    monkeypatch.setattr(streaming_pipeline, 'SERIES_TABLE_CACHE_SIZE', 2)
+    layout = decode(make_block(1664312040, 60, 3)[0]).layout
+    resources, metrics = frozenset({'207', '11'}), frozenset({'22'})
+
+    first, second, third = (get_series_table(layout, interval, SN, resources, metrics)
+                            for interval in (60, 300, 900))
+    assert [key[1] for key in series_tables] == [300, 900]
+    # A hit does not refresh the entry: 300 is still the oldest
+    assert get_series_table(layout, 300, SN, resources, metrics) is second
+    rebuilt = get_series_table(layout, 60, SN, resources, metrics)
+    assert rebuilt is not first and rebuilt.prefixes == first.prefixes
+    assert [key[1] for key in series_tables] == [900, 60]
+    assert get_series_table(layout, 900, SN, resources, metrics) is third
+
+
+def test_series_table_columns_and_conversion(series_tables):
+    """Selected columns keep block order; factors and the converted mask follow them."""
+    layout = decode(make_block(1664312040, 60, 3, groups=ENCODE_GROUPS)[0]).layout
+
+    table = get_series_table(layout, 60, SN, ENCODE_RESOURCES, frozenset({'22', '1164'}))
+    assert table.columns.tolist() == [0, 2, 4, 5]
+    assert table.converted.dtype == bool and table.converted.tolist() == [False, False, False, True]
+    assert table.factors.dtype.name == 'float64'
+    assert table.factors.tolist() == [1.0, 1.0, 1.0, METRIC_CONVERSION['1164']]
+    assert table.prefixes[3].startswith(b'huawei_avg_full_copy_read_request_size_kb{Element="lun_1",')
+
+    assert get_series_table(layout, 60, SN, frozenset({'11'}), frozenset({'18'})).prefixes == ()
+
+
+def test_series_table_reports_unknown_ids(series_tables, tmp_path, caplog):
+    """IDs missing from the dictionaries get UNKNOWN_ names and are logged once per file."""
+    groups = GROUPS[:1] + [("99999", ["1", "2"], ["x_1", "x_2"], [22, 88888]),
+                           ("11", ["1"], ["lun_1"], [88887])]
+    raw, _ = make_block(1664312040, 60, 3, groups=groups)
+    layout = decode(raw).layout
+
+    table = get_series_table(layout, 60, SN, frozenset({'207', '99999'}), frozenset({'22', '88888'}))
+    assert table.unknown_resources == frozenset({'99999'})
+    assert table.unknown_metrics == frozenset({'88888'})
+    assert table.prefixes[2] == \
+        b'huawei_total_iops_io_s{Element="x_1",Resource="UNKNOWN_RESOURCE_99999",SN="ABC",scrape_interval="60"} '
+    assert table.prefixes[3].startswith(b'huawei_unknown_metric_88888{Element="x_1",')
+    # Unknown IDs outside the selection are not reported
+    known = get_series_table(layout, 60, SN, frozenset({'207'}), frozenset({'22', '88888', '88887'}))
+    assert not known.unknown_resources and not known.unknown_metrics
+
+    dat_path = tmp_path / 'perf.dat'
+    dat_path.write_bytes(make_dat(raw, make_block(1664312220, 60, 3, groups=groups, seed=1)[0]))
+    with caplog.at_level('WARNING', logger=streaming_pipeline.logger.name):
+        list(stream_prometheus_metrics(dat_path, SN, ['99999', '11'], ['22', '88888', '88887']))
+    warnings = [record.getMessage() for record in caplog.records]
+    assert warnings == [
+        "Found 1 unknown resource IDs in perf.dat: ['99999']",
+        "Found 2 unknown metric IDs in perf.dat: ['88887', '88888']",
+    ]
+
+
+def write_7z(path, src_dir):
+    """A .7z with three .tgz (one in a subdirectory) and a non-.tgz file."""
+    py7zr = pytest.importorskip('py7zr')
+    (src_dir / 'sub').mkdir(parents=True)
+    tgz_files = [write_tgz(src_dir / f'PerfData_X_SN_ABC_SP{i}_0_20240101.tgz', blocks=5 + i)
+                 for i in range(2)]
+    tgz_files.append(write_tgz(src_dir / 'sub' / 'PerfData_X_SN_ABC_SP2_0_20240101.tgz', blocks=7))
+    (src_dir / 'readme.txt').write_text('not a tgz')
+    with py7zr.SevenZipFile(path, 'w') as archive:
+        archive.writeall(src_dir, arcname='')
+    return {tgz.relative_to(src_dir): tgz.read_bytes() for tgz in tgz_files}
+
+
+def consume(generator, timeout=30):
+    """Drain a generator in a thread: (items, error), failing instead of hanging."""
+    items, error = [], []
+
+    def run():
+        try:
+            for item in generator:
+                items.append((item, item.read_bytes()))
+        except Exception as e:
+            error.append(e)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), 'consumer is stuck'
+    return items, error[0] if error else None
+
+
+def test_7z_tgz_yielded_once_fully_written(tmp_path):
+    """Each .tgz is yielded once, already complete on disk when the consumer gets it."""
+    archive_path = tmp_path / 'in.7z'
+    contents = write_7z(archive_path, tmp_path / 'src')
+    extract_dir = tmp_path / 'out'
+
+    items, error = consume(iter_extracted_7z_tgz(archive_path, extract_dir))
+    assert error is None
+    assert sorted(path.relative_to(extract_dir) for path, _ in items) == sorted(contents)
+    for path, data in items:
+        assert data == contents[path.relative_to(extract_dir)]
+        with tarfile.open(fileobj=io.BytesIO(data), mode='r:gz') as tar:
+            assert tar.getnames() == ['perf.dat']
+    assert (extract_dir / 'readme.txt').exists()
+
+
+def test_7z_extraction_error_reaches_consumer(tmp_path):
+    """A corrupt archive raises in the consuming loop instead of blocking it."""
+    archive_path = tmp_path / 'in.7z'
+    contents = write_7z(archive_path, tmp_path / 'src')
+    raw = bytearray(archive_path.read_bytes())
+    middle = len(raw) // 2
+    raw[middle:middle + 200] = bytes(200)
+    archive_path.write_bytes(bytes(raw))
+
+    extract_dir = tmp_path / 'out'
+    generator = iter_extracted_7z_tgz(archive_path, extract_dir)
+    items, error = consume(generator)
+    assert error is not None
+    # Files completed before the damaged data may still be handed out, intact
+    assert len(items) < len(contents)
+    assert all(data == contents[path.relative_to(extract_dir)] for path, data in items)
+    assert list(generator) == []  # the generator is finished, not left waiting
+
+
+def test_truncated_tgz_is_not_imported(tmp_path, vm_url):
+    """A read error midway fails the file: the ledger gets no completed import."""
+    ledger_path = tmp_path / 'ledger.jsonl'
+    good = write_tgz(tmp_path / 'PerfData_X_SN_ABC_SP0_0_20240101.tgz')
+    broken = write_tgz(tmp_path / 'PerfData_X_SN_ABC_SP1_0_20240101.tgz', keep=0.5)
+
+    assert run_worker(good, vm_url, ledger_path)['success']
+
+    result = run_worker(broken, vm_url, ledger_path)
+    assert not result['success']
+    assert result['metrics'] > 0  # blocks before the cut were sent
+
+    ledger = ImportLedger(ledger_path)
+    assert ledger.lookup(file_ledger_key(broken), vm_url) is None
+    assert ledger.checkpoints(file_ledger_key(good), vm_url)[1][0]['checkpoint']['done']
+
+
+def test_truncated_tgz_keeps_confirmed_checkpoint(tmp_path, vm_url):
+    """After a read error the checkpoint holds the last confirmed position, not 'done'."""
+    ledger_path = tmp_path / 'ledger.jsonl'
+    broken = write_tgz(tmp_path / 'PerfData_X_SN_ABC_SP1_0_20240101.tgz', keep=0.5)
+
+    result = run_worker(broken, vm_url, ledger_path)
+    assert not result['success']
+
+    entry = ImportLedger(ledger_path).checkpoints(file_ledger_key(broken), vm_url)[1][0]
+    assert not entry['checkpoint']['done']
+    assert 0 < entry['checkpoint']['block'] < 40
+    assert entry['metrics'] == result['metrics']
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
@@ -0,0 +1,253 @@
+"""
+Unit tests for parsers/vm_sender.py
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from parsers import vm_sender
+from parsers.ingest_controller import IngestController
+from parsers.pipeline_metrics import take_stats
+from parsers.vm_sender import BatchUploader, get_session, send_batch_to_vm
+
+
+@pytest.fixture
+def vm_shards(monkeypatch, start_vm_server):
+    """Three import endpoints; endpoint health starts clean."""
+    monkeypatch.setattr(vm_sender, '_endpoints', {})
+    monkeypatch.setattr(vm_sender, 'VM_RETRY_BACKOFF', 0.01)
+    shards = [start_vm_server() for _ in range(3)]
+    return [server for server, _ in shards], ','.join(url for _, url in shards)
+
+
+def test_batches_reuse_one_connection(vm_server):
+    server, url = vm_server
+    for n in range(5):
+        assert send_batch_to_vm([b'm{a="1"} %d 1000\n' % n, b'm{a="2"} 1 1000\n'], url)
+
+    assert server.bodies[0] == b'm{a="1"} 0 1000\nm{a="2"} 1 1000\n'
+    assert len(server.bodies) == 5
+    assert len(server.clients) == 1
+
+    assert not send_batch_to_vm([b'bad'], url)
+    assert send_batch_to_vm([], url)
+
+
+def test_gzip_compressed_payload(vm_server):
+    server, url = vm_server
+    payload = b''.join(b'm{Element="e%d",SN="X"} 1 1000\n' % n for n in range(200))
+    vm_sender.configure_compression('gzip')
+    try:
+        before = vm_sender.get_send_stats()
+        assert send_batch_to_vm([payload], url)
+        after = vm_sender.get_send_stats()
+    finally:
+        vm_sender.configure_compression('none')
+
+    assert server.encodings == ['gzip']
+    assert server.bodies == [payload]
+    assert after['raw_bytes'] - before['raw_bytes'] == len(payload)
+    assert after['wire_bytes'] - before['wire_bytes'] < len(payload) // 5
+
+
+def test_requests_feed_pipeline_metrics(vm_server):
+    server, url = vm_server
+    payload = b''.join(b'm{Element="e%d",SN="X"} 1 1000\n' % n for n in range(200))
+    take_stats()
+    vm_sender.configure_compression('gzip')
+    try:
+        assert send_batch_to_vm([payload], url)
+    finally:
+        vm_sender.configure_compression('none')
+
+    stats = take_stats()
+    assert stats['batches'] == 1
+    assert stats['payload_bytes'] == len(payload)
+    assert 0 < stats['wire_bytes'] < len(payload)
+    assert stats['compress'] > 0 and stats['send'] > 0
+
+
+def test_configure_compression_rejects_bad_settings():
+    with pytest.raises(ValueError):
+        vm_sender.configure_compression('brotli')
+    with pytest.raises(ValueError):
+        vm_sender.configure_compression('gzip', 12)
+    assert vm_sender.compression_settings() == (None, None)
+
+
+def test_import_url_for_format():
+    assert vm_sender.import_url('http://vm:8428', 'prometheus') == 'http://vm:8428/api/v1/import/prometheus'
+    assert vm_sender.import_url('http://vm:8428/api/v1/import/prometheus', 'jsonl') == 'http://vm:8428/api/v1/import'
+    assert vm_sender.import_url('http://vm:8428/api/v1/import/', 'prometheus') == 'http://vm:8428/api/v1/import/prometheus'
+    assert vm_sender.import_url('http://a:8480/insert/0/prometheus, http://b:8480/insert/0/prometheus/api/v1/import/prometheus',
+                                'jsonl') == 'http://a:8480/insert/0/prometheus/api/v1/import,http://b:8480/insert/0/prometheus/api/v1/import'
+    with pytest.raises(ValueError):
+        vm_sender.import_url(' , ', 'prometheus')
+
+
+def test_uploader_sends_in_background(vm_server):
+    server, url = vm_server
+    server.release.clear()
+    uploader = BatchUploader(url, threads=1, queue_depth=2)
+
+    # VM still holds the first request: submit() returns without waiting for it
+    assert uploader.submit([b'm 1 1000\n'], 1)
+    assert uploader.submit([b'm 2 1000\n'], 1)
+    assert uploader.metrics_sent == 0
+
+    server.release.set()
+    assert uploader.close()
+    assert uploader.metrics_sent == 2
+    assert uploader.batches_sent == 2
+    assert sorted(server.bodies) == [b'm 1 1000\n', b'm 2 1000\n']
+
+
+def test_uploader_stops_after_failure(vm_server):
+    server, url = vm_server
+    uploader = BatchUploader(url, threads=0)
+    assert uploader.submit([b'm 1 1000\n'], 1)
+    assert not uploader.submit([b'bad'], 1)
+    assert not uploader.submit([b'm 2 1000\n'], 1)
+    assert not uploader.close()
+    assert uploader.metrics_sent == 1
+    assert len(server.bodies) == 2
+
+
+def test_uploader_batches_by_bytes_in_reused_buffers(vm_server):
+    server, url = vm_server
+    chunks = [(b'm{a="%d"} 1 1000\n' % n, 1) for n in range(10)]
+    uploader = BatchUploader(url, threads=0)
+    buffer = uploader.get_buffer()
+    uploader._free_buffers.put(buffer)
+
+    assert uploader.upload(iter(chunks), batch_size=100, batch_bytes=32)
+    assert uploader.close()
+    assert uploader.metrics_sent == 10
+    # Two 16-byte lines per batch, one buffer reused for every batch
+    assert len(server.bodies) == 5
+    assert b''.join(server.bodies) == b''.join(payload for payload, _ in chunks)
+    assert uploader.get_buffer() is buffer
+
+
+def test_uploader_streams_one_chunked_request(vm_server):
+    server, url = vm_server
+    chunks = [(b'm{a="%d"} 1 1000\n' % n, 1) for n in range(100)]
+    vm_sender.configure_compression('gzip')
+    try:
+        uploader = BatchUploader(url, threads=0)
+        assert uploader.upload_stream(iter(chunks))
+    finally:
+        vm_sender.configure_compression('none')
+
+    assert uploader.metrics_sent == 100
+    assert server.encodings == ['gzip']
+    assert server.bodies == [b''.join(payload for payload, _ in chunks)]
+
+
+def test_retry_after_server_error(vm_server, monkeypatch):
+    server, url = vm_server
+    monkeypatch.setattr(vm_sender, 'VM_RETRY_BACKOFF', 0.01)
+    server.unavailable = 2
+    before = vm_sender.get_send_stats()
+    assert send_batch_to_vm([b'm 1 1000\n'], url)
+    assert vm_sender.get_send_stats()['retries'] - before['retries'] == 2
+    assert len(server.bodies) == 3
+
+    # Other 4xx are data errors: no retry
+    assert not send_batch_to_vm([b'bad'], url)
+    assert len(server.bodies) == 4
+
+
+def test_uploader_confirms_marks_in_order(vm_server):
+    server, url = vm_server
+    confirmed = []
+    uploader = BatchUploader(url, threads=3, queue_depth=3,
+                             on_sent=lambda mark, metrics: confirmed.append((mark, metrics)))
+    for n in range(10):
+        assert uploader.submit([b'm %d 1000\n' % n], 2, mark=n)
+    assert uploader.close()
+
+    marks = [mark for mark, _ in confirmed]
+    assert marks == sorted(marks) and marks[-1] == 9
+    assert confirmed[-1][1] == 20
+
+
+def test_requests_go_through_ingest_controller(vm_server, monkeypatch):
+    server, url = vm_server
+    monkeypatch.setattr(vm_sender, 'VM_RETRY_BACKOFF', 0.01)
+    controller = IngestController(max_uploads=4, batch_bytes=64, initial_uploads=4, interval=0,
+                                  min_batch_bytes=16)
+    vm_sender.set_ingest_controller(controller)
+    try:
+        server.unavailable = 1
+        chunks = [(b'm{a="%d"} 1 1000\n' % n, 1) for n in range(8)]
+        uploader = BatchUploader(url, threads=0)
+        assert uploader.upload(iter(chunks), batch_size=100, batch_bytes=64)
+    finally:
+        vm_sender.set_ingest_controller(None)
+
+    state = controller.snapshot()
+    assert state['errors'] == 1 and state['in_flight'] == 0
+    # 503 halves the batch: 64 -> 32 bytes, the rest goes two 16-byte lines per request
+    assert state['batch_bytes'] == 32
+    assert [len(body) for body in server.bodies] == [64, 64, 32, 32]
+
+
+def test_round_robin_across_endpoints(vm_shards):
+    servers, urls = vm_shards
+    for n in range(6):
+        assert send_batch_to_vm([b'm %d 1000\n' % n], urls)
+    assert [len(server.bodies) for server in servers] == [2, 2, 2]
+
+
+def test_sn_sharding_keeps_array_on_one_endpoint(vm_shards):
+    servers, urls = vm_shards
+    uploader = BatchUploader(urls, threads=2, shard_key='2102355TJUFSQ4100015')
+    for n in range(6):
+        assert uploader.submit([b'm %d 1000\n' % n], 1)
+    assert uploader.close()
+    assert sorted(len(server.bodies) for server in servers) == [0, 0, 6]
+
+    # Rendezvous hashing: the key keeps its endpoint, and many keys use every endpoint
+    endpoints = vm_sender.parse_endpoints(urls)
+    assert vm_sender.endpoint_order(urls, 'SN1') == vm_sender.endpoint_order(urls, 'SN1')
+    assert {vm_sender.endpoint_order(urls, f'SN{n}')[0] for n in range(50)} == set(endpoints)
+    # A removed endpoint only moves its own keys
+    for n in range(50):
+        order = vm_sender.endpoint_order(urls, f'SN{n}')
+        if order[0] != endpoints[2]:
+            assert vm_sender.endpoint_order(','.join(endpoints[:2]), f'SN{n}')[0] == order[0]
+
+
+def test_failover_skips_unhealthy_endpoint(vm_shards):
+    servers, urls = vm_shards
+    servers[1].shutdown()
+    servers[1].server_close()
+    servers[2].unavailable = 100
+
+    for n in range(6):
+        assert send_batch_to_vm([b'm %d 1000\n' % n], urls, shard_key='SN')
+        assert send_batch_to_vm([b'm %d 1000\n' % n], urls)
+    assert len(servers[0].bodies) == 12
+
+    # Each failed endpoint was tried once, then left alone for the cooldown
+    stats = vm_sender.get_endpoint_stats()
+    endpoints = vm_sender.parse_endpoints(urls)
+    assert stats[endpoints[0]]['up'] and stats[endpoints[0]]['requests'] == 12
+    assert not stats[endpoints[1]]['up'] and stats[endpoints[1]]['requests'] == 1
+    assert not stats[endpoints[2]]['up'] and len(servers[2].bodies) == 1
+
+
+def test_new_session_after_fork(monkeypatch):
+    session = get_session()
+    assert get_session() is session
+    monkeypatch.setattr(vm_sender, '_session_pid', -1)
+    assert get_session() is not session
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
@@ -9,6 +9,7 @@ Batch Import Script для массового импорта Huawei Performance
 Использование:
     python3 batch_import.py /path/to/logs/
     python3 batch_import.py /path/to/logs/ --skip-existing
+    python3 batch_import.py /path/to/logs/ --ledger import_ledger.jsonl
     python3 batch_import.py /path/to/logs/ --dry-run
 """
 
@@ -240,7 +241,13 @@ def extract_perf_zip_from_7z(archive_path: Path, temp_dir: Path, logger: logging
         return None
 
 
-def run_streaming_pipeline(zip_path: Path, vm_url: str, logger: logging.Logger) -> Tuple[bool, str, int]:
+def run_streaming_pipeline(
+    zip_path: Path,
+    vm_url: str,
+    logger: logging.Logger,
+    ledger: Optional[str] = None,
+    force: bool = False
+) -> Tuple[bool, str, int]:
     """
     Запускает huawei_streaming_pipeline.py через subprocess.
     
@@ -248,6 +255,8 @@ def run_streaming_pipeline(zip_path: Path, vm_url: str, logger: logging.Logger)
         zip_path: Путь к ZIP архиву
         vm_url: URL VictoriaMetrics
         logger: Logger для вывода
+        ledger: Журнал импортов - уже импортированные .tgz пропускаются
+        force: Импортировать заново файлы из журнала
         
     Returns:
         Tuple[успех, логи, количество метрик]
@@ -270,6 +279,10 @@ def run_streaming_pipeline(zip_path: Path, vm_url: str, logger: logging.Logger)
         "--vm-url", f"{vm_url}/api/v1/import/prometheus",
         "--monitor"
     ]
+    if ledger:
+        cmd += ["--ledger", ledger]
+        if force:
+            cmd.append("--force")
     
     logger.info(f"Запуск: {' '.join(cmd)}")
     
@@ -357,7 +370,9 @@ def process_archive(
     vm_client: Optional[VictoriaMetricsClient],
     skip_existing: bool,
     dry_run: bool,
-    logger: logging.Logger
+    logger: logging.Logger,
+    ledger: Optional[str] = None,
+    force: bool = False
 ) -> ImportResult:
     """
     Обработка одного архива.
@@ -376,6 +391,8 @@ def process_archive(
         skip_existing: Пропускать если данные уже есть в VM
         dry_run: Режим без реального импорта
         logger: Logger
+        ledger: Журнал импортов (пропуск уже импортированных .tgz по содержимому)
+        force: Импортировать заново файлы из журнала
         
     Returns:
         ImportResult с результатами обработки
@@ -458,7 +475,7 @@ def process_archive(
         
         # Шаг 5: Запуск streaming pipeline
         logger.info("🚀 Запуск streaming pipeline...")
-        success, output, metrics_sent = run_streaming_pipeline(perf_zip_path, vm_url, logger)
+        success, output, metrics_sent = run_streaming_pipeline(perf_zip_path, vm_url, logger, ledger, force)
         result.metrics_sent = metrics_sent
         
         if not success:
@@ -598,6 +615,9 @@ def main():
   # С пропуском уже импортированных
   %(prog)s /data/vtb_hc/perf/ --skip-existing
   
+  # Повторно импортировать файлы, уже записанные в журнале импортов
+  %(prog)s /data/vtb_hc/perf/ --force
+  
   # Dry-run (без реального импорта)
   %(prog)s /data/vtb_hc/perf/ --dry-run
   
@@ -624,6 +644,18 @@ def main():
         action='store_true',
         help='Пропускать архивы, данные которых уже есть в VM'
     )
+    parser.add_argument(
+        '--ledger',
+        type=str,
+        default=os.getenv("IMPORT_LEDGER", "import_ledger.jsonl"),
+        help='Журнал импортов: .tgz, уже импортированные в этот VM, пропускаются по содержимому; '
+             'пустая строка - выключить (default: $IMPORT_LEDGER или import_ledger.jsonl)'
+    )
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='Импортировать заново файлы, уже записанные в журнале импортов'
+    )
     parser.add_argument(
         '--dry-run',
         action='store_true',
@@ -647,6 +679,7 @@ def main():
     logger.info(f"Log directory: {args.log_dir}")
     logger.info(f"VM URL: {args.vm_url}")
     logger.info(f"Skip existing: {args.skip_existing}")
+    logger.info(f"Ledger: {args.ledger or 'disabled'}{' (force)' if args.force else ''}")
     logger.info(f"Dry-run: {args.dry_run}")
     logger.info("="*80)
     logger.info("")
@@ -722,7 +755,9 @@ def main():
                 vm_client,
                 args.skip_existing,
                 args.dry_run,
-                logger
+                logger,
+                ledger=str(Path(args.ledger).resolve()) if args.ledger else None,
+                force=args.force
             )
             
             stats.results.append(result)
@@ -4,12 +4,21 @@ VictoriaMetrics Client для получения performance метрик
 Модуль для запросов к VictoriaMetrics API и расчета статистик производительности.
 """
 
+import sys
 import requests
 from datetime import datetime, timedelta
+from pathlib import Path
 from typing import Dict, Any, Optional, List, Tuple
 import logging
 import numpy as np
 
+# Общий пул keep-alive соединений к VM (parsers/vm_sender.py)
+try:
+    from parsers.vm_sender import get_session, vm_timeout
+except ImportError:
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+    from parsers.vm_sender import get_session, vm_timeout
+
 logger = logging.getLogger(__name__)
 
 
@@ -39,7 +48,7 @@ class VictoriaMetricsClient:
         """
         try:
             url = f"{self.vm_url}{endpoint}"
-            response = requests.get(url, params=params, timeout=self.timeout)
+            response = get_session().get(url, params=params, timeout=vm_timeout(self.timeout))
             response.raise_for_status()
             
             data = response.json()
@@ -189,7 +198,7 @@ class VictoriaMetricsClient:
             True если VM доступна
         """
         try:
-            response = requests.get(f"{self.vm_url}/health", timeout=5)
+            response = get_session().get(f"{self.vm_url}/health", timeout=vm_timeout(5))
             return response.status_code == 200
         except:
             return False
@@ -7,7 +7,7 @@ const GRAFANA_URL = import.meta.env.VITE_GRAFANA_URL || 'http://localhost:3000'
 
 interface CSVJob {
   job_id: string
-  target: 'csv' | 'perfmonkey'
+  target: string  // 'csv', 'perfmonkey' или комбинированные targets через запятую
   target_label: string
   serial_numbers: string[]
   status: string
@@ -4,7 +4,7 @@ import './App.css'
 
 const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000'
 
-type ProcessingTarget = 'grafana' | 'csv' | 'perfmonkey'
+type ProcessingTarget = 'grafana' | 'csv' | 'perfmonkey' | 'all'
 // pending - ждёт старта
 // uploading - загружается на сервер
 // queued - загружен, ждёт обработки в очереди
@@ -112,7 +112,7 @@ function Upload() {
         }
 
         // Для CSV targets получаем список файлов
-        if ((target === 'csv' || target === 'perfmonkey') && (status.status === 'running' || status.status === 'done')) {
+        if ((target === 'csv' || target === 'perfmonkey' || target === 'all') && (status.status === 'running' || status.status === 'done')) {
           try {
             const filesResponse = await fetch(`${API_URL}/api/files/${jobId}`)
             if (filesResponse.ok) {
@@ -478,6 +478,13 @@ function Upload() {
               <FileText size={16} />
               CSV Perfmonkey
             </button>
+            <button
+              className={`target-option ${target === 'all' ? 'active' : ''}`}
+              onClick={() => setTarget('all')}
+            >
+              <Files size={16} />
+              All (single pass)
+            </button>
           </div>
 
           <button onClick={startProcessing} className="start-button">